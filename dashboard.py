@@ -1,72 +1,204 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import os
+import datetime
+from utils.aggregator import query
+from utils.columnar import ColumnStore, counting_frame
+from utils.journal import JOURNAL_HEADER
+from utils.rollup import RollupStore
+from utils.sketch import SketchReader
 
 # ---- 載入並清理資料 ----
-@st.cache_data(ttl=10) 
-def load_data(filename):
-    df = pd.read_csv(filename)
-    df["In Time"] = pd.to_datetime(df["In Time"], errors="coerce")
-    df["Out Time"] = pd.to_datetime(df["Out Time"], errors="coerce")
+@st.cache_data(ttl=10)
+def load_data(filename, start=None, end=None):
+    # 欄式儲存（.col 目錄）只讀取選定日期範圍
+    if ColumnStore.is_store(filename):
+        df = counting_frame(ColumnStore(filename), start, end)
+    else:
+        df = pd.read_csv(filename)
+    df["In Time"] = pd.to_datetime(df["In Time"], errors="coerce", format="ISO8601")
+    df["Out Time"] = pd.to_datetime(df["Out Time"], errors="coerce", format="ISO8601")
     df["Stay Duration"] = pd.to_numeric(df["Stay Duration"], errors="coerce")
     valid = df["Stay Duration"].notna() & (df["Stay Duration"] >= 0)
     return df[valid].reset_index(drop=True)
 
+# 事件日誌目錄：只讀取預先彙總的每分鐘資料，以及上次刷新後新增的事件
+@st.cache_resource
+def load_rollups(directory):
+    return RollupStore(directory)
+
+# 停留時間串流摘要（每小時、每支攝影機），任意日期範圍皆為常數時間查詢
+@st.cache_resource
+def load_sketches(directory):
+    return SketchReader(directory)
+
+# 彙總服務：各螢幕即時統計，服務未啟動時回傳 None
+@st.cache_data(ttl=5)
+def load_fleet(url, window, step, engaged_sec):
+    try:
+        return (query(url, "/fleet", window=window, engaged=engaged_sec),
+                query(url, "/screens"),
+                query(url, "/series", window=window, step=step))
+    except OSError:
+        return None
+
 st.title("廣告機人流統計數據")
 
 # ---- 側邊欄控制 ----
 st.sidebar.header("設定")
-csv_file = st.sidebar.text_input("CSV 檔案路徑", value="utils/data/logs/counting_data.csv")
-interval = st.sidebar.selectbox("時間顯示單位", ["1分鐘","15分鐘", "30分鐘", "1小時", "1天"])
+csv_file = st.sidebar.text_input("CSV 檔案或事件日誌目錄路徑", value="utils/data/logs/journal")
+use_rollups = os.path.isdir(csv_file) and not ColumnStore.is_store(csv_file)
+# 每分鐘彙總無法細分到秒；CSV 與欄式儲存的事件時間精確到毫秒
+intervals = ["1分鐘","15分鐘", "30分鐘", "1小時", "1天"]
+if not use_rollups:
+    intervals = ["10秒"] + intervals
+interval = st.sidebar.selectbox("時間顯示單位", intervals, index=intervals.index("1分鐘"))
 engaged_sec = st.sidebar.slider("有效停留最少秒數", min_value=0.5, max_value=10.0, value=2.0, step=0.5)
 
 interval_map = {
-    "1分鐘": "1T",
-    "15分鐘": "15T",
-    "30分鐘": "30T",
-    "小時": "H",
-    "天": "D"
+    "10秒": "10s",
+    "1分鐘": "1min",
+    "15分鐘": "15min",
+    "30分鐘": "30min",
+    "1小時": "h",
+    "1天": "D"
 }
 freq = interval_map[interval]
 
-df = load_data(csv_file)
+zone = ""
+if use_rollups:
+    store = load_rollups(csv_file)
+    store.refresh()
+    # 事件日誌記錄了多個區域／穿越線時可切換
+    zones = store.zones()
+    if len(zones) > 1:
+        zone = st.sidebar.selectbox("區域", zones, format_func=lambda z: z or "主要計數區域")
+elif ColumnStore.is_store(csv_file):
+    today = datetime.date.today()
+    date_range = st.sidebar.date_input("日期範圍", value=(today - datetime.timedelta(days=7), today))
+    start = pd.Timestamp(date_range[0])
+    end = pd.Timestamp(date_range[-1]) + pd.Timedelta(days=1)
+    df = load_data(csv_file, start, end)
+else:
+    df = load_data(csv_file)
+is_line = use_rollups and zone in store.lines
 
 # ---- 計算主要指標 ----
 st.subheader("指標")
 
-total_visitors = len(df)
-avg_stay = df["Stay Duration"].mean()
-median_stay = df["Stay Duration"].median()
-engaged = df[df["Stay Duration"] >= engaged_sec]
-percent_engaged = (len(engaged) / total_visitors * 100) if total_visitors else 0
+if is_line:
+    stats = store.summary(engaged_sec, zone=zone)
+    col1, col2 = st.columns(2)
+    col1.metric("➡️ 正向穿越", stats["entries"])
+    col2.metric("⬅️ 反向穿越", stats["visits"])
+elif use_rollups:
+    stats = store.summary(engaged_sec, zone=zone)
+    total_visitors = stats["visits"]
+    avg_stay = stats["mean"]
+    median_stay = stats["median"]
+    percent_engaged = stats["engaged_pct"]
+else:
+    total_visitors = len(df)
+    avg_stay = df["Stay Duration"].mean()
+    median_stay = df["Stay Duration"].median()
+    engaged = df[df["Stay Duration"] >= engaged_sec]
+    percent_engaged = (len(engaged) / total_visitors * 100) if total_visitors else 0
+
+if not is_line:
+    col1, col2, col3, col4 = st.columns([1.5, 2, 2, 2.5])
+    col1.metric("👣 人流總數", total_visitors)
+    col2.metric("⏱ 平均停留時間（秒）", f"{avg_stay:.2f}" if not np.isnan(avg_stay) else "-")
+    col3.metric("🧍 停留時間中位數（秒）", f"{median_stay:.2f}" if not np.isnan(median_stay) else "-")
+    col4.metric(f"👍 有效停留比率（≥{engaged_sec}秒）", f"{percent_engaged:.1f}%")
+
+# ---- 停留時間分佈（串流摘要） ----
+sketch_dir = st.sidebar.text_input("停留時間摘要目錄", value="utils/data/logs/sketches")
+if os.path.isdir(sketch_dir):
+    sketches = load_sketches(sketch_dir)
+    sketches.refresh()
+    camera = st.sidebar.selectbox("攝影機", ["全部"] + sorted(sketches.cameras))
+    today = datetime.date.today()
+    sketch_range = st.sidebar.date_input("摘要日期範圍", value=(today - datetime.timedelta(days=30), today))
+    sketch_stats = sketches.summary(
+        engaged_sec,
+        datetime.datetime.combine(sketch_range[0], datetime.time()),
+        datetime.datetime.combine(sketch_range[-1], datetime.time()) + datetime.timedelta(days=1),
+        None if camera == "全部" else camera,
+    )
+
+    st.subheader("停留時間分佈（串流摘要）")
+    fmt = lambda v: f"{v:.2f}" if not np.isnan(v) else "-"
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("👣 離開人數", sketch_stats["visits"])
+    col2.metric("中位數（秒）", fmt(sketch_stats["median"]))
+    col3.metric("P90（秒）", fmt(sketch_stats["p90"]))
+    col4.metric("P95（秒）", fmt(sketch_stats["p95"]))
+    col5.metric(f"≥{engaged_sec}秒", f"{sketch_stats['engaged_pct']:.1f}%")
 
-col1, col2, col3, col4 = st.columns([1.5, 2, 2, 2.5]) 
-col1.metric("👣 人流總數", total_visitors)
-col2.metric("⏱ 平均停留時間（秒）", f"{avg_stay:.2f}" if not np.isnan(avg_stay) else "-")
-col3.metric("🧍 停留時間中位數（秒）", f"{median_stay:.2f}" if not np.isnan(median_stay) else "-")
-col4.metric(f"👍 有效停留比率（≥{engaged_sec}秒）", f"{percent_engaged:.1f}%")
+# ---- 多螢幕即時彙總 ----
+agg_url = st.sidebar.text_input("彙總服務網址", value="http://127.0.0.1:9110")
+fleet_windows = {"5分鐘": (300, 10), "15分鐘": (900, 30), "1小時": (3600, 60)}
+fleet_label = st.sidebar.selectbox("彙總時間範圍", list(fleet_windows), index=2)
+fleet = load_fleet(agg_url, *fleet_windows[fleet_label], engaged_sec) if agg_url else None
+if fleet is None:
+    st.sidebar.caption("彙總服務未連線")
+else:
+    fleet_stats, cameras, series = fleet
+    st.subheader(f"全部螢幕即時彙總（最近{fleet_label}）")
+    fmt = lambda v: f"{v:.2f}" if v is not None else "-"
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("👣 進入人數", fleet_stats["fleet"]["entries"])
+    col2.metric("⏱ 平均停留（秒）", fmt(fleet_stats["fleet"]["mean"]))
+    col3.metric("🧍 中位數（秒）", fmt(fleet_stats["fleet"]["median"]))
+    col4.metric(f"👍 ≥{engaged_sec}秒", f"{fleet_stats['fleet']['engaged_pct']:.1f}%")
+    per_screen = pd.DataFrame.from_dict(fleet_stats["screens"], orient="index")
+    if len(per_screen):
+        last_seen = pd.DataFrame(cameras).groupby("screen")["last_event_age"].min()
+        per_screen["最後事件（秒前）"] = last_seen
+        st.dataframe(per_screen[["entries", "visits", "mean", "median", "p90", "engaged_pct", "最後事件（秒前）"]]
+                     .rename(columns={"entries": "進入", "visits": "離開", "mean": "平均停留", "median": "中位數",
+                                      "p90": "P90", "engaged_pct": "有效停留%"}))
+    if series["time_ms"]:
+        # 事件以本地時間記錄，圖表時間軸沿用本地時間
+        times = [datetime.datetime.fromtimestamp(t / 1000) for t in series["time_ms"]]
+        st.bar_chart(pd.DataFrame({"進入": series["entries"], "離開": series["exits"]}, index=times),
+                     use_container_width=True)
 
 # ---- 區間分組資料 ----
-df_time = df.set_index("In Time")
-footfall = df_time["Move In"].resample(freq).count()
-avg_stays = df_time["Stay Duration"].resample(freq).mean()
+if use_rollups:
+    buckets = store.frame(freq, zone=zone)
+    footfall = buckets["entries"].rename("Move In")
+    avg_stays = (buckets["stay_sum"] / buckets["exits"].replace(0, np.nan)).rename("Stay Duration")
+else:
+    df_time = df.set_index("In Time")
+    footfall = df_time["Move In"].resample(freq).count()
+    avg_stays = df_time["Stay Duration"].resample(freq).mean()
 
 # ---- 圖表 ----
 
-st.subheader(f"人流量（以{interval}為單位）")
-st.bar_chart(footfall, use_container_width=True)
+if is_line:
+    st.subheader(f"穿越人次（以{interval}為單位）")
+    st.bar_chart(pd.DataFrame({"正向": buckets["entries"], "反向": buckets["exits"]}), use_container_width=True)
+else:
+    st.subheader(f"人流量（以{interval}為單位）")
+    st.bar_chart(footfall, use_container_width=True)
 
-st.subheader(f"平均停留時間（以{interval}為單位）")
-st.line_chart(avg_stays, use_container_width=True)
+    st.subheader(f"平均停留時間（以{interval}為單位）")
+    st.line_chart(avg_stays, use_container_width=True)
 
 # ---- 原始資料預覽 ----
 with st.expander("顯示原始資料"):
-    st.dataframe(df)
+    if use_rollups:
+        st.dataframe(pd.DataFrame(list(store.tail), columns=JOURNAL_HEADER))
+    else:
+        st.dataframe(df)
 
 # ---- 異常提示 ----
-if (df["Stay Duration"] < 0).any():
-    st.warning("⚠️ 檢測到負值停留時間（已排除）")
-if df.isnull().any().any():
-    st.warning("⚠️ 檢測到缺失或無效資料（已排除）")
+if not use_rollups:
+    if (df["Stay Duration"] < 0).any():
+        st.warning("⚠️ 檢測到負值停留時間（已排除）")
+    if df.isnull().any().any():
+        st.warning("⚠️ 檢測到缺失或無效資料（已排除）")
 
 st.caption("由 Streamlit 提供支援。可在側邊欄調整檔案路徑及統計區間。")
@@ -6,12 +6,31 @@ import logging
 import imutils
 import time
 import json
-import csv
-from imutils.video import VideoStream, FPS
-from itertools import zip_longest
+import os
+import tempfile
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from imutils.video import FPS
 import math
 import norfair
 from norfair import Detection, Tracker
+from utils.journal import EventJournal, export_counting_csv
+from utils.pipeline import Pipeline, DROP_POLICIES
+from utils.region import validate_zones
+from utils.scheduler import DetectionScheduler
+from utils.motion import MotionGate
+from utils.capture import StreamReader
+from utils.timing import FrameClock, VideoClock
+from utils.frame_ring import FrameRing
+from utils.control import ControlServer
+from utils.sketch import SketchWriter
+from utils.telemetry import TelemetryWriter
+from utils.inference import OPENCV_BACKENDS, OPENCV_TARGETS, load_detector
+from utils.recorder import VideoRecorder
+from utils.aggregator import EventPublisher
+from utils.counting import RegionCounter, decode_detections, draw_overlay
+from utils.metrics import MetricsServer, install_stack_dump_signal, log_line
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format="[INFO] %(message)s")
@@ -24,13 +43,31 @@ with open("utils/config.json", "r") as f:
 def parse_arguments():
     ap = argparse.ArgumentParser()
     ap.add_argument("-p", "--prototxt", required=False,
-                    help="(unused) kept for backward compatibility")
+                    help="path to the Caffe 'deploy' prototxt file (required by the opencv backend)")
     ap.add_argument("-m", "--model", required=True,
-                    help="path to Caffe pre-trained model (.caffemodel)")
+                    help="path to the pre-trained model (.caffemodel, or .onnx with --backend onnx)")
+    ap.add_argument("--backend", choices=("opencv", "onnx"), default=config.get("backend", "opencv"),
+                    help="inference backend: OpenCV DNN or ONNX Runtime (CPU)")
+    ap.add_argument("--dnn-backend", choices=sorted(OPENCV_BACKENDS), default=config.get("dnn_backend", "default"),
+                    help="OpenCV DNN computation backend")
+    ap.add_argument("--dnn-target", choices=sorted(OPENCV_TARGETS), default=config.get("dnn_target", "cpu"),
+                    help="OpenCV DNN target device")
+    ap.add_argument("--dnn-threads", type=int, default=config.get("dnn_threads"),
+                    help="threads used by the inference backend (default: library default)")
+    ap.add_argument("--input-size", type=int, default=config.get("input_size", 300),
+                    help="network input size (MobileNet-SSD is trained at 300); 0 feeds frames at full size")
     ap.add_argument("-i", "--input", type=str,
                     help="path to optional input video file")
+    ap.add_argument("-s", "--sources", nargs="+", default=config.get("sources"),
+                    help="several stream URLs / video files sharing one model (multi-camera mode)")
     ap.add_argument("-o", "--output", type=str,
-                    help="path to optional output video file")
+                    help="path to optional output video file (annotated and encoded on a background thread)")
+    ap.add_argument("--output-fps", type=float, default=None,
+                    help="frame rate of the output video (default: the source rate)")
+    ap.add_argument("--output-width", type=int, default=None,
+                    help="width of the output video in pixels (default: the processed frame width)")
+    ap.add_argument("--output-segment", type=float, default=None,
+                    help="start a new output file every N seconds of capture time")
     ap.add_argument("-c", "--confidence", type=float, default=0.4,
                     help="minimum probability to filter weak detections")
     ap.add_argument("--rect-x", type=int, default=None,
@@ -43,214 +80,789 @@ def parse_arguments():
                     help="height of counting rectangle")
     ap.add_argument("--tilt-angle", type=float, default=0,
                     help="Camera tilt angle in degrees (positive = top tilts away from viewer)")
+    ap.add_argument("--pipeline", action="store_true",
+                    help="run capture, inference, tracking and output on separate threads")
+    ap.add_argument("--queue-size", type=int, default=config.get("queue_size", 4),
+                    help="size of the bounded queues between pipeline stages")
+    ap.add_argument("--drop-policy", choices=DROP_POLICIES, default=config.get("drop_policy", "drop-oldest"),
+                    help="what to do with live frames when inference falls behind (files always block)")
+    ap.add_argument("--adaptive-stride", action="store_true",
+                    help="run the DNN every N frames and let the tracker predict in between")
+    ap.add_argument("--max-stride", type=int, default=config.get("max_stride", 5),
+                    help="largest detection stride used while nobody is near the counting region")
+    ap.add_argument("--stride-report", type=str, default=None,
+                    help="run --input with every-frame and adaptive detection and write a JSON comparison")
+    ap.add_argument("--roi", action="store_true",
+                    help="run the DNN only on a padded box around the counting region")
+    ap.add_argument("--roi-padding", type=int, default=config.get("roi_padding", 40),
+                    help="pixels added around the counting region's bounding box for --roi")
+    ap.add_argument("--roi-full-every", type=int, default=config.get("roi_full_every", 0),
+                    help="with --roi, run a full-frame detection every N detections (0 = never)")
+    ap.add_argument("--motion-gate", action="store_true",
+                    help="skip detection and tracking while nothing moves near the region and no track is alive")
+    ap.add_argument("--motion-threshold", type=float, default=config.get("motion_threshold", 0.002),
+                    help="share of changed pixels near the region that counts as motion")
+    ap.add_argument("--frame-ring", type=str, default=config.get("frame_ring"),
+                    help="publish resized frames to this shared-memory ring for the region tweak tools")
+    ap.add_argument("--headless", action="store_true",
+                    help="no GUI windows; overlays are only drawn when --output is set")
+    ap.add_argument("--segments", type=int, default=1,
+                    help="split --input into this many time segments processed in parallel (implies --headless)")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="worker processes for --segments (default: CPU count)")
+    ap.add_argument("--segment-overlap", type=float, default=config.get("segment_overlap", 10.0),
+                    help="seconds of video re-read around each segment cut to stitch tracks")
+    ap.add_argument("--video-start", type=str, default=None,
+                    help="wall-clock start of the --input recording (ISO format) for headless timestamps")
+    ap.add_argument("--control-port", type=int, default=config.get("control_port"),
+                    help="accept live region updates (GET/POST /region) on this local port")
+    ap.add_argument("--metrics-port", type=int, default=config.get("metrics_port"),
+                    help="serve Prometheus metrics, /stacks and /profile on this local port")
+    ap.add_argument("--telemetry", action="store_true",
+                    help="record every detection and track estimate to compressed chunks (see \"telemetry\" in config.json)")
+    ap.add_argument("--screen", type=str, default=config.get("screen") or socket.gethostname(),
+                    help="name of this screen in the fleet-wide aggregation (default: host name)")
+    ap.add_argument("--aggregator", type=str, default=None,
+                    help="send every event to the aggregation service at HOST:PORT over UDP")
+    ap.add_argument("--event-spool", type=str, default=None,
+                    help="append every event to hourly spool files in this directory for the aggregation service")
     return vars(ap.parse_args())
 
-def log_data(move_in, in_time, move_out, out_time, stay_duration):
-    """Log counting data (including precomputed stay durations) to CSV."""
-    data = [move_in, in_time, move_out, out_time, stay_duration]
-    export_data = zip_longest(*data, fillvalue="")
-    with open("utils/data/logs/counting_data.csv", "w", newline="") as myfile:
-        wr = csv.writer(myfile, quoting=csv.QUOTE_ALL)
-        if myfile.tell() == 0:
-            wr.writerow(("Move In", "In Time", "Move Out", "Out Time", "Stay Duration"))
-        for row in export_data:
-            wr.writerow(row)
-
-def keystone_polygon(x, y, w, h, tilt_deg, frame_width):
-    tilt_rad = math.radians(tilt_deg)
-    max_shift = w // 3
-    shift = int(max_shift * math.sin(abs(tilt_rad)))
-    if tilt_deg > 0:
-        pts = np.array([
-            [x + shift, y],
-            [x + w - shift, y],
-            [x + w, y + h],
-            [x, y + h]
-        ])
-    else:
-        pts = np.array([
-            [x, y],
-            [x + w, y],
-            [x + w - shift, y + h],
-            [x + shift, y + h]
-        ])
-    pts[:, 0] = np.clip(pts[:, 0], 0, frame_width - 1)
-    return pts
-
-def point_in_polygon(point, polygon):
-    x, y = point
-    poly = polygon.tolist() if isinstance(polygon, np.ndarray) else polygon
-    inside = False
-    px1, py1 = poly[0]
-    for i in range(len(poly) + 1):
-        px2, py2 = poly[i % len(poly)]
-        if y > min(py1, py2):
-            if y <= max(py1, py2):
-                if x <= max(px1, px2):
-                    if py1 != py2:
-                        xinters = (y - py1) * (px2 - px1) / (py2 - py1 + 1e-8) + px1
-                    if px1 == px2 or x <= xinters:
-                        inside = not inside
-        px1, py1 = px2, py2
-    return inside
-
-def people_counter():
-    args = parse_arguments()
-    net = cv2.dnn.readNetFromCaffe(args["prototxt"], args["model"])
-
-    # Start video source
-    if not args.get("input", False):
-        vs = VideoStream(config["url"]).start()
-        time.sleep(2.0)
-        feed_fps = config.get("feed_fps", 30)
+class FramePacket:
+    """A frame travelling through the capture -> inference -> tracking -> output stages."""
+    def __init__(self, camera, index, frame, captured_at=None, captured_mono=None, frame_time=None):
+        self.camera = camera
+        self.index = index
+        self.frame = frame
+        self.captured_at = captured_at or datetime.datetime.now()
+        self.captured_mono = time.monotonic() if captured_mono is None else captured_mono
+        # Seconds on the source's own timeline that stay durations are measured in
+        self.frame_time = self.captured_mono if frame_time is None else frame_time
+        self.detections = None
+        self.period = 1
+        self.gated = False
+        self.points = []
+        self.totals = (0, 0)
+
+def detect_people(net, frame, confidence):
+    """Run MobileNet-SSD on a frame and return Norfair detections for people."""
+    return detect_people_batch(net, [frame], confidence)[0]
+
+def detect_people_batch(net, frames, confidence, rois=None):
+    """Run batched forwards over several frames; returns detections per frame.
+
+    `net` is a `utils.inference.Detector`. `rois` optionally gives an
+    (x0, y0, x1, y1) crop per frame (None for the whole frame); the network
+    then only sees the crop and the centroids are shifted back to frame
+    coordinates. At the native input size every whole frame shares one
+    N-way forward, and a crop runs at its share of the input size so it
+    costs less than the whole frame.
+    """
+    rois = rois or [None] * len(frames)
+    images, offsets = [], []
+    for frame, roi in zip(frames, rois):
+        if roi is None:
+            images.append(frame)
+            offsets.append((0, 0))
+        else:
+            x0, y0, x1, y1 = roi
+            images.append(frame[y0:y1, x0:x1])
+            offsets.append((x0, y0))
+
+    results = []
+    # Boxes come back relative to each image, whatever size the network ran at
+    for image, offset, rows in zip(images, offsets, net.detect(images, [frame.shape[1::-1] for frame in frames])):
+        H, W = image.shape[:2]
+        centroids, scores, boxes = decode_detections(rows, W, H, confidence)
+        centroids += np.array(offset)
+        boxes += np.array(offset * 2)
+        # The box rides along as data for telemetry
+        results.append([Detection(points=c[None], scores=s[None], data=tuple(box))
+                        for c, s, box in zip(centroids, scores, boxes.tolist())])
+    return results
+
+def video_start(args, path, vs, feed_fps):
+    """Wall-clock time of the first frame of a recording.
+
+    Uses --video-start when given, otherwise assumes the file was last
+    modified when the recording ended.
+    """
+    if args.get("video_start"):
+        return datetime.datetime.fromisoformat(args["video_start"])
+    duration = (vs.get(cv2.CAP_PROP_FRAME_COUNT) or 0) / feed_fps
+    return datetime.datetime.fromtimestamp(os.path.getmtime(path) - duration)
+
+class Camera:
+    """One video source with its own tracker, counting state and outputs."""
+    def __init__(self, name, source, is_file, args, journal_dir=None, sketch_dir=None, telemetry_dir=None,
+                 publish=True):
+        self.name = name
+        self.is_file = is_file
+        # Events are stamped with each frame's capture time; a headless recording
+        # uses video time. Durations use the frame's monotonic time (the media
+        # timestamp for files), never the processing rate.
+        self.capture_clock = FrameClock()
+        self.video_start = None
+        if is_file:
+            self.vs = cv2.VideoCapture(source)
+            self.feed_fps = self.vs.get(cv2.CAP_PROP_FPS) or config.get("feed_fps", 30)
+            if args["headless"]:
+                self.video_start = video_start(args, source, self.vs, self.feed_fps)
+        else:
+            self.vs = StreamReader.from_config(config, source, name).start()
+            self.feed_fps = config.get("feed_fps", 30)
+        journal_cfg = dict(config.get("journal", {}))
+        if journal_dir is not None:
+            journal_cfg["directory"] = journal_dir
+        self.publisher = None
+        if publish:
+            self.publisher = EventPublisher.from_config(config, args["screen"], name, args.get("aggregator"),
+                                                        args.get("event_spool"))
+        self.journal = EventJournal(**journal_cfg, publisher=self.publisher)
+        if sketch_dir is not None:
+            self.sketches = SketchWriter(sketch_dir, name)
+        else:
+            self.sketches = SketchWriter.from_config(config, name)
+        self.telemetry = None
+        if args.get("telemetry"):
+            self.telemetry = TelemetryWriter.from_config(config, name, telemetry_dir)
+        self.tracker = Tracker(distance_function="euclidean", distance_threshold=30)
+        self.counter = RegionCounter(self.journal, self.feed_fps,
+                                     (args["rect_x"], args["rect_y"], args["rect_w"], args["rect_h"]),
+                                     args["tilt_angle"], clock=self.capture_clock, sketches=self.sketches,
+                                     zones=config_zones(name))
+        self.scheduler = DetectionScheduler(args["adaptive_stride"], args["max_stride"])
+        self.roi = args.get("roi", False)
+        self.roi_padding = args.get("roi_padding", 40)
+        self.roi_full_every = args.get("roi_full_every", 0)
+        self.gate = MotionGate(args["motion_threshold"]) if args.get("motion_gate") else None
+        self.ring_name = args.get("frame_ring")
+        self.ring = None
+        if self.ring_name and FrameRing.owner(self.ring_name) is not None:
+            raise SystemExit(f"{name}: frame ring {self.ring_name} is in use by process "
+                             f"{FrameRing.owner(self.ring_name)}; pass another --frame-ring name")
+        self.frames = 0
+        self.frame_age = 0.0
+        self.done = False
+        self.recorder = None
+
+    def read(self, timeout=1.0):
+        """Return (frame, captured_at, captured_mono, frame_time) for the next resized frame, or None.
+
+        `frame_time` is the media time for files and the capture monotonic
+        time for live streams.
+
+        A file is done once it is exhausted; a live stream returns None while
+        no new frame has arrived within `timeout` seconds (e.g. during a
+        reconnect) and keeps going.
+        """
+        if self.is_file:
+            ok, frame = self.vs.read()
+            if not ok:
+                self.done = True
+                return None
+            captured_mono = time.monotonic()
+            # Media time of this frame; some containers do not report it
+            frame_time = self.vs.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if frame_time <= 0 and self.frames:
+                frame_time = self.frames / self.feed_fps
+            if self.video_start is not None:
+                captured_at = self.video_start + datetime.timedelta(seconds=frame_time)
+            else:
+                captured_at = datetime.datetime.now()
+        else:
+            latest = self.vs.read(timeout)
+            if latest is None:
+                return None
+            frame, captured_at, captured_mono = latest
+            frame_time = captured_mono
+        frame = imutils.resize(frame, width=500)
+        if self.counter.polygon is None:
+            H, W = frame.shape[:2]
+            self.counter.set_frame_size(W, H)
+            if self.telemetry is not None:
+                self.telemetry.frame_size = (W, H)
+        return frame, captured_at, captured_mono, frame_time
+
+    def publish(self, frame, index, captured_at):
+        """Share the frame with other processes through the frame ring, if enabled."""
+        if not self.ring_name:
+            return
+        if self.ring is not None and frame.nbytes > self.ring.slot_bytes:
+            # The stream came back at a larger resolution; readers re-attach to the new ring
+            logger.info(f"{self.name}: frame size changed, recreating frame ring {self.ring_name}")
+            self.ring.close()
+            self.ring = None
+        if self.ring is None:
+            self.ring = FrameRing.create(self.ring_name, frame.nbytes, config.get("frame_ring_slots", 4))
+            logger.info(f"{self.name}: publishing frames to shared memory ring {self.ring_name}")
+        self.ring.publish(frame, index, captured_at)
+
+    def detection_roi(self):
+        """Crop for the next detection, or None when it should see the whole frame."""
+        if not self.roi:
+            return None
+        # The scheduler has already counted this forward
+        if self.roi_full_every and (self.scheduler.forwards - 1) % self.roi_full_every == 0:
+            return None
+        return self.counter.region.bounding_box(self.roi_padding)
+
+    def needs_processing(self, frame):
+        """Run the motion gate; False when the frame can skip detection and tracking."""
+        if self.gate is None:
+            return True
+        was_idle = self.gate.idle_for > self.gate.hold
+        roi = self.counter.region.bounding_box(2 * self.roi_padding)
+        active = self.gate.check(frame, roi, tracks_alive=bool(self.tracker.tracked_objects))
+        if active and was_idle:
+            self.scheduler.wake()
+        return active
+
+    def summary(self):
+        summary = self.scheduler.summary()
+        if self.gate is not None:
+            summary.update(self.gate.summary())
+        if self.telemetry is not None:
+            summary.update(self.telemetry.summary())
+        if self.recorder is not None:
+            summary.update(self.recorder.summary())
+        if self.publisher is not None:
+            summary.update(self.publisher.summary())
+        return summary
+
+    def close(self, csv_path):
+        self.journal.close()
+        if self.publisher is not None:
+            self.publisher.close()
+        self.sketches.flush()
+        if self.telemetry is not None:
+            self.telemetry.close()
+        export_counting_csv(self.journal.directory, csv_path)
+        if self.is_file:
+            self.vs.release()
+        else:
+            self.vs.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.ring:
+            self.ring.close()
+
+def config_zones(camera):
+    """Zones of a camera; "zones" in config.json is one list for every camera or a dict of lists by name."""
+    zones = config.get("zones") or []
+    if isinstance(zones, dict):
+        zones = zones.get(camera, [])
+    return zones
+
+def open_cameras(args, log_dir=None):
+    """Build the Camera list for single-source or multi-source mode."""
+    journal_root = config.get("journal", {}).get("directory", "utils/data/logs/journal")
+    sketch_dir = telemetry_dir = None
+    # Runs with their own log directory (the stride report) stay out of the fleet totals
+    publish = log_dir is None
+    if log_dir is not None:
+        journal_root = os.path.join(log_dir, "journal")
+        sketch_dir = os.path.join(log_dir, "sketches")
+        telemetry_dir = os.path.join(log_dir, "telemetry")
+    if args.get("sources"):
+        cameras = []
+        for i, src in enumerate(args["sources"]):
+            src = int(src) if isinstance(src, str) and src.isdigit() else src
+            is_file = isinstance(src, str) and os.path.isfile(src)
+            cam_args = dict(args, frame_ring=f"{args['frame_ring']}_cam{i}") if args.get("frame_ring") else args
+            cameras.append(Camera(f"cam{i}", src, is_file, cam_args,
+                                  journal_dir=os.path.join(journal_root, f"cam{i}"), sketch_dir=sketch_dir,
+                                  telemetry_dir=telemetry_dir, publish=publish))
+    elif args.get("input"):
+        cameras = [Camera("main", args["input"], True, args, journal_dir=journal_root, sketch_dir=sketch_dir,
+                          telemetry_dir=telemetry_dir, publish=publish)]
     else:
-        vs = cv2.VideoCapture(args["input"])
-        feed_fps = vs.get(cv2.CAP_PROP_FPS) or config.get("feed_fps", 30)
-
-    writer = None
-    W = H = None
-
-    tracker = Tracker(distance_function="euclidean", distance_threshold=30)
-
-    class RegionTrackable:
-        def __init__(self, track_id, inside=False, entry_frame=None, entry_timestamp=None):
-            self.track_id = track_id
-            self.inside = inside
-            self.entry_frame = entry_frame
-            self.entry_timestamp = entry_timestamp
-
-    trackableObjects = {}
-    totalFrames = 0
-    totalIn = 0
-    totalOut = 0
-    move_in = []
-    move_out = []
-    in_time = []
-    out_time = []
-    stay_duration = []
+        cameras = [Camera("main", config["url"], False, args, journal_dir=journal_root, sketch_dir=sketch_dir,
+                          telemetry_dir=telemetry_dir, publish=publish)]
+    timeout = config.get("first_frame_timeout", 10.0)
+    for cam in cameras:
+        if not cam.is_file and not cam.vs.wait_first(timeout):
+            logger.warning(f"{cam.name}: no frame within {timeout}s, continuing while it reconnects")
+    return cameras
+
+def camera_path(path, camera, multi):
+    """Give every camera its own output file in multi-source mode."""
+    if not multi:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{camera.name}{ext}"
+
+def apply_region(cameras, body):
+    """Apply a region update from the control channel; returns every camera's region."""
+    name = body.get("camera")
+    if name is None and len(cameras) > 1:
+        raise ValueError("several cameras are running, pass \"camera\"")
+    targets = [cam for cam in cameras if name is None or cam.name == name]
+    if not targets:
+        raise ValueError(f"unknown camera {name!r}")
+    rect, polygon, zones = body.get("rect"), body.get("polygon"), body.get("zones")
+    if polygon is not None and len(polygon) < 3:
+        raise ValueError("polygon needs at least 3 points")
+    if polygon is None and rect is not None:
+        if len(rect) != 4:
+            raise ValueError("rect needs [x, y, w, h]")
+        rect = [None if v is None else int(v) for v in rect]
+    if zones is not None:
+        validate_zones(zones)
+    # A body with only "zones" leaves the main region alone; omitted keys keep their current value
+    main_region = any(key in body for key in ("rect", "polygon", "tilt"))
+    # Build every camera's new region first so a failure leaves all of them unchanged
+    updates = []
+    for cam in targets:
+        counter = cam.counter
+        region = built_zones = None
+        if main_region:
+            cam_rect = rect if "rect" in body else counter.rect
+            cam_tilt = float(body.get("tilt") or 0) if "tilt" in body else counter.tilt_angle
+            cam_polygon = polygon if "rect" in body or "polygon" in body else counter.custom_polygon
+            region = counter.build_region(cam_rect, cam_tilt, cam_polygon)
+        if zones is not None:
+            built_zones = counter.build_zones(zones)
+        updates.append((cam, region, built_zones))
+    for cam, region, built_zones in updates:
+        if region is not None:
+            cam.counter.swap_region(*region)
+        if built_zones is not None:
+            cam.counter.swap_zones(*built_zones)
+        logger.info(f"{cam.name}: counting region updated to {cam.counter.region_params()}")
+    return {cam.name: cam.counter.region_params() for cam in cameras}
+
+def collect_metrics(pipeline, cameras):
+    """Metric families for the Prometheus endpoint."""
+    stages = pipeline.stats
+    return [
+        ("counter_stage_latency_seconds", "histogram", "Time spent per item in each pipeline stage.",
+         [({"stage": st.name}, st.latency) for st in stages]),
+        ("counter_stage_items_total", "counter", "Items processed by each pipeline stage.",
+         [({"stage": st.name}, st.count) for st in stages]),
+        ("counter_dropped_frames_total", "counter", "Frames dropped because a queue was full.",
+         [({"stage": st.name}, st.dropped) for st in stages]),
+        ("counter_queue_depth", "gauge", "Items waiting between pipeline stages.",
+         [({"queue": name}, depth) for name, depth in pipeline.queue_depths().items()]),
+        ("counter_active_tracks", "gauge", "Objects currently held by the tracker.",
+         [({"camera": cam.name}, len(cam.tracker.tracked_objects)) for cam in cameras]),
+        ("counter_events_total", "counter", "Entry and exit events logged.",
+         [({"camera": cam.name, "event": "in"}, cam.counter.totalIn) for cam in cameras]
+         + [({"camera": cam.name, "event": "out"}, cam.counter.totalOut) for cam in cameras]),
+        ("counter_zone_events_total", "counter", "Entries/forward crossings (in) and exits/backward crossings (out) per zone.",
+         [({"camera": cam.name, "zone": zone, "event": event}, counts[i])
+          # The control thread may add zones while this runs
+          for cam in cameras for zone, counts in dict(cam.counter.zone_counts).items()
+          for i, event in enumerate(("in", "out"))]),
+        ("counter_lost_visits_total", "counter", "Visits closed because the track was lost inside the region.",
+         [({"camera": cam.name}, cam.counter.lost) for cam in cameras]),
+        ("counter_detector_forwards_total", "counter", "Frames on which the DNN ran.",
+         [({"camera": cam.name}, cam.scheduler.forwards) for cam in cameras]),
+        ("counter_detector_skipped_total", "counter", "Frames handled by tracker prediction only.",
+         [({"camera": cam.name}, cam.scheduler.skipped) for cam in cameras]),
+        ("counter_frame_age_seconds", "gauge", "Time from capture to tracking of the latest frame.",
+         [({"camera": cam.name}, cam.frame_age) for cam in cameras]),
+        ("counter_stream_reconnects_total", "counter", "Times a live stream was reopened.",
+         [({"camera": cam.name}, cam.vs.reconnects) for cam in cameras if not cam.is_file]),
+        ("counter_stream_overwritten_frames_total", "counter", "Live frames replaced by a newer one before processing.",
+         [({"camera": cam.name}, cam.vs.overwritten) for cam in cameras if not cam.is_file]),
+        ("counter_motion_gated_frames_total", "counter", "Frames skipped by the motion gate.",
+         [({"camera": cam.name}, cam.gate.gated) for cam in cameras if cam.gate is not None]),
+        ("counter_motion_processed_frames_total", "counter", "Frames the motion gate let through.",
+         [({"camera": cam.name}, cam.gate.processed) for cam in cameras if cam.gate is not None]),
+        ("counter_telemetry_dropped_frames_total", "counter", "Frames left out of telemetry because its writer fell behind.",
+         [({"camera": cam.name}, cam.telemetry.dropped) for cam in cameras if cam.telemetry is not None]),
+        ("counter_recording_dropped_frames_total", "counter", "Output video frames dropped because the encoder fell behind.",
+         [({"camera": cam.name}, cam.recorder.dropped) for cam in cameras if cam.recorder is not None]),
+        ("counter_published_events_total", "counter", "Events sent to the aggregation service.",
+         [({"camera": cam.name}, cam.publisher.published) for cam in cameras if cam.publisher is not None]),
+        ("counter_publish_dropped_events_total", "counter", "Events that could not be sent to the aggregation service.",
+         [({"camera": cam.name}, cam.publisher.dropped) for cam in cameras if cam.publisher is not None]),
+    ]
+
+def quantile_ms(histogram, q):
+    """A latency quantile in ms for JSON; None when empty or past the last bucket (no upper bound)."""
+    bound = histogram.quantile(q)
+    return bound * 1000 if bound is not None and math.isfinite(bound) else None
+
+def metrics_snapshot(pipeline, cameras, previous, interval):
+    """Compact metrics for the periodic structured log line, with event rates per minute."""
+    snapshot = {
+        "stages": {st.name: {"items": st.count, "mean_ms": round(st.mean_latency_ms(), 2),
+                             "p95_ms": quantile_ms(st.latency, 0.95), "dropped": st.dropped}
+                   for st in pipeline.stats},
+        "queues": pipeline.queue_depths(),
+        "cameras": {},
+    }
+    for cam in cameras:
+        prev = previous.get("cameras", {}).get(cam.name, {})
+        snapshot["cameras"][cam.name] = dict(
+            cam.counter.memory_stats(),
+            tracks=len(cam.tracker.tracked_objects),
+            frame_age_ms=round(cam.frame_age * 1000, 1),
+            total_in=cam.counter.totalIn,
+            total_out=cam.counter.totalOut,
+            zones={zone: list(counts) for zone, counts in dict(cam.counter.zone_counts).items()},
+            in_per_min=round((cam.counter.totalIn - prev.get("total_in", 0)) * 60 / interval, 2),
+            out_per_min=round((cam.counter.totalOut - prev.get("total_out", 0)) * 60 / interval, 2),
+        )
+    return snapshot
+
+def run_counter(args, net, log_dir=None):
+    """Count people on the configured sources; returns a per-camera summary.
+
+    `log_dir` redirects the journals and exported CSVs, which the stride
+    report uses to keep its comparison runs out of the production logs.
+    """
+    cameras = open_cameras(args, log_dir)
+    multi = len(cameras) > 1
+    # Recorded footage must be processed in strict order. A batch holds a frame of
+    # every camera, so one file among live streams makes every batch precious; the
+    # live readers still only ever hand over their newest frame, so blocking adds no lag
+    drop_policy = args["drop_policy"]
+    if any(cam.is_file for cam in cameras) and drop_policy != "block":
+        if not all(cam.is_file for cam in cameras):
+            logger.info(f"A source is a video file, using the block drop policy instead of {drop_policy}")
+        drop_policy = "block"
+    cpu_start = time.process_time()
+    stats_interval = config.get("stats_interval", 60)
+    last_stats = time.monotonic()
+    last_snapshot = {}
     fps = FPS().start()
 
-    rect_x = args["rect_x"]
-    rect_y = args["rect_y"]
-    rect_w = args["rect_w"]
-    rect_h = args["rect_h"]
-    tilt_angle = args["tilt_angle"]
-    polygon = None
-
-    while True:
-        frame = vs.read()
-        frame = frame[1] if args.get("input", False) else frame
-        if args.get("input", False) and frame is None:
-            break
-
-        frame = imutils.resize(frame, width=500)
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        if W is None or H is None:
-            H, W = frame.shape[:2]
-            if None in (rect_x, rect_y, rect_w, rect_h):
-                rect_w = W
-                rect_h = H // 4
-                rect_x = 0
-                rect_y = (H // 2) - (rect_h // 2)
-            polygon = keystone_polygon(rect_x, rect_y, rect_w, rect_h, tilt_angle, W)
-
-        if polygon is not None:
-            cv2.polylines(frame, [polygon], isClosed=True, color=(0, 0, 255), thickness=2)
-
-        if args.get("output") and writer is None:
-            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-            writer = cv2.VideoWriter(args["output"], fourcc, feed_fps, (W, H), True)
-
-        # Detection
-        blob = cv2.dnn.blobFromImage(frame, 0.007843, (W, H), 127.5)
-        net.setInput(blob)
-        detections = net.forward()
-
-        norfair_detections = []
-        for i in np.arange(0, detections.shape[2]):
-            conf = float(detections[0, 0, i, 2])
-            if conf < args["confidence"]:
+    # One stalled or reconnecting stream must not hold up the others, so live
+    # sources are polled without blocking and the loop waits once for any of them
+    new_frame = threading.Event()
+    for cam in cameras:
+        if not cam.is_file:
+            cam.vs.new_frame = new_frame
+
+    def poll():
+        packets = []
+        for cam in cameras:
+            if cam.done:
                 continue
-            cls = int(detections[0, 0, i, 1])
-            if cls != 15: continue
-            box = (detections[0, 0, i, 3:7] * [W, H, W, H]).astype(int)
-            sx, sy, ex, ey = box
-            cx, cy = (sx + ex)//2, (sy + ey)//2
-            norfair_detections.append(
-                Detection(points=np.array([[cx, cy]]), scores=np.array([conf]))
-            )
-
-        tracked_objects = tracker.update(detections=norfair_detections)
-
-        for obj in tracked_objects:
-            tid = obj.id
-            cx, cy = obj.estimate.astype(int)[0]
-            inside = point_in_polygon((cx, cy), polygon)
-            to = trackableObjects.get(tid)
-
-            if to is None:
-                # First sighting
-                if inside:
-                    entry_ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-                    to = RegionTrackable(tid, inside, entry_frame=totalFrames, entry_timestamp=entry_ts)
-                    totalIn += 1
-                    move_in.append(totalIn)
-                    in_time.append(entry_ts)
-                else:
-                    to = RegionTrackable(tid, inside)
-            else:
-                if not to.inside and inside:
-                    # Entering
-                    entry_ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-                    to.entry_frame = totalFrames
-                    to.entry_timestamp = entry_ts
-                    totalIn += 1
-                    move_in.append(totalIn)
-                    in_time.append(entry_ts)
-                elif to.inside and not inside and to.entry_frame is not None:
-                    # Exiting
-                    exit_ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-                    totalOut += 1
-                    move_out.append(totalOut)
-                    out_time.append(exit_ts)
-                    dur = (totalFrames - to.entry_frame) / feed_fps
-                    stay_duration.append(round(dur, 2))
-                    to.entry_frame = None
-                    to.entry_timestamp = None
-
-                to.inside = inside
-
-            trackableObjects[tid] = to
-
-            cv2.putText(frame, f"ID {tid}", (cx-10, cy-10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 2)
-            cv2.circle(frame, (cx, cy), 4, (255,255,255), -1)
-
-        cv2.putText(frame, f"In: {totalIn}", (10, H-40),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
-        cv2.putText(frame, f"Out: {totalOut}", (10, H-20),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
-
-        # Log data
-        log_data(move_in, in_time, move_out, out_time, stay_duration)
-
-        if writer:
-            writer.write(frame)
-        cv2.imshow("People Counter", frame)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
-
-        totalFrames += 1
-        fps.update()
+            read = cam.read(timeout=0)
+            if read is None:
+                continue
+            packets.append(FramePacket(cam, cam.frames, *read))
+            cam.publish(read[0], cam.frames, read[1])
+            cam.frames += 1
+        return packets
+
+    def capture():
+        if all(cam.done for cam in cameras):
+            return None
+        new_frame.clear()
+        packets = poll()
+        # Live streams may have no new frame for a moment (an empty batch keeps the GUI responsive)
+        if not packets and not any(cam.is_file and not cam.done for cam in cameras):
+            if new_frame.wait(1.0):
+                packets = poll()
+        if not packets and all(cam.done for cam in cameras):
+            return None
+        return packets
+
+    def infer(batch):
+        # Frames the scheduler skips keep detections=None and rely on tracker prediction
+        to_detect = []
+        for packet in batch:
+            if not packet.camera.needs_processing(packet.frame):
+                packet.gated = True
+                continue
+            sched = packet.camera.scheduler
+            detected = sched.should_detect()
+            packet.period = sched.mark(detected)
+            if detected:
+                to_detect.append(packet)
+        if to_detect:
+            results = detect_people_batch(net, [p.frame for p in to_detect], args["confidence"],
+                                          [p.camera.detection_roi() for p in to_detect])
+            for packet, detections in zip(to_detect, results):
+                packet.detections = detections
+        return batch
+
+    def track(batch):
+        for packet in batch:
+            cam = packet.camera
+            packet.totals = (cam.counter.totalIn, cam.counter.totalOut)
+            cam.frame_age = time.monotonic() - packet.captured_mono
+            cam.capture_clock.stamp(packet.index, packet.captured_at, packet.frame_time)
+            if packet.gated:
+                continue
+            tracked_objects = cam.tracker.update(detections=packet.detections, period=packet.period)
+            cam.scheduler.observe(cam.tracker.tracked_objects, cam.counter.region)
+            packet.points = cam.counter.update(tracked_objects, packet.index)
+            if cam.telemetry is not None:
+                cam.telemetry.record(packet.index, packet.captured_at, packet.detections, tracked_objects)
+            cam.counter.evict({obj.id for obj in cam.tracker.tracked_objects})
+            packet.totals = (cam.counter.totalIn, cam.counter.totalOut)
+            # Flush buffered events once the time threshold passes
+            cam.journal.poll()
+            cam.sketches.poll()
+        nonlocal last_stats, last_snapshot
+        now = time.monotonic()
+        if now - last_stats >= stats_interval:
+            last_snapshot = metrics_snapshot(pipeline, cameras, last_snapshot, now - last_stats)
+            last_stats = now
+            log_line(last_snapshot)
+        return batch
+
+    def output(batch):
+        for packet in batch:
+            cam = packet.camera
+            frame = packet.frame
+            fps.update()
+            overlay = (cam.counter.polygon, packet.points, packet.totals, cam.counter.zone_specs)
+            if not args["headless"]:
+                draw_overlay(frame, *overlay)
+                cv2.imshow(f"People Counter {cam.name}" if multi else "People Counter", frame)
+                # The frame on screen already carries the overlay
+                overlay = None
+            if args.get("output"):
+                if cam.recorder is None:
+                    cam.recorder = VideoRecorder.from_config(
+                        config, camera_path(args["output"], cam, multi), cam.feed_fps, render=draw_overlay,
+                        live=not cam.is_file, fps=args.get("output_fps"), width=args.get("output_width"),
+                        segment_seconds=args.get("output_segment"))
+                cam.recorder.submit(frame, packet.frame_time, packet.captured_at, overlay)
+        if not args["headless"] and cv2.waitKey(1) & 0xFF == ord("q"):
+            return False
+
+    pipeline = Pipeline(capture, [("inference", infer), ("tracking", track)],
+                        queue_size=args["queue_size"], drop_policy=drop_policy,
+                        threaded=args["pipeline"])
+    server = None
+    if args["metrics_port"]:
+        server = MetricsServer(lambda: collect_metrics(pipeline, cameras), args["metrics_port"]).start()
+    control = None
+    if args["control_port"]:
+        control = ControlServer(lambda: {cam.name: cam.counter.region_params() for cam in cameras},
+                                lambda body: apply_region(cameras, body), args["control_port"]).start()
+    install_stack_dump_signal()
+    pipeline.run(output)
+    if server:
+        server.stop()
+    if control:
+        control.stop()
 
     fps.stop()
     logger.info(f"Elapsed time: {fps.elapsed():.2f} seconds")
     logger.info(f"Approx. FPS: {fps.fps():.2f}")
+    pipeline.log_stats()
+    for cam in cameras:
+        if cam.gate is not None:
+            logger.info(f"{cam.name} motion gate: {cam.gate.summary()}")
+
+    summary = {"cpu_seconds": round(time.process_time() - cpu_start, 3),
+               "wall_seconds": round(fps.elapsed(), 3), "cameras": {}}
+    for cam in cameras:
+        cam.close(camera_path(os.path.join(log_dir or "utils/data/logs", "counting_data.csv"), cam, multi))
+        summary["cameras"][cam.name] = dict(cam.summary(),
+                                            total_in=cam.counter.totalIn,
+                                            total_out=cam.counter.totalOut,
+                                            zones=cam.counter.zone_counts,
+                                            memory=cam.counter.memory_stats())
+    if not args["headless"]:
+        cv2.destroyAllWindows()
+    return summary
+
+class SegmentCounter(RegionCounter):
+    """RegionCounter for one time segment of a recording in a worker process.
+
+    Only visits that start inside [start, end) belong to the segment, for
+    the main region ("") and for every zone. Frames read before `start`
+    just establish who is already inside; frames after `end` only close
+    visits the segment owns. Visits are [entry frame, exit frame, reason,
+    zone]; tripwire crossings inside [start, end) are kept as
+    (frame, direction, zone).
+    """
+    def __init__(self, start, end, feed_fps, rect, tilt_angle, zones=None):
+        super().__init__(None, feed_fps, rect, tilt_angle, zones=zones)
+        self.start = start
+        self.end = end
+        self.visits = []
+        self.crossings = []
+        self._open = {}
+
+    def _open_visit(self, key, frame_index):
+        if self.start <= frame_index < self.end:
+            visit = [frame_index, None, None, key[1]]
+            self.visits.append(visit)
+            self._open[key] = visit
+
+    def _close_visit(self, key, frame_index, reason):
+        visit = self._open.pop(key, None)
+        if visit is not None:
+            visit[1], visit[2] = frame_index, reason
+
+    def close_open(self, frame_index):
+        """Close visits still open when the video ends as "lost"."""
+        for key in list(self._open):
+            self._close_visit(key, frame_index, "lost")
+
+    def _enter(self, to, frame_index):
+        to.entry_frame = frame_index
+        self._open_visit((to.track_id, ""), frame_index)
+
+    def _exit(self, to, frame_index, reason="exit"):
+        self._close_visit((to.track_id, ""), frame_index, reason)
+        to.entry_frame = None
+
+    def _zone_event(self, to, zone, event, frame_index, reason="exit"):
+        if event == "enter":
+            to.zone_entries = to.zone_entries or {}
+            to.zone_entries[zone] = frame_index
+            self._open_visit((to.track_id, zone), frame_index)
+        elif event == "exit":
+            if to.zone_entries:
+                to.zone_entries.pop(zone, None)
+            self._close_visit((to.track_id, zone), frame_index, reason)
+        elif self.start <= frame_index < self.end:
+            self.crossings.append((frame_index, event, zone))
+
+def count_segment(job):
+    """Worker: count one segment of --input; returns its visits and tripwire crossings.
+
+    Reading goes on past `end + overlap` until every visit the segment
+    owns has closed, so long stays across a cut are not cut short; visits
+    still open when the video ends are closed as "lost" at its last frame.
+    """
+    args, start, end, overlap, threads = job
+    cv2.setNumThreads(threads)
+    net = load_detector(dict(args, dnn_threads=args.get("dnn_threads") or threads))
+    vs = cv2.VideoCapture(args["input"])
+    feed_fps = vs.get(cv2.CAP_PROP_FPS) or config.get("feed_fps", 30)
+    first = max(0, start - overlap)
+    vs.set(cv2.CAP_PROP_POS_FRAMES, first)
+    tracker = Tracker(distance_function="euclidean", distance_threshold=30)
+    counter = SegmentCounter(start, end, feed_fps,
+                             (args["rect_x"], args["rect_y"], args["rect_w"], args["rect_h"]),
+                             args["tilt_angle"], zones=config_zones("main"))
+    frame_index = first
+    while frame_index < end or counter._open:
+        ok, frame = vs.read()
+        if not ok:
+            break
+        frame = imutils.resize(frame, width=500)
+        if counter.polygon is None:
+            H, W = frame.shape[:2]
+            counter.set_frame_size(W, H)
+        tracked_objects = tracker.update(detections=detect_people(net, frame, args["confidence"]))
+        counter.update(tracked_objects, frame_index)
+        counter.evict({obj.id for obj in tracker.tracked_objects})
+        frame_index += 1
+    counter.close_open(frame_index - 1)
+    vs.release()
+    return counter.visits, counter.crossings
+
+def batch_count(args):
+    """Count a recording in parallel time segments and merge the visits.
+
+    Each worker re-reads --segment-overlap seconds before its cut to pick
+    up tracks already inside and after it to close its own open visits, so
+    a person crossing a cut is counted exactly once. Events are stamped
+    with video time.
+    """
+    vs = cv2.VideoCapture(args["input"])
+    feed_fps = vs.get(cv2.CAP_PROP_FPS) or config.get("feed_fps", 30)
+    total = int(vs.get(cv2.CAP_PROP_FRAME_COUNT))
+    clock = VideoClock(video_start(args, args["input"], vs, feed_fps), feed_fps)
+    vs.release()
+    if args.get("output"):
+        logger.warning("--output is ignored when --segments > 1")
+
+    workers = args["workers"] or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    overlap = int(args["segment_overlap"] * feed_fps)
+    bounds = np.linspace(0, total, args["segments"] + 1).astype(int)
+    jobs = [(args, int(a), int(b), overlap, threads) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    start = time.perf_counter()
+    visits, crossings = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for seg_visits, seg_crossings in pool.map(count_segment, jobs):
+            visits += seg_visits
+            crossings += seg_crossings
+
+    # Replay the merged visits and crossings into the journal in frame order
+    events = [(entry, 0, zone, None, None) for entry, _, _, zone in visits]
+    events += [(exit_, 1, zone, entry, reason) for entry, exit_, reason, zone in visits]
+    events += [(frame_index, 2, zone, None, direction) for frame_index, direction, zone in crossings]
+    events.sort(key=lambda e: e[:2])
+    journal = EventJournal.from_config(config)
+    sketches = SketchWriter.from_config(config, "main")
+    counts = {}
+    for frame_index, kind, zone, entry, detail in events:
+        ts = clock.wall(frame_index)
+        zone_counts = counts.setdefault(zone, [0, 0])
+        if kind == 0:
+            zone_counts[0] += 1
+            journal.record_in(zone_counts[0], ts, zone=zone)
+        elif kind == 1:
+            zone_counts[1] += 1
+            dur = clock.mono(frame_index) - clock.mono(entry)
+            journal.record_out(zone_counts[1], ts, round(dur, 3), detail, zone=zone)
+            if not zone:
+                sketches.add(ts, dur)
+        else:
+            side = 0 if detail == "forward" else 1
+            zone_counts[side] += 1
+            journal.record_cross(zone_counts[side], ts, detail, zone)
+    totalIn, totalOut = counts.get("", [0, 0])
+    journal.close()
+    sketches.flush()
+    export_counting_csv(journal.directory)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Processed {total} frames in {len(jobs)} segments with {workers} workers "
+                f"in {elapsed:.2f} seconds ({total / elapsed if elapsed else 0:.2f} FPS)")
+    logger.info(f"In: {totalIn}, Out: {totalOut}")
+    return totalIn, totalOut
+
+def stride_report(args, net):
+    """Compare every-frame detection with adaptive stride on a recorded --input video."""
+    if not args.get("input"):
+        raise SystemExit("--stride-report needs --input")
+    runs = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, adaptive in (("baseline", False), ("adaptive", True)):
+            logger.info(f"Stride report: {label} run")
+            runs[label] = run_counter(dict(args, adaptive_stride=adaptive, sources=None),
+                                      net, log_dir=os.path.join(tmp, label))
+    base, adapt = runs["baseline"]["cameras"]["main"], runs["adaptive"]["cameras"]["main"]
+    report = {
+        "input": args["input"],
+        "max_stride": args["max_stride"],
+        "baseline": runs["baseline"],
+        "adaptive": runs["adaptive"],
+        "in_count_error": adapt["total_in"] - base["total_in"],
+        "out_count_error": adapt["total_out"] - base["total_out"],
+        "cpu_saving": round(1 - runs["adaptive"]["cpu_seconds"] / runs["baseline"]["cpu_seconds"], 3)
+                      if runs["baseline"]["cpu_seconds"] else 0.0,
+    }
+    with open(args["stride_report"], "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"In/Out baseline {base['total_in']}/{base['total_out']}, "
+                f"adaptive {adapt['total_in']}/{adapt['total_out']}, "
+                f"forwards {base['forwards']} -> {adapt['forwards']}, "
+                f"CPU saving {report['cpu_saving']:.1%}")
+    return report
 
-    if args.get("input"):
-        vs.release()
-    cv2.destroyAllWindows()
+def people_counter():
+    args = parse_arguments()
+    if args["segments"] > 1:
+        args["headless"] = True
+    net = load_detector(args)
+    net.warm_up(batch=len(args.get("sources") or [None]))
+    if args["stride_report"]:
+        stride_report(args, net)
+    elif args["segments"] > 1:
+        if not args.get("input"):
+            raise SystemExit("--segments needs --input")
+        batch_count(args)
+    else:
+        run_counter(args, net)
 
 if __name__ == "__main__":
     people_counter()
@@ -1,5 +1,5 @@
 import cv2
-import numpy as np
+import json
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.slider import Slider
@@ -10,27 +10,13 @@ from kivy.clock import Clock
 from kivy.graphics.texture import Texture
 from kivy.uix.button import Button
 from kivy.core.window import Window
+from utils.frame_ring import open_capture
+from utils.control import push_region, tweak_target
+from utils.counting import keystone_polygon
 
-def keystone_polygon(x, y, w, h, tilt_deg, frame_width):
-    tilt_rad = np.radians(tilt_deg)
-    max_shift = w // 3
-    shift = int(max_shift * np.sin(abs(tilt_rad)))
-    if tilt_deg > 0:
-        pts = np.array([
-            [x + shift, y],
-            [x + w - shift, y],
-            [x + w, y + h],
-            [x, y + h]
-        ])
-    else:
-        pts = np.array([
-            [x, y],
-            [x + w, y],
-            [x + w - shift, y + h],
-            [x + shift, y + h]
-        ])
-    pts[:, 0] = np.clip(pts[:, 0], 0, frame_width - 1)
-    return pts
+with open("utils/config.json", "r") as f:
+    config = json.load(f)
+ring_name, camera = tweak_target(config)
 
 class ClickableImage(Image):
     """Kivy Image widget that tracks mouse position over image."""
@@ -57,7 +43,7 @@ class ClickableImage(Image):
 class RegionTweakWidget(BoxLayout):
     def __init__(self, **kwargs):
         super().__init__(orientation='vertical', **kwargs)
-        self.capture = cv2.VideoCapture(0)
+        self.capture = open_capture(ring_name)
         ret, frame = self.capture.read()
         if not ret:
             raise RuntimeError("Cannot access camera.")
@@ -96,6 +82,9 @@ class RegionTweakWidget(BoxLayout):
         # --- Reset Button ---
         self.reset_button = Button(text="Reset", size_hint=(.08, 1), background_color=[0.9,0.3,0.3,1])
         controls.add_widget(self.reset_button)
+        # --- Apply to a running people_counter.py (needs "control_port" in config.json) ---
+        self.apply_button = Button(text="Apply", size_hint=(.08, 1), disabled=not config.get("control_port"))
+        controls.add_widget(self.apply_button)
 
         self.add_widget(controls)
 
@@ -117,6 +106,7 @@ class RegionTweakWidget(BoxLayout):
         self.h_slider.bind(value=self.update_from_slider)
         self.tilt_slider.bind(value=self.update_from_slider)
         self.reset_button.bind(on_release=self.reset_params)
+        self.apply_button.bind(on_release=self.apply_to_counter)
 
         # Video update
         Clock.schedule_interval(self.update, 1/30)
@@ -148,6 +138,15 @@ class RegionTweakWidget(BoxLayout):
         self.h_slider.value = self.default_h
         self.tilt_slider.value = self.default_tilt
 
+    def apply_to_counter(self, instance):
+        try:
+            push_region(config["control_port"], [self.rect_x, self.rect_y, self.rect_w, self.rect_h],
+                        self.tilt_angle, camera=camera)
+            self.apply_button.text = "Applied"
+        except (OSError, ValueError):
+            self.apply_button.text = "Failed"
+        Clock.schedule_once(lambda dt: setattr(self.apply_button, "text", "Apply"), 2)
+
     def update(self, dt):
         ret, frame = self.capture.read()
         if not ret:
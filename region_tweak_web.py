@@ -1,43 +1,36 @@
 import cv2
-import numpy as np
-import base64
+import asyncio
+import json
 import threading
 import time
-from nicegui import ui
-
-def keystone_polygon(x, y, w, h, tilt_deg, frame_width):
-    tilt_rad = np.radians(tilt_deg)
-    max_shift = w // 3
-    shift = int(max_shift * np.sin(abs(tilt_rad)))
-    if tilt_deg > 0:
-        pts = np.array([
-            [x + shift, y],
-            [x + w - shift, y],
-            [x + w, y + h],
-            [x, y + h]
-        ])
-    else:
-        pts = np.array([
-            [x, y],
-            [x + w, y],
-            [x + w - shift, y + h],
-            [x + shift, y + h]
-        ])
-    pts[:, 0] = np.clip(pts[:, 0], 0, frame_width - 1)
-    return pts
-
-# ---- Webcam init ----
-cap = cv2.VideoCapture(0)
+from fastapi.responses import StreamingResponse
+from nicegui import app, ui
+from utils.frame_ring import open_capture
+from utils.control import push_region, tweak_target
+from utils.counting import keystone_polygon
+
+with open("utils/config.json", "r") as f:
+    config = json.load(f)
+ring_name, camera = tweak_target(config)
+
+# ---- Webcam init (or the running counter's frame ring) ----
+cap = open_capture(ring_name)
 ret, frame = cap.read()
 if not ret:
     raise RuntimeError('Cannot open camera')
 img_h, img_w = frame.shape[:2]
 
+# Default per-client preview caps; other viewers can ask for their own via the query string
+PREVIEW_FPS = config.get("preview_fps", 15)
+PREVIEW_WIDTH = min(config.get("preview_width", img_w), img_w)
+
 # ---- State ----
 state = {'x': 50, 'y': 50, 'w': 200, 'h': 120, 'tilt': 0, 'pointer': None}
 state['cmd'] = f"python people_counter.py -p models/MobileNetSSD_deploy.prototxt -m models/MobileNetSSD_deploy.caffemodel --rect-x {state['x']} --rect-y {state['y']} --rect-w {state['w']} --rect-h {state['h']} --tilt-angle {state['tilt']}"
 frame_lock = threading.Lock()
 last_frame = None
+frame_seq = 0
+jpeg_cache = {}
 
 # ---- UI Elements ----
 with ui.row().style('align-items:center; gap:8px; padding:8px'):
@@ -62,13 +55,15 @@ with ui.row().style('align-items:center; gap:8px; padding:8px'):
     tilt_input = ui.input(value=state['tilt'], label='').style('width:80px; height:40px').bind_value(state, 'tilt')
 
     ui.button('Reset', on_click=lambda: reset()).style('height:40px; background:#f33; color:white;')
+    ui.button('Apply to counter', on_click=lambda: apply_to_counter()).style('height:40px;')
 
 with ui.row().style('align-items:center; gap:8px; padding:8px'):
     ui.label('Generated command for people_counter.py: ')
     cmd_textbox = ui.input(value=state['cmd'], label='').style('width:1200px; height:40px').bind_value(state, 'cmd')
 
 
-image = ui.interactive_image().style(f'width:{img_w}px; height:{img_h}px; cursor:crosshair;')
+image = ui.interactive_image(f'/video/stream?fps={PREVIEW_FPS}&width={PREVIEW_WIDTH}').style(
+    f'width:{img_w}px; height:{img_h}px; cursor:crosshair;')
 status = ui.label('')
 
 def reset():
@@ -82,6 +77,19 @@ def reset():
     tilt_slider.value = state['tilt']
 
 
+def apply_to_counter():
+    port = config.get("control_port")
+    if not port:
+        ui.notify('Set "control_port" in utils/config.json and start people_counter.py with it', type='warning')
+        return
+    try:
+        push_region(port, [int(state['x']), int(state['y']), int(state['w']), int(state['h'])], int(state['tilt']),
+                    camera=camera)
+        ui.notify('Region applied to the running counter', type='positive')
+    except (OSError, ValueError) as e:
+        ui.notify(f'Could not reach the counter: {e}', type='negative')
+
+
 def on_click(e):
     ox, oy = e.args['offsetX'], e.args['offsetY']
 
@@ -95,40 +103,74 @@ def on_click(e):
 
 image.on('click', on_click)
 
-# ---- Background Thread: Grab & encode frames ----
+# ---- Background Thread: Grab frames (encoding happens per viewer) ----
 def camera_loop():
-    global last_frame
+    global last_frame, frame_seq
     while True:
         ret, frame = cap.read()
         if not ret:
+            time.sleep(0.01)
             continue
-        try:
-            pts = keystone_polygon(
-                int(state['x']),
-                int(state['y']),
-                int(state['w']),
-                int(state['h']),
-                int(state['tilt']),
-                img_w
-            )
-        except:
-            continue
-        finally:
-            state['cmd'] = f"python people_counter.py -p models/MobileNetSSD_deploy.prototxt -m models/MobileNetSSD_deploy.caffemodel --rect-x {state['x']} --rect-y {state['y']} --rect-w {state['w']} --rect-h {state['h']} --tilt-angle {state['tilt']}"
-        cv2.polylines(frame, [pts], isClosed=True, color=(0, 0, 255), thickness=2)
-        _, buf = cv2.imencode('.jpg', frame)
-        img_b64 = base64.b64encode(buf).decode('utf-8')
         with frame_lock:
-            last_frame = f'data:image/jpeg;base64,{img_b64}'
+            last_frame = frame
+            frame_seq += 1
         time.sleep(1 / 60)  # Limit to 60 FPS
 
 threading.Thread(target=camera_loop, daemon=True).start()
 
+def encode_latest(width):
+    """JPEG of the newest frame at `width`, shared by every viewer with the same width."""
+    with frame_lock:
+        frame, seq = last_frame, frame_seq
+    cached = jpeg_cache.get(width)
+    if frame is None or (cached and cached[0] == seq):
+        return cached or (seq, None)
+    if width < frame.shape[1]:
+        frame = cv2.resize(frame, (width, frame.shape[0] * width // frame.shape[1]), interpolation=cv2.INTER_AREA)
+    _, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    jpeg_cache[width] = (seq, buf.tobytes())
+    return jpeg_cache[width]
+
+# ---- MJPEG stream: frames are only encoded while someone is watching ----
+@app.get('/video/stream')
+async def video_stream(fps: float = PREVIEW_FPS, width: int = PREVIEW_WIDTH):
+    fps = min(max(fps, 1.0), 60.0)
+    width = min(max(width, 80), img_w)
+
+    async def frames():
+        loop = asyncio.get_running_loop()
+        sent = None
+        while True:
+            started = time.monotonic()
+            seq, jpeg = await loop.run_in_executor(None, encode_latest, width)
+            if jpeg is not None and seq != sent:
+                sent = seq
+                yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                       + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+            await asyncio.sleep(max(0.0, 1 / fps - (time.monotonic() - started)))
+
+    return StreamingResponse(frames(), media_type='multipart/x-mixed-replace; boundary=frame')
+
+# ---- Region overlay: an SVG layer redrawn only when the parameters change ----
+overlay_params = None
+
+def update_overlay():
+    global overlay_params
+    try:
+        params = tuple(int(state[k]) for k in ('x', 'y', 'w', 'h', 'tilt'))
+    except (TypeError, ValueError):
+        return
+    if params == overlay_params:
+        return
+    overlay_params = params
+    pts = keystone_polygon(*params, img_w) * (PREVIEW_WIDTH / img_w)
+    points = ' '.join(f'{px:.1f},{py:.1f}' for px, py in pts)
+    image.content = f'<polygon points="{points}" fill="none" stroke="red" stroke-width="2" />'
+    state['cmd'] = f"python people_counter.py -p models/MobileNetSSD_deploy.prototxt -m models/MobileNetSSD_deploy.caffemodel --rect-x {state['x']} --rect-y {state['y']} --rect-w {state['w']} --rect-h {state['h']} --tilt-angle {state['tilt']}"
+
 # ---- UI Timer Update ----
 def update_image():
-    with frame_lock:
-        if last_frame:
-            image.set_source(last_frame)
+    update_overlay()
     ptr = state['pointer']
     ptr_text = f' | Pointer: ({ptr[0]}, {ptr[1]})' if ptr else ''
     status.text = (
@@ -139,5 +181,5 @@ def update_image():
     )
 
 
-ui.timer(1/60, update_image)  # Update UI ~30 FPS
+ui.timer(0.1, update_image)  # Overlay and status only; video comes from /video/stream
 ui.run()
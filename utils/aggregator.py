@@ -0,0 +1,444 @@
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from utils.rollup import FIELDS, N_BINS, engaged_share, hist_bin, hist_quantile
+from utils.timing import epoch_ms
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENT_PORT = 9109
+DEFAULT_QUERY_PORT = 9110
+# Spool files roll over every hour: <screen>-<camera>-<YYYYMMDDHH>.jsonl
+SPOOL_HOUR = "%Y%m%d%H"
+
+
+def parse_address(address, default_port=DEFAULT_EVENT_PORT):
+    """(host, port) from "host:port", ":port" or a bare port."""
+    host, _, port = str(address).rpartition(":")
+    return host or "127.0.0.1", int(port or default_port)
+
+
+class EventPublisher:
+    """Sends a counter's journal events on to the aggregation service.
+
+    Every event becomes one JSON line: a UDP datagram to `address`
+    ("host:port") that never blocks the caller, or a line appended to an
+    hourly spool file in `spool`, which the service tails (and which keeps
+    events while it is down). Give one of the two.
+    """
+
+    def __init__(self, screen, camera, address=None, spool=None):
+        if (address is None) == (spool is None):
+            raise ValueError("give the aggregator an address or a spool directory, not both")
+        self.screen = screen
+        self.camera = camera
+        self.published = 0
+        self.dropped = 0
+        self._sock = None
+        self._spool = spool
+        self._file = None
+        self._hour = None
+        if address is not None:
+            self._target = parse_address(address)
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+        else:
+            os.makedirs(spool, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config, screen, camera, address=None, spool=None):
+        """Build a publisher from the "aggregator" section of config.json, or None if unset."""
+        options = config.get("aggregator", {})
+        address = address or options.get("address")
+        spool = spool or options.get("spool")
+        if address is None and spool is None:
+            return None
+        return cls(screen, camera, address, None if address else spool)
+
+    def publish(self, row):
+        """Send one journal row (event, count, time, stay duration, reason, zone, epoch ms)."""
+        event, count, ts, duration, reason, zone, ms = row
+        if ms == "":
+            ms = epoch_ms(datetime.datetime.fromisoformat(ts))
+        line = json.dumps({"screen": self.screen, "camera": self.camera, "event": event, "count": count,
+                           "time_ms": ms, "duration": duration if duration != "" else None,
+                           "reason": reason, "zone": zone}, separators=(",", ":")) + "\n"
+        try:
+            if self._sock is not None:
+                self._sock.sendto(line.encode("utf-8"), self._target)
+            else:
+                self._spool_file(ms).write(line)
+                self._file.flush()
+            self.published += 1
+        except OSError:
+            # A full socket buffer or disk must not stop counting
+            self.dropped += 1
+
+    def _spool_file(self, ms):
+        hour = datetime.datetime.fromtimestamp(ms / 1000).strftime(SPOOL_HOUR)
+        if hour != self._hour:
+            if self._file is not None:
+                self._file.close()
+            path = os.path.join(self._spool, f"{self.screen}-{self.camera}-{hour}.jsonl")
+            self._file = open(path, "a")
+            self._hour = hour
+        return self._file
+
+    def summary(self):
+        return {"published_events": self.published, "publish_dropped": self.dropped}
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class WindowStore:
+    """Rolling per-camera, per-screen and fleet-wide event buckets in memory.
+
+    Events fall into `bucket_seconds` buckets by their epoch time; a
+    bucket holds entries, exits, the sum and sum of squares of stay
+    durations and the 0.5 s stay histogram of `utils.rollup`, kept per
+    zone. Every event updates its camera's row, its screen's row (all of
+    that screen's cameras) and the fleet row, so queries of any scope sum
+    at most `window / bucket_seconds` rows whatever the number of cameras.
+    Buckets older than `retention_seconds` are dropped; events arriving
+    that late are counted in `late` and ignored. Totals since start and
+    the time of the last event are kept per camera.
+    """
+
+    def __init__(self, bucket_seconds=10, retention_seconds=3600):
+        self.bucket_ms = int(bucket_seconds * 1000)
+        self.retention_ms = int(retention_seconds * 1000)
+        self.buckets = {}
+        self.cameras = {}
+        self.lines = set()
+        self.events = 0
+        self.late = 0
+        self._lock = threading.Lock()
+
+    def add(self, screen, camera, event, time_ms, duration=None, reason="", zone=""):
+        """Fold one published event in; crossings count forward/backward as entries/exits."""
+        if event == "cross":
+            self.lines.add(zone)
+            event = reason
+        if event == "out" and (duration is None or duration < 0):
+            return
+        bucket = int(time_ms) // self.bucket_ms
+        with self._lock:
+            if int(time_ms) < time.time() * 1000 - self.retention_ms:
+                self.late += 1
+                return
+            state = self.cameras.setdefault((screen, camera), {"entries": 0, "exits": 0, "last_ms": 0})
+            for key in ((screen, camera, zone), (screen, None, zone), (None, None, zone)):
+                rows = self.buckets.setdefault(key, {})
+                row = rows.get(bucket)
+                if row is None:
+                    row = rows[bucket] = np.zeros(len(FIELDS) + N_BINS)
+                if event in ("in", "forward"):
+                    row[0] += 1
+                else:
+                    row[1] += 1
+                    if event == "out":
+                        row[2] += duration
+                        row[3] += duration * duration
+                        row[len(FIELDS) + hist_bin(duration)] += 1
+            if not zone:
+                state["entries" if event == "in" else "exits"] += 1
+            state["last_ms"] = max(state["last_ms"], int(time_ms))
+            self.events += 1
+
+    def prune(self):
+        """Drop buckets that fell out of the retention window."""
+        oldest = (int(time.time() * 1000) - self.retention_ms) // self.bucket_ms
+        with self._lock:
+            for key, rows in list(self.buckets.items()):
+                for bucket in [b for b in rows if b < oldest]:
+                    del rows[bucket]
+                if not rows:
+                    del self.buckets[key]
+
+    def _rows(self, screen, camera, zone, window):
+        """(bucket, row) pairs of the last `window` seconds for one scope, oldest first."""
+        start = (int(time.time() * 1000) - int(window * 1000)) // self.bucket_ms
+        with self._lock:
+            rows = self.buckets.get((screen, camera, zone), {})
+            return sorted((b, row.copy()) for b, row in rows.items() if b > start)
+
+    def summary(self, window, engaged_sec=2.0, screen=None, camera=None, zone=""):
+        """Entries, visits and stay statistics of the last `window` seconds (None when unknown)."""
+        rows = self._rows(screen, camera, zone, window)
+        total = np.sum([row for _, row in rows], axis=0) if rows else np.zeros(len(FIELDS) + N_BINS)
+        entries, exits, stay_sum, stay_sumsq = total[:len(FIELDS)]
+        hist = total[len(FIELDS):]
+        visits = hist.sum()
+        mean = stay_sum / visits if visits else None
+        finite = lambda v: None if v is None or np.isnan(v) else round(float(v), 3)
+        return {
+            "entries": int(entries),
+            "exits": int(exits),
+            "visits": int(visits),
+            "mean": finite(mean),
+            "std": finite(np.sqrt(max(stay_sumsq / visits - mean * mean, 0)) if visits else None),
+            "median": finite(hist_quantile(hist, 0.5)),
+            "p90": finite(hist_quantile(hist, 0.9)),
+            "engaged_pct": round(engaged_share(hist, engaged_sec) * 100, 1),
+        }
+
+    def series(self, window, step=60, screen=None, camera=None, zone=""):
+        """Entries, exits and mean stay per `step` seconds (a multiple of the bucket size)."""
+        step_buckets = max(1, int(step * 1000) // self.bucket_ms)
+        merged = {}
+        for bucket, row in self._rows(screen, camera, zone, window):
+            slot = bucket // step_buckets
+            if slot in merged:
+                merged[slot] += row
+            else:
+                merged[slot] = row
+        out = {"time_ms": [], "entries": [], "exits": [], "mean_stay": []}
+        for slot in sorted(merged):
+            row = merged[slot]
+            visits = row[len(FIELDS):].sum()
+            out["time_ms"].append(slot * step_buckets * self.bucket_ms)
+            out["entries"].append(int(row[0]))
+            out["exits"].append(int(row[1]))
+            out["mean_stay"].append(round(float(row[2] / visits), 3) if visits else None)
+        return out
+
+    def screens(self):
+        """Every camera seen so far with its totals and the age of its last event."""
+        now = time.time() * 1000
+        with self._lock:
+            return [{"screen": screen, "camera": camera, "total_in": s["entries"], "total_out": s["exits"],
+                     "last_event_age": round(max(now - s["last_ms"], 0) / 1000, 1)}
+                    for (screen, camera), s in sorted(self.cameras.items())]
+
+    def zones(self):
+        with self._lock:
+            return sorted({zone for _, _, zone in self.buckets} | {""})
+
+    def fleet(self, window, engaged_sec=2.0, zone=""):
+        """Fleet-wide summary plus one summary per screen."""
+        screens = sorted({screen for screen, _ in self.cameras})
+        return {
+            "fleet": self.summary(window, engaged_sec, zone=zone),
+            "screens": {screen: self.summary(window, engaged_sec, screen, zone=zone) for screen in screens},
+        }
+
+
+class SpoolReader:
+    """Tails the publishers' spool files, reading only bytes appended since the last poll.
+
+    Files whose hour is older than `retention_seconds` are skipped, and
+    once fully read they are deleted.
+    """
+
+    def __init__(self, directory, store, retention_seconds=3600):
+        self.directory = directory
+        self.store = store
+        self.retention_seconds = retention_seconds
+        self.offsets = {}
+
+    def poll(self):
+        """Feed new events to the store; returns how many were read."""
+        added = 0
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.retention_seconds, hours=1)
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.jsonl"))):
+            hour = datetime.datetime.strptime(os.path.basename(path)[:-6].rsplit("-", 1)[1], SPOOL_HOUR)
+            offset = self.offsets.get(path, 0)
+            size = os.path.getsize(path)
+            if hour < cutoff:
+                if offset >= size:
+                    os.remove(path)
+                    self.offsets.pop(path, None)
+                    continue
+            if size <= offset:
+                continue
+            with open(path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read()
+            # Leave a partially written last line for the next poll
+            end = chunk.rfind(b"\n") + 1
+            for line in chunk[:end].splitlines():
+                added += ingest(self.store, line)
+            self.offsets[path] = offset + end
+        return added
+
+
+def ingest(store, line):
+    """Add one JSON event line to the store; returns 1 if it was valid."""
+    try:
+        e = json.loads(line)
+        store.add(e["screen"], e["camera"], e["event"], e["time_ms"], e.get("duration"),
+                  e.get("reason", ""), e.get("zone", ""))
+    except (ValueError, KeyError, TypeError):
+        logger.warning(f"Ignoring malformed event {line[:200]!r}")
+        return 0
+    return 1
+
+
+class AggregatorServer:
+    """Merges event streams from many counters and answers queries over local HTTP.
+
+    Events arrive as UDP datagrams on `event_port` and/or from spool
+    files in `spool`. Queries (JSON):
+
+    GET /screens                                      cameras seen, totals, last event age
+    GET /summary?window=S&screen=&camera=&zone=&engaged=
+                                                      one scope (fleet when no screen)
+    GET /series?window=S&step=S&screen=&camera=&zone= counts and mean stay per step
+    GET /fleet?window=S&zone=&engaged=                fleet summary and one per screen
+    GET /zones                                        zones and tripwires seen
+    """
+
+    def __init__(self, store, query_port=DEFAULT_QUERY_PORT, event_port=None, spool=None,
+                 host="127.0.0.1", poll_interval=1.0):
+        self.store = store
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self.spool = SpoolReader(spool, store, store.retention_ms / 1000) if spool else None
+        self.sock = None
+        if event_port is not None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            self.sock.bind((host, event_port))
+            self.sock.settimeout(0.5)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                q = {k: v[0] for k, v in parse_qs(url.query).items()}
+                zone = q.get("zone", "")
+                try:
+                    window = float(q.get("window", 3600))
+                    engaged = float(q.get("engaged", 2.0))
+                    if url.path == "/screens":
+                        payload = server.store.screens()
+                    elif url.path == "/summary":
+                        payload = server.store.summary(window, engaged, q.get("screen"), q.get("camera"), zone)
+                    elif url.path == "/series":
+                        payload = server.store.series(window, float(q.get("step", 60)), q.get("screen"),
+                                                      q.get("camera"), zone)
+                    elif url.path == "/fleet":
+                        payload = server.store.fleet(window, engaged, zone)
+                    elif url.path == "/zones":
+                        payload = {"zones": server.store.zones(), "lines": sorted(server.store.lines)}
+                    else:
+                        self.send_error(404)
+                        return
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, query_port), Handler)
+        self.threads = [threading.Thread(target=self.httpd.serve_forever, name="aggregator-http", daemon=True),
+                        threading.Thread(target=self._maintain, name="aggregator-spool", daemon=True)]
+        if self.sock is not None:
+            self.threads.append(threading.Thread(target=self._receive, name="aggregator-udp", daemon=True))
+
+    @classmethod
+    def from_config(cls, config, **overrides):
+        """Build a store and server from the "aggregator" section of config.json."""
+        options = dict(config.get("aggregator", {}))
+        options.update({k: v for k, v in overrides.items() if v is not None})
+        store = WindowStore(options.get("bucket_seconds", 10), options.get("retention_seconds", 3600))
+        address = options.get("address")
+        event_port = options.get("event_port") or (parse_address(address)[1] if address else None)
+        return cls(store, options.get("query_port", DEFAULT_QUERY_PORT), event_port, options.get("spool"),
+                   options.get("host", "127.0.0.1"))
+
+    def _receive(self):
+        while not self._stop.is_set():
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            for line in data.splitlines():
+                ingest(self.store, line)
+
+    def _maintain(self):
+        while not self._stop.wait(self.poll_interval):
+            if self.spool is not None:
+                self.spool.poll()
+            self.store.prune()
+
+    def start(self):
+        if self.spool is not None:
+            n = self.spool.poll()
+            logger.info(f"Read {n} spooled events from {self.spool.directory}")
+        for thread in self.threads:
+            thread.start()
+        if self.sock is not None:
+            logger.info(f"Receiving events on udp://{self.sock.getsockname()[0]}:{self.sock.getsockname()[1]}")
+        logger.info(f"Aggregator queries on http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.sock is not None:
+            self.sock.close()
+
+
+def query(url, path, timeout=2.0, **params):
+    """GET `path` from an aggregator at `url` ("http://host:port"); returns the decoded JSON."""
+    params = {k: v for k, v in params.items() if v is not None}
+    full = f"{url.rstrip('/')}{path}" + (f"?{urllib.parse.urlencode(params)}" if params else "")
+    with urllib.request.urlopen(full, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[INFO] %(message)s")
+    with open("utils/config.json", "r") as f:
+        config = json.load(f)
+    ap = argparse.ArgumentParser(description="Merge event streams from many counters and serve rolling totals")
+    ap.add_argument("--event-port", type=int, default=None,
+                    help=f"receive UDP events on this port (e.g. {DEFAULT_EVENT_PORT})")
+    ap.add_argument("--spool", default=None, help="tail spool files written by counters in this directory")
+    ap.add_argument("--query-port", type=int, default=None, help=f"HTTP query port (default {DEFAULT_QUERY_PORT})")
+    ap.add_argument("--bucket-seconds", type=float, default=None, help="bucket size (default 10)")
+    ap.add_argument("--retention-seconds", type=float, default=None, help="window kept in memory (default 3600)")
+    args = ap.parse_args()
+
+    server = AggregatorServer.from_config(config, event_port=args.event_port, spool=args.spool,
+                                          query_port=args.query_port, bucket_seconds=args.bucket_seconds,
+                                          retention_seconds=args.retention_seconds)
+    if server.sock is None and server.spool is None:
+        raise SystemExit("nothing to ingest: pass --event-port and/or --spool")
+    server.start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"{server.store.events} events from {len(server.store.cameras)} cameras, "
+                        f"{server.store.late} too late")
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import cv2
+import imutils
+import numpy as np
+import pandas as pd
+from norfair import Detection, Tracker
+
+from utils.columnar import ColumnStore, convert_counting_csv, synthetic_counting_csv
+from utils.counting import RegionCounter, decode_detections, draw_overlay
+from utils.inference import INPUT_SIZE, Detector, load_detector
+from utils.journal import EventJournal
+from utils.sketch import SketchWriter
+
+STAGES = ("decode", "resize", "blob", "forward", "postprocess", "track",
+          "region", "count", "logging", "encode")
+
+
+def synthetic_clip(path, frames, width=1280, height=720, fps=30, seed=0):
+    """Write a noisy clip so decode/encode costs resemble real footage."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    for i in range(frames):
+        writer.write(np.roll(base, i * 4, axis=1))
+    writer.release()
+
+
+class SyntheticDetector(Detector):
+    """A `Detector` whose forward reports `people` walking top to bottom.
+
+    Rows have the layout of MobileNet-SSD's DetectionOutput, padded with
+    `distractors` rows of other classes and weak people so that
+    post-processing sees realistic filtering work. Blobs are built as for
+    the real network, only the forward is skipped.
+    """
+
+    name = "synthetic"
+
+    def __init__(self, people, distractors=20, seed=0, input_size=INPUT_SIZE):
+        super().__init__(input_size)
+        rng = np.random.default_rng(seed)
+        self.x = rng.uniform(0.05, 0.9, people)
+        self.y = rng.uniform(0.0, 1.0, people)
+        self.speed = rng.uniform(0.003, 0.01, people)
+        self.distractors = distractors
+        self.rng = rng
+
+    def forward(self, blob):
+        self.y = (self.y + self.speed) % 1.0
+        n = len(self.x)
+        people = np.stack([np.zeros(n), np.full(n, 15), self.rng.uniform(0.5, 1.0, n),
+                           self.x, self.y - 0.05, self.x + 0.05, self.y + 0.05], axis=1)
+        other = np.stack([np.zeros(self.distractors), self.rng.integers(1, 21, self.distractors),
+                          self.rng.uniform(0.0, 0.4, self.distractors),
+                          *self.rng.uniform(0, 1, (4, self.distractors))], axis=1)
+        return np.concatenate([people, other]).astype(np.float32)
+
+
+def percentiles(samples):
+    a = np.asarray(samples) * 1000
+    if not len(a):
+        return {}
+    return {"mean_ms": round(float(a.mean()), 4), "p50_ms": round(float(np.percentile(a, 50)), 4),
+            "p95_ms": round(float(np.percentile(a, 95)), 4), "max_ms": round(float(a.max()), 4)}
+
+
+def bench_pipeline(clip, frames, people, net=None, confidence=0.4, seed=0):
+    """Time every stage of the counting loop separately on a clip.
+
+    `net` is a `utils.inference.Detector` (default: synthetic people); the
+    blob and forward stages run the same preprocessing and forward calls as
+    `Detector.detect()` in the counter.
+    """
+    net = net or SyntheticDetector(people, seed=seed)
+    timings = {stage: [] for stage in STAGES}
+    cap = cv2.VideoCapture(clip)
+    feed_fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    tracker = Tracker(distance_function="euclidean", distance_threshold=30)
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = EventJournal(os.path.join(tmp, "journal"))
+        sketches = SketchWriter(os.path.join(tmp, "sketches"), "bench")
+        counter = RegionCounter(journal, feed_fps, (None, None, None, None), 0, sketches=sketches)
+        writer = None
+        done = 0
+        start = time.perf_counter()
+        while done < frames:
+            t0 = time.perf_counter()
+            ok, frame = cap.read()
+            t1 = time.perf_counter()
+            if not ok:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                continue
+            frame = imutils.resize(frame, width=500)
+            t2 = time.perf_counter()
+            H, W = frame.shape[:2]
+            if counter.polygon is None:
+                counter.set_frame_size(W, H)
+            blob = net.blob([frame], net.blob_size(frame))
+            t3 = time.perf_counter()
+            detections = net.forward(blob)
+            t4 = time.perf_counter()
+            centroids, scores, _ = decode_detections(detections, W, H, confidence)
+            norfair_detections = [Detection(points=c[None], scores=s[None]) for c, s in zip(centroids, scores)]
+            t5 = time.perf_counter()
+            tracked_objects = tracker.update(detections=norfair_detections)
+            t6 = time.perf_counter()
+            if tracked_objects:
+                counter.region.contains(np.array([obj.estimate[0] for obj in tracked_objects]))
+            t7 = time.perf_counter()
+            points = counter.update(tracked_objects, done)
+            counter.evict({obj.id for obj in tracker.tracked_objects})
+            t8 = time.perf_counter()
+            journal.poll()
+            sketches.poll()
+            t9 = time.perf_counter()
+            draw_overlay(frame, counter.polygon, points, (counter.totalIn, counter.totalOut))
+            if writer is None:
+                writer = cv2.VideoWriter(os.path.join(tmp, "out.mp4"), cv2.VideoWriter_fourcc(*"mp4v"),
+                                         feed_fps, (W, H), True)
+            writer.write(frame)
+            t10 = time.perf_counter()
+            for stage, a, b in zip(STAGES, (t0, t1, t2, t3, t4, t5, t6, t7, t8, t9),
+                                   (t1, t2, t3, t4, t5, t6, t7, t8, t9, t10)):
+                timings[stage].append(b - a)
+            done += 1
+        elapsed = time.perf_counter() - start
+        journal.close()
+        writer.release()
+    cap.release()
+    return {
+        "people": people,
+        "frames": done,
+        "fps": round(done / elapsed, 2),
+        "forward": net.name,
+        "total_in": counter.totalIn,
+        "total_out": counter.totalOut,
+        "stages": {stage: percentiles(samples) for stage, samples in timings.items()},
+    }
+
+
+def bench_dashboard(rows, freqs=("1min", "15min", "h", "D"), seed=0):
+    """Time the dashboard's CSV load/resample path and the column store on `rows` visits."""
+    def timed(fn):
+        t0 = time.perf_counter()
+        out = fn()
+        return out, round(time.perf_counter() - t0, 4)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "counting_data.csv")
+        synthetic_counting_csv(csv_path, rows, seed)
+
+        # Same steps as dashboard.load_data()
+        def load():
+            df = pd.read_csv(csv_path)
+            df["In Time"] = pd.to_datetime(df["In Time"], errors="coerce", format="ISO8601")
+            df["Out Time"] = pd.to_datetime(df["Out Time"], errors="coerce", format="ISO8601")
+            df["Stay Duration"] = pd.to_numeric(df["Stay Duration"], errors="coerce")
+            valid = df["Stay Duration"].notna() & (df["Stay Duration"] >= 0)
+            return df[valid].reset_index(drop=True)
+
+        df, load_s = timed(load)
+        _, metrics_s = timed(lambda: (df["Stay Duration"].mean(), df["Stay Duration"].median(),
+                                      (df["Stay Duration"] >= 2.0).mean()))
+        df_time = df.set_index("In Time")
+        resample_s = {}
+        for freq in freqs:
+            _, resample_s[freq] = timed(lambda: (df_time["Move In"].resample(freq).count(),
+                                                 df_time["Stay Duration"].resample(freq).mean()))
+        store, convert_s = timed(lambda: convert_counting_csv(csv_path, os.path.join(tmp, "events.col")))
+        _, store_load_s = timed(lambda: ColumnStore(store.path).to_frame())
+    return {"rows": rows, "csv_load_s": load_s, "metrics_s": metrics_s, "resample_s": resample_s,
+            "columnar_convert_s": convert_s, "columnar_load_s": store_load_s}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "opencv": cv2.__version__, "numpy": np.__version__,
+            "pandas": pd.__version__}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Camera-free benchmark of the counting pipeline and dashboard")
+    ap.add_argument("--input", type=str, default=None,
+                    help="recorded clip to decode (default: a generated 1280x720 clip)")
+    ap.add_argument("--frames", type=int, default=300,
+                    help="frames to process per people setting")
+    ap.add_argument("--people", type=int, nargs="+", default=[0, 5, 20, 50],
+                    help="number of synthetic people in the detection tensor")
+    ap.add_argument("-p", "--prototxt", default=None,
+                    help="Caffe deploy file for the OpenCV backend")
+    ap.add_argument("-m", "--model", default=None,
+                    help="run the real MobileNet-SSD forward with this model instead of synthetic detections")
+    ap.add_argument("--backend", choices=("opencv", "onnx"), default="opencv",
+                    help="inference backend for --model: OpenCV DNN or ONNX Runtime (CPU)")
+    ap.add_argument("--dnn-threads", type=int, default=None,
+                    help="threads used by the inference backend (default: library default)")
+    ap.add_argument("--input-size", type=int, default=INPUT_SIZE,
+                    help="network input size; 0 feeds frames at full size")
+    ap.add_argument("--log-rows", type=int, nargs="*", default=[10_000, 100_000, 1_000_000],
+                    help="synthetic log sizes for the dashboard benchmark (e.g. 10000 ... 10000000)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", type=str, default=None,
+                    help="write the JSON results to this file instead of stdout")
+    args = ap.parse_args()
+
+    net = None
+    if args.model:
+        net = load_detector(dict(vars(args), dnn_backend="default", dnn_target="cpu"))
+        net.warm_up()
+    results = {"environment": environment(), "params": vars(args), "pipeline": [], "dashboard": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = args.input
+        if clip is None:
+            clip = os.path.join(tmp, "clip.avi")
+            synthetic_clip(clip, min(args.frames, 150), seed=args.seed)
+        for people in args.people:
+            detector = net or SyntheticDetector(people, seed=args.seed, input_size=args.input_size)
+            results["pipeline"].append(bench_pipeline(clip, args.frames, people, detector, seed=args.seed))
+    for rows in args.log_rows:
+        results["dashboard"].append(bench_dashboard(rows, seed=args.seed))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
@@ -0,0 +1,126 @@
+import datetime
+import logging
+import threading
+import time
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+
+class StreamReader:
+    """Reads a live source on its own thread into a latest-frame-wins slot.
+
+    Every frame is stamped with the wall-clock and monotonic time it was
+    captured. Consumers always get the newest frame; frames nobody picked up
+    in time are overwritten and counted in `overwritten`. When the source
+    fails to open or stops delivering frames for `stall_timeout` seconds the
+    reader reopens it, waiting `reconnect_min` seconds at first and doubling
+    up to `reconnect_max` on repeated failures. `new_frame` may be set to a
+    threading.Event shared by several readers; it is set on every frame so
+    a consumer can wait once for whichever source delivers first.
+    """
+
+    def __init__(self, source, name="stream", reconnect_min=0.5, reconnect_max=30.0, stall_timeout=5.0):
+        self.source = source
+        self.name = name
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.stall_timeout = stall_timeout
+        self.frames = 0
+        self.overwritten = 0
+        self.reconnects = 0
+        self.new_frame = None
+        self._slot = None
+        self._seq = 0
+        self._taken = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"reader-{name}", daemon=True)
+
+    @classmethod
+    def from_config(cls, config, source, name="stream"):
+        """Build a reader from the optional "capture" section of config.json."""
+        return cls(source, name, **config.get("capture", {}))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _open(self):
+        params = []
+        if isinstance(self.source, str) and hasattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC"):
+            ms = int(self.stall_timeout * 1000)
+            params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, ms, cv2.CAP_PROP_READ_TIMEOUT_MSEC, ms]
+        cap = cv2.VideoCapture(self.source, cv2.CAP_ANY, params)
+        if cap.isOpened():
+            # Keep the driver from queueing stale frames behind ours
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            return cap
+        cap.release()
+        return None
+
+    def _run(self):
+        delay = self.reconnect_min
+        while not self._stop.is_set():
+            cap = self._open()
+            if cap is None:
+                logger.warning(f"{self.name}: cannot open source, retrying in {delay:.1f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.reconnect_max)
+                continue
+            last_frame = time.monotonic()
+            while not self._stop.is_set():
+                ok, frame = cap.read()
+                now = time.monotonic()
+                if not ok or frame is None:
+                    if now - last_frame >= self.stall_timeout:
+                        break
+                    time.sleep(0.01)
+                    continue
+                last_frame = now
+                delay = self.reconnect_min
+                self._publish(frame, datetime.datetime.now(), now)
+            cap.release()
+            if not self._stop.is_set():
+                self.reconnects += 1
+                logger.warning(f"{self.name}: stream stalled, reconnecting in {delay:.1f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.reconnect_max)
+
+    def _publish(self, frame, captured_at, captured_mono):
+        with self._cond:
+            if self._seq > self._taken:
+                self.overwritten += 1
+            self._seq += 1
+            self.frames += 1
+            self._slot = (frame, captured_at, captured_mono)
+            self._cond.notify_all()
+        if self.new_frame is not None:
+            self.new_frame.set()
+
+    def read(self, timeout=1.0):
+        """Newest frame not returned before as (frame, captured_at, captured_mono).
+
+        Returns None if no new frame arrives within `timeout` seconds or the
+        reader has been stopped.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > self._taken or self._stop.is_set(), timeout):
+                return None
+            if self._stop.is_set():
+                return None
+            self._taken = self._seq
+            return self._slot
+
+    def wait_first(self, timeout=10.0):
+        """Block until the first frame has been captured; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq > 0, timeout)
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._thread.join(timeout=self.stall_timeout + 1.0)
+
@@ -0,0 +1,310 @@
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.journal import COUNTING_HEADER, read_events
+
+logger = logging.getLogger(__name__)
+
+# Fixed-width little-endian columns; time_ms is Unix epoch milliseconds, the
+# same convention as `utils.timing.epoch_ms` and telemetry. Stores written
+# before meta["time_base"] existed hold the naive local time read as UTC.
+# `zone` indexes meta["zones"] (0 is the main region, -1 a log without zones).
+SCHEMAS = {
+    "events": [("time_ms", "<i8"), ("event", "i1"), ("count", "<i4"),
+               ("stay", "<f4"), ("reason", "i1"), ("zone", "<i2")],
+    "detections": [("time_ms", "<i8"), ("frame", "<i4"), ("track", "<i4"),
+                   ("sx", "<i2"), ("sy", "<i2"), ("ex", "<i2"), ("ey", "<i2"),
+                   ("conf", "<f4")],
+}
+EVENT_CODES = {"in": 0, "out": 1, "cross": 2}
+REASON_CODES = {"": 0, "exit": 0, "lost": 1, "forward": 2, "backward": 3}
+INDEX_BLOCK = 4096
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _local_offset_ms(epoch_ms):
+    """UTC offset of local time in ms at each epoch-ms value, looked up once per hour."""
+    hours, inverse = np.unique(np.asarray(epoch_ms, dtype=np.int64) // 3_600_000, return_inverse=True)
+    offsets = np.array([time.localtime(h * 3600).tm_gmtoff for h in hours.tolist()], dtype=np.int64)
+    return offsets[inverse] * 1000
+
+
+def local_ms(values):
+    """Naive local datetime strings as milliseconds on a UTC axis (NaT becomes the int64 minimum)."""
+    dt = pd.to_datetime(pd.Series(values), errors="coerce", format="ISO8601")
+    return dt.to_numpy(dtype="datetime64[ms]").astype(np.int64)
+
+
+def to_epoch_ms(values):
+    """Unix epoch milliseconds of naive local datetime strings, like `utils.timing.epoch_ms`.
+
+    NaT becomes the int64 minimum.
+    """
+    naive = local_ms(values)
+    out = naive.copy()
+    valid = naive != np.iinfo(np.int64).min
+    if valid.any():
+        # Offset of every local hour as datetime.timestamp() sees it, so repeated
+        # and skipped times around DST changes resolve the same way
+        hours, inverse = np.unique(naive[valid] // 3_600_000, return_inverse=True)
+        starts = [int((_EPOCH + datetime.timedelta(hours=h)).timestamp()) * 1000 for h in hours.tolist()]
+        out[valid] = naive[valid] - (hours * 3_600_000 - np.array(starts, dtype=np.int64))[inverse]
+    return out
+
+
+def to_local_datetime(epoch_ms):
+    """Naive local datetimes of Unix epoch milliseconds (the inverse of `to_epoch_ms`)."""
+    epoch_ms = np.asarray(epoch_ms, dtype=np.int64)
+    return pd.to_datetime(epoch_ms + _local_offset_ms(epoch_ms), unit="ms")
+
+
+class ColumnStore:
+    """Directory of fixed-width column files sorted by `time_ms`.
+
+    Each column is a raw `.bin` file read through `np.memmap`, so opening a
+    store costs nothing and a query only touches the pages it returns.
+    `index.bin` holds the timestamp of every `INDEX_BLOCK`-th row; a date
+    range is located by a binary search over that sparse index and then
+    inside one block. Rows must be appended in time order.
+    """
+
+    def __init__(self, path, kind=None):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            if kind not in SCHEMAS:
+                raise ValueError(f"new store needs kind in {sorted(SCHEMAS)}, got {kind!r}")
+            os.makedirs(path, exist_ok=True)
+            self.meta = {"kind": kind, "columns": SCHEMAS[kind], "rows": 0, "block": INDEX_BLOCK,
+                         "time_base": "epoch"}
+            self._write_meta()
+        self.columns = [name for name, _ in self.meta["columns"]]
+        self.dtypes = dict(self.meta["columns"])
+        self.epoch = self.meta.get("time_base") == "epoch"
+
+    @staticmethod
+    def is_store(path):
+        return os.path.isfile(os.path.join(path, "meta.json"))
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def _write_meta(self):
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def _column(self, name, rows=None):
+        rows = len(self) if rows is None else rows
+        if rows == 0:
+            return np.zeros(0, dtype=self.dtypes[name])
+        return np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=self.dtypes[name],
+                         mode="r", shape=(rows,))
+
+    def _index(self):
+        n = -(-len(self) // self.meta["block"])
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.memmap(os.path.join(self.path, "index.bin"), dtype="<i8", mode="r", shape=(n,))
+
+    def append(self, data):
+        """Append a dict of equal-length column arrays (time-sorted, after existing rows)."""
+        n = len(data["time_ms"])
+        if n == 0:
+            return
+        ts = np.asarray(data["time_ms"], dtype="<i8")
+        if np.any(np.diff(ts) < 0):
+            raise ValueError("rows must be sorted by time_ms")
+        rows = len(self)
+        if rows and ts[0] < self._column("time_ms")[-1]:
+            raise ValueError("appended rows start before the end of the store")
+        for name in self.columns:
+            values = np.asarray(data.get(name, np.full(n, -1)), dtype=self.dtypes[name])
+            with open(os.path.join(self.path, f"{name}.bin"), "ab") as f:
+                f.write(values.tobytes())
+        block = self.meta["block"]
+        first = -(-rows // block) * block
+        with open(os.path.join(self.path, "index.bin"), "ab") as f:
+            f.write(ts[first - rows::block].tobytes())
+        self.meta["rows"] = rows + n
+        self._write_meta()
+
+    def row_range(self, start=None, end=None):
+        """Row slice [lo, hi) holding start <= time_ms < end (epoch ms or datetimes)."""
+        ts = self._column("time_ms")
+        index, block = self._index(), self.meta["block"]
+
+        def locate(value):
+            if isinstance(value, (str, pd.Timestamp)) or hasattr(value, "year"):
+                value = int((to_epoch_ms if self.epoch else local_ms)([value])[0])
+            b = max(int(np.searchsorted(index, value, side="left")) - 1, 0)
+            lo = b * block
+            return lo + int(np.searchsorted(ts[lo:lo + 2 * block], value, side="left"))
+
+        lo = 0 if start is None else locate(start)
+        hi = len(self) if end is None else locate(end)
+        return lo, max(lo, hi)
+
+    def read(self, start=None, end=None, columns=None):
+        """Dict of memory-mapped column slices for a time range."""
+        lo, hi = self.row_range(start, end)
+        return {name: self._column(name)[lo:hi] for name in (columns or self.columns)}
+
+    def to_frame(self, start=None, end=None, columns=None):
+        data = self.read(start, end, columns)
+        df = pd.DataFrame({name: np.asarray(col) for name, col in data.items()})
+        if "time_ms" in df:
+            df["time"] = (to_local_datetime(df["time_ms"]) if self.epoch
+                          else pd.to_datetime(df["time_ms"], unit="ms"))
+        return df
+
+
+def counting_frame(store, start=None, end=None):
+    """Main-region events in a time range laid out like `counting_data.csv` for the dashboard."""
+    df = store.to_frame(start, end)
+    if "zone" in df:
+        df = df[df["zone"] <= 0]
+    ins = df[df["event"] == 0].reset_index(drop=True)
+    outs = df[df["event"] == 1].reset_index(drop=True)
+    return pd.concat([
+        pd.DataFrame({"Move In": ins["count"], "In Time": ins["time"]}),
+        pd.DataFrame({"Move Out": outs["count"], "Out Time": outs["time"],
+                      "Stay Duration": outs["stay"].astype(float)}),
+    ], axis=1)[list(COUNTING_HEADER)]
+
+
+def _write_sorted(path, kind, data):
+    order = np.argsort(data["time_ms"], kind="stable")
+    valid = data["time_ms"][order] != np.iinfo(np.int64).min
+    store = ColumnStore(path, kind)
+    store.append({k: np.asarray(v)[order][valid] for k, v in data.items()})
+    return store
+
+
+def convert_counting_csv(csv_path, path):
+    """Convert a legacy counting_data.csv (In and Out columns side by side)."""
+    df = pd.read_csv(csv_path)
+    ins = df[["Move In", "In Time"]].dropna()
+    outs = df[["Move Out", "Out Time", "Stay Duration"]].dropna()
+    n_in, n_out = len(ins), len(outs)
+    return _write_sorted(path, "events", {
+        "time_ms": np.concatenate([to_epoch_ms(ins["In Time"]), to_epoch_ms(outs["Out Time"])]),
+        "event": np.r_[np.zeros(n_in), np.ones(n_out)],
+        "count": np.r_[ins["Move In"].to_numpy(), outs["Move Out"].to_numpy()],
+        "stay": np.r_[np.zeros(n_in), pd.to_numeric(outs["Stay Duration"], errors="coerce").to_numpy()],
+        "reason": np.zeros(n_in + n_out),
+    })
+
+
+def convert_journal(directory, path):
+    """Convert an event journal directory; zone names are kept in meta["zones"]."""
+    rows = list(read_events(directory))
+    zones = [""] + sorted({r[5] for r in rows} - {""})
+    zone_index = {zone: i for i, zone in enumerate(zones)}
+    store = _write_sorted(path, "events", {
+        "time_ms": to_epoch_ms([r[2] for r in rows]),
+        "event": np.array([EVENT_CODES[r[0]] for r in rows]),
+        "count": np.array([int(r[1]) for r in rows]),
+        "stay": np.array([float(r[3]) if r[3] else 0.0 for r in rows]),
+        "reason": np.array([REASON_CODES.get(r[4], 0) for r in rows]),
+        "zone": np.array([zone_index[r[5]] for r in rows]),
+    })
+    store.meta["zones"] = zones
+    store._write_meta()
+    return store
+
+
+def convert_detections_csv(csv_path, path):
+    """Convert detections.csv rows of (time, startX, startY, endX, endY, confidence)."""
+    df = pd.read_csv(csv_path, header=None, names=["time", "sx", "sy", "ex", "ey", "conf"])
+    return _write_sorted(path, "detections", {
+        "time_ms": to_epoch_ms(df["time"]),
+        "frame": np.full(len(df), -1),
+        "track": np.full(len(df), -1),
+        "sx": df["sx"].to_numpy(), "sy": df["sy"].to_numpy(),
+        "ex": df["ex"].to_numpy(), "ey": df["ey"].to_numpy(),
+        "conf": df["conf"].to_numpy(),
+    })
+
+
+def synthetic_counting_csv(path, rows, seed=0):
+    """Write a quoted counting_data.csv with `rows` visits, one every few seconds."""
+    rng = np.random.default_rng(seed)
+    t = pd.Timestamp("2025-01-01") + pd.to_timedelta(np.cumsum(rng.integers(1, 10, rows)), unit="s")
+    stays = np.round(rng.gamma(4.0, 0.75, rows), 2)
+    times = t.strftime("%Y-%m-%d %H:%M")
+    count = np.arange(1, rows + 1)
+    with open(path, "w", newline="") as f:
+        wr = csv.writer(f, quoting=csv.QUOTE_ALL)
+        wr.writerow(COUNTING_HEADER)
+        wr.writerows(zip(count, times, count, times, stays))
+
+
+def benchmark(rows, range_days=1, repeat=3):
+    """Time pd.read_csv against the column store on a synthetic log."""
+    def best(fn):
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - t0)
+        return min(timings)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "counting_data.csv")
+        synthetic_counting_csv(csv_path, rows)
+        t0 = time.perf_counter()
+        store = convert_counting_csv(csv_path, os.path.join(tmp, "events.col"))
+        convert_s = time.perf_counter() - t0
+
+        def load_csv():
+            df = pd.read_csv(csv_path)
+            df["In Time"] = pd.to_datetime(df["In Time"], errors="coerce", format="ISO8601")
+            df["Out Time"] = pd.to_datetime(df["Out Time"], errors="coerce", format="ISO8601")
+
+        first = to_local_datetime(store.read(columns=["time_ms"])["time_ms"][:1])[0]
+        result = {
+            "rows": rows,
+            "csv_bytes": os.path.getsize(csv_path),
+            "store_bytes": sum(os.path.getsize(os.path.join(store.path, f)) for f in os.listdir(store.path)),
+            "convert_s": round(convert_s, 4),
+            "read_csv_s": round(best(load_csv), 4),
+            "store_full_s": round(best(lambda: ColumnStore(store.path).to_frame()), 4),
+            "store_range_s": round(best(lambda: ColumnStore(store.path).to_frame(
+                first, first + pd.Timedelta(days=range_days))), 4),
+        }
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[INFO] %(message)s")
+    ap = argparse.ArgumentParser(description="Convert logs to the columnar format or benchmark it")
+    sub = ap.add_subparsers(dest="command", required=True)
+    for name in ("counting", "journal", "detections"):
+        p = sub.add_parser(name, help=f"convert a {name} log")
+        p.add_argument("source", help="CSV file or journal directory")
+        p.add_argument("store", help="output store directory (e.g. utils/data/logs/events.col)")
+    p = sub.add_parser("bench", help="compare load time against pd.read_csv")
+    p.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = ap.parse_args()
+
+    if args.command == "bench":
+        print(json.dumps([benchmark(n) for n in args.rows], indent=2))
+    else:
+        convert = {"counting": convert_counting_csv, "journal": convert_journal,
+                   "detections": convert_detections_csv}[args.command]
+        store = convert(args.source, args.store)
+        logger.info(f"Wrote {len(store)} rows to {args.store}")
@@ -0,0 +1,89 @@
+import json
+import logging
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class ControlServer:
+    """Local HTTP control channel for a running counter.
+
+    GET  /region    current region of every camera as JSON
+    POST /region    JSON body {"camera": name, "rect": [x, y, w, h], "tilt": deg}
+                    or {"camera": name, "polygon": [[x, y], ...]}
+
+    `get_regions()` returns the JSON-able state and `set_region(body)`
+    applies an update, raising ValueError for a bad request.
+    """
+
+    def __init__(self, get_regions, set_region, port, host="127.0.0.1"):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != "/region":
+                    self.send_error(404)
+                    return
+                self._reply(200, server.get_regions())
+
+            def do_POST(self):
+                if self.path != "/region":
+                    self.send_error(404)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    self._reply(200, server.set_region(body))
+                except (ValueError, TypeError, KeyError) as e:
+                    self._reply(400, {"error": str(e)})
+
+            def log_message(self, format, *args):
+                pass
+
+        self.get_regions = get_regions
+        self.set_region = set_region
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="control", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Region control on http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/region")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def push_region(port, rect=None, tilt=0, polygon=None, camera=None, host="127.0.0.1", timeout=2.0):
+    """Send a region to a running counter; returns its reply as a dict."""
+    body = {"rect": rect, "tilt": tilt, "polygon": polygon}
+    if camera is not None:
+        body["camera"] = camera
+    request = urllib.request.Request(f"http://{host}:{port}/region", data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def tweak_target(config):
+    """(frame ring name, camera) the region tweak tools preview and apply to.
+
+    In multi-source mode the counter names its cameras cam0, cam1, ... and
+    publishes their frames to `<frame_ring>_cam0`, ...; "tweak_camera" in
+    config.json picks one, and the region is then sent for that camera.
+    """
+    ring, camera = config.get("frame_ring"), config.get("tweak_camera")
+    if ring and camera and camera != "main":
+        ring = f"{ring}_{camera}"
+    return ring, camera
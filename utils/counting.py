@@ -0,0 +1,309 @@
+import math
+import resource
+
+import cv2
+import numpy as np
+
+from utils.region import RegionMask, ZoneMap, validate_zones
+from utils.timing import WallClock
+
+
+def keystone_polygon(x, y, w, h, tilt_deg, frame_width):
+    tilt_rad = math.radians(tilt_deg)
+    max_shift = w // 3
+    shift = int(max_shift * math.sin(abs(tilt_rad)))
+    if tilt_deg > 0:
+        pts = np.array([
+            [x + shift, y],
+            [x + w - shift, y],
+            [x + w, y + h],
+            [x, y + h]
+        ])
+    else:
+        pts = np.array([
+            [x, y],
+            [x + w, y],
+            [x + w - shift, y + h],
+            [x + shift, y + h]
+        ])
+    pts[:, 0] = np.clip(pts[:, 0], 0, frame_width - 1)
+    return pts
+
+
+class RegionTrackable:
+    __slots__ = ("track_id", "inside", "entry_frame", "entry_timestamp", "entry_mono", "last_frame",
+                 "zone_bits", "zone_version", "zone_entries")
+
+    def __init__(self, track_id, inside=False, entry_frame=None, entry_timestamp=None, last_frame=None):
+        self.track_id = track_id
+        self.inside = inside
+        self.entry_frame = entry_frame
+        self.entry_timestamp = entry_timestamp
+        self.entry_mono = None
+        self.last_frame = last_frame
+        # Extra zones: bit set of the last frame, the ZoneMap it came from, open visits
+        # as {zone name: monotonic entry time}
+        self.zone_bits = 0
+        self.zone_version = None
+        self.zone_entries = None
+
+
+class RegionCounter:
+    """Counts tracked people entering and leaving the counting polygon.
+
+    `clock` maps frame indices to capture times (see `utils.timing`):
+    `clock.wall(i)` is the datetime stamped on events and `clock.mono(i)` the
+    monotonic time stay durations are measured in. It defaults to the wall
+    clock; the pipeline passes each camera's FrameClock and batch processing
+    a video-time clock.
+    Closed visits are also fed to the optional `sketches` writer.
+    Call `evict()` with the ids the tracker still holds so state for dropped
+    tracks is released and their open visits are closed as "lost".
+    `set_region()` swaps the counting region while running; track state is
+    kept, so people simply enter or leave the new region on later frames.
+    Optional named `zones` and tripwires (see `ZoneMap`) are counted
+    alongside the main region with their own per-zone counts in the journal.
+    """
+    def __init__(self, journal, feed_fps, rect, tilt_angle, clock=None, sketches=None, zones=None):
+        self.journal = journal
+        self.sketches = sketches
+        self.feed_fps = feed_fps
+        self.rect = rect
+        self.tilt_angle = tilt_angle
+        self.custom_polygon = None
+        self.clock = clock or WallClock()
+        self.frame_size = None
+        self.region = None
+        self.zone_specs = []
+        self.zone_map = None
+        self.zone_counts = {}
+        self.set_zones(zones)
+        self.trackableObjects = {}
+        self.totalIn = 0
+        self.totalOut = 0
+        self.evicted = 0
+        self.lost = 0
+        self.peak_tracks = 0
+
+    @property
+    def polygon(self):
+        return None if self.region is None else self.region.polygon
+
+    def set_frame_size(self, W, H):
+        self.frame_size = (W, H)
+        self.set_region(self.rect, self.tilt_angle, self.custom_polygon)
+        self.set_zones(self.zone_specs)
+
+    def set_zones(self, zones):
+        """Use a new list of named zones/tripwires; swapped in like `set_region()`.
+
+        Tracks keep their open zone visits for zones that still contain them.
+        Invalid zones raise ValueError and leave the current ones in place.
+        """
+        self.swap_zones(*self.build_zones(zones))
+
+    def build_zones(self, zones):
+        """Validated zone specs and their ZoneMap (None until the frame size is known)."""
+        specs = list(zones or [])
+        validate_zones(specs)
+        zone_map = ZoneMap(specs, *self.frame_size) if specs and self.frame_size is not None else None
+        return specs, zone_map
+
+    def swap_zones(self, specs, zone_map):
+        """Switch to zones from `build_zones()`."""
+        for zone in specs:
+            self.zone_counts.setdefault(str(zone["name"]), [0, 0])
+        self.zone_map = zone_map
+        self.zone_specs = specs
+
+    def set_region(self, rect=None, tilt_angle=0, polygon=None):
+        """Use a new rect + tilt, or an explicit polygon, as the counting region.
+
+        The mask is built before it replaces the old one in a single
+        assignment, so a frame is always counted against one whole region.
+        If building it fails nothing changes.
+        """
+        self.swap_region(*self.build_region(rect, tilt_angle, polygon))
+
+    def build_region(self, rect=None, tilt_angle=0, polygon=None):
+        """(rect, tilt, polygon, RegionMask) of a region; the mask is None until the frame size is known."""
+        rect = tuple(rect) if rect is not None else (None, None, None, None)
+        custom_polygon = None if polygon is None else np.asarray(polygon, dtype=int).reshape(-1, 2)
+        if self.frame_size is None:
+            return rect, tilt_angle, custom_polygon, None
+        W, H = self.frame_size
+        if custom_polygon is not None:
+            pts = np.clip(custom_polygon, 0, [W - 1, H - 1])
+        else:
+            rect_x, rect_y, rect_w, rect_h = rect
+            if None in rect:
+                rect_w = W
+                rect_h = H // 4
+                rect_x = 0
+                rect_y = (H // 2) - (rect_h // 2)
+            pts = keystone_polygon(rect_x, rect_y, rect_w, rect_h, tilt_angle, W)
+        return rect, tilt_angle, custom_polygon, RegionMask(pts, W, H)
+
+    def swap_region(self, rect, tilt_angle, custom_polygon, region):
+        """Switch to a region from `build_region()`."""
+        self.rect = rect
+        self.tilt_angle = tilt_angle
+        self.custom_polygon = custom_polygon
+        if region is not None:
+            self.region = region
+
+    def region_params(self):
+        return {
+            "rect": list(self.rect),
+            "tilt": self.tilt_angle,
+            "polygon": None if self.polygon is None else self.polygon.tolist(),
+            "zones": self.zone_specs,
+        }
+
+    def update(self, tracked_objects, frame_index):
+        """Update region state and log crossings; returns (id, cx, cy) per track."""
+        if not tracked_objects:
+            return []
+        centroids = np.array([obj.estimate[0] for obj in tracked_objects]).astype(int)
+        insides = self.region.contains(centroids)
+        zone_map = self.zone_map
+        zone_bits = zone_map.lookup(centroids).tolist() if zone_map is not None else None
+
+        points = []
+        for i, (obj, (cx, cy), inside) in enumerate(zip(tracked_objects, centroids.tolist(), insides.tolist())):
+            tid = obj.id
+            to = self.trackableObjects.get(tid)
+
+            if to is None:
+                # First sighting
+                to = RegionTrackable(tid, inside)
+                if inside:
+                    self._enter(to, frame_index)
+                if zone_map is not None:
+                    to.zone_version = zone_map.version
+                    self._update_zones(to, zone_map, zone_bits[i], frame_index)
+            else:
+                if zone_map is not None:
+                    self._update_zones(to, zone_map, zone_bits[i], frame_index)
+                if not to.inside and inside:
+                    self._enter(to, frame_index)
+                elif to.inside and not inside and to.entry_frame is not None:
+                    self._exit(to, frame_index)
+
+                to.inside = inside
+
+            to.last_frame = frame_index
+            self.trackableObjects[tid] = to
+            points.append((tid, cx, cy))
+        self.peak_tracks = max(self.peak_tracks, len(self.trackableObjects))
+        return points
+
+    def evict(self, alive_ids):
+        """Drop state for tracks the tracker no longer holds, closing open visits.
+
+        `alive_ids` may hold None for tracks Norfair is still initializing,
+        so its size says nothing about which known tracks are gone.
+        """
+        for tid in [tid for tid in self.trackableObjects if tid not in alive_ids]:
+            to = self.trackableObjects.pop(tid)
+            if to.inside and to.entry_frame is not None:
+                self.lost += 1
+                self._exit(to, to.last_frame, reason="lost")
+            for zone in list(to.zone_entries or ()):
+                self._zone_event(to, zone, "exit", to.last_frame, reason="lost")
+            self.evicted += 1
+
+    def memory_stats(self):
+        return {
+            "live_tracks": len(self.trackableObjects),
+            "peak_tracks": self.peak_tracks,
+            "evicted_tracks": self.evicted,
+            "lost_visits": self.lost,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    def _enter(self, to, frame_index):
+        entry_ts = self.clock.wall(frame_index)
+        to.entry_frame = frame_index
+        to.entry_timestamp = entry_ts
+        to.entry_mono = self.clock.mono(frame_index)
+        self.totalIn += 1
+        self.journal.record_in(self.totalIn, entry_ts)
+
+    def _exit(self, to, frame_index, reason="exit"):
+        exit_ts = self.clock.wall(frame_index)
+        self.totalOut += 1
+        dur = max(0.0, self.clock.mono(frame_index) - to.entry_mono)
+        self.journal.record_out(self.totalOut, exit_ts, round(dur, 3), reason)
+        if self.sketches is not None:
+            self.sketches.add(exit_ts, dur)
+        to.entry_frame = None
+        to.entry_timestamp = None
+        to.entry_mono = None
+
+    def _update_zones(self, to, zone_map, bits, frame_index):
+        if to.zone_version != zone_map.version:
+            # Zones were reconfigured: take the new bits as a baseline without events
+            if to.zone_entries:
+                inside = zone_map.inside(bits)
+                to.zone_entries = {z: t for z, t in to.zone_entries.items() if z in inside} or None
+            to.zone_version = zone_map.version
+        elif bits != to.zone_bits:
+            for zone, event in zone_map.transitions(to.zone_bits, bits):
+                self._zone_event(to, zone, event, frame_index)
+        to.zone_bits = bits
+
+    def _zone_event(self, to, zone, event, frame_index, reason="exit"):
+        counts = self.zone_counts.setdefault(zone, [0, 0])
+        ts = self.clock.wall(frame_index)
+        if event == "enter":
+            counts[0] += 1
+            to.zone_entries = to.zone_entries or {}
+            to.zone_entries[zone] = self.clock.mono(frame_index)
+            self.journal.record_in(counts[0], ts, zone=zone)
+        elif event == "exit":
+            entry_mono = to.zone_entries.pop(zone, None) if to.zone_entries else None
+            if entry_mono is None:
+                return
+            counts[1] += 1
+            dur = max(0.0, self.clock.mono(frame_index) - entry_mono)
+            self.journal.record_out(counts[1], ts, round(dur, 3), reason, zone=zone)
+        else:
+            counts[0 if event == "forward" else 1] += 1
+            self.journal.record_cross(counts[0 if event == "forward" else 1], ts, event, zone)
+
+
+def decode_detections(detections, W, H, confidence, person_class=15):
+    """Filter a `net.forward()` tensor to confident people in one pass.
+
+    Returns an (N, 2) int array of box centroids in frame coordinates, the
+    matching (N,) confidence scores and the (N, 4) int boxes.
+    """
+    rows = detections.reshape(-1, detections.shape[-1])
+    keep = (rows[:, 2] >= confidence) & (rows[:, 1].astype(int) == person_class)
+    rows = rows[keep]
+    boxes = (rows[:, 3:7] * np.array([W, H, W, H])).astype(int)
+    centroids = np.stack(((boxes[:, 0] + boxes[:, 2]) // 2,
+                          (boxes[:, 1] + boxes[:, 3]) // 2), axis=1)
+    return centroids, rows[:, 2].astype(np.float32), boxes
+
+
+def draw_overlay(frame, polygon, points, totals, zones=()):
+    H = frame.shape[0]
+    totalIn, totalOut = totals
+    if polygon is not None:
+        cv2.polylines(frame, [polygon], isClosed=True, color=(0, 0, 255), thickness=2)
+    for zone in zones:
+        pts = np.asarray(zone.get("line", zone.get("polygon")), dtype=np.int32)
+        cv2.polylines(frame, [pts], isClosed="polygon" in zone, color=(0, 255, 255), thickness=1)
+        cv2.putText(frame, str(zone["name"]), tuple(int(v) for v in pts[0]),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 255), 1)
+    for tid, cx, cy in points:
+        cv2.putText(frame, f"ID {tid}", (cx-10, cy-10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 2)
+        cv2.circle(frame, (cx, cy), 4, (255,255,255), -1)
+
+    cv2.putText(frame, f"In: {totalIn}", (10, H-40),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
+    cv2.putText(frame, f"Out: {totalOut}", (10, H-20),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
@@ -0,0 +1,210 @@
+import datetime
+import logging
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x50434652  # "PCFR"
+VERSION = 1
+HEADER_WORDS = 8
+META_WORDS = 8
+# Header: [magic, version, slots, slot_bytes, latest_seq, owner_pid, retired, 0]
+# Slot meta: [seq, frame_number, timestamp_ns, height, width, channels, 0, 0]
+SEQ, FRAME, TIME_NS, HEIGHT, WIDTH, CHANNELS = range(6)
+LATEST, OWNER, RETIRED = 4, 5, 6
+
+
+def _layout(slots):
+    meta_offset = HEADER_WORDS * 8
+    data_offset = -(-(meta_offset + slots * META_WORDS * 8) // 64) * 64
+    return meta_offset, data_offset
+
+
+class FrameRing:
+    """Fixed-slot ring of uint8 frames in shared memory.
+
+    One process publishes frames and any number of others attach by name
+    and read the newest one without pipes or re-encoding. Each slot has a
+    metadata row with a sequence number that is cleared while the slot is
+    being written, so a reader can tell a complete frame from a torn one.
+    Frames larger than the slot size chosen at creation are skipped; the
+    writer recreates the ring for them and marks the old one retired so
+    readers re-attach. The header records the writer's pid, and a ring
+    whose writer is still alive is never replaced.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if self.header[0] != MAGIC or self.header[1] != VERSION:
+            raise ValueError(f"{shm.name} is not a frame ring")
+        self.slots = int(self.header[2])
+        self.slot_bytes = int(self.header[3])
+        meta_offset, data_offset = _layout(self.slots)
+        self.meta = np.ndarray((self.slots, META_WORDS), dtype=np.int64, buffer=shm.buf, offset=meta_offset)
+        self.data = np.ndarray((self.slots, self.slot_bytes), dtype=np.uint8, buffer=shm.buf, offset=data_offset)
+
+    @classmethod
+    def create(cls, name, slot_bytes, slots=4):
+        """Create (or replace a stale) ring with `slots` slots of `slot_bytes` each.
+
+        Raises FileExistsError when a live process still writes to `name`.
+        """
+        _, data_offset = _layout(slots)
+        size = data_offset + slots * slot_bytes
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            pid = cls.owner(name)
+            if pid is not None:
+                raise FileExistsError(f"frame ring {name} is in use by process {pid}")
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = (MAGIC, VERSION, slots, slot_bytes, 0, os.getpid(), 0, 0)
+        return cls(shm, owner=True)
+
+    @staticmethod
+    def owner(name):
+        """Pid of the live process writing ring `name`, or None if there is none."""
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        pid = 0
+        if shm.size >= HEADER_WORDS * 8:
+            header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+            if header[0] == MAGIC and not header[RETIRED]:
+                pid = int(header[OWNER])
+            del header
+        shm.close()
+        if pid != os.getpid():
+            # Like attach(): looking must not unlink the segment when this process exits
+            try:
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+        if pid <= 0:
+            return None
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None
+        except PermissionError:
+            pass
+        return pid
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # Readers must not unlink the writer's segment when they exit
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return cls(shm, owner=False)
+
+    def publish(self, frame, frame_number, timestamp=None):
+        """Copy a frame into the next slot; returns its sequence number, or None if it does not fit."""
+        if frame.nbytes > self.slot_bytes:
+            logger.warning(f"{self.shm.name}: skipping a frame of {frame.nbytes} bytes, slots hold {self.slot_bytes}")
+            return None
+        seq = int(self.header[LATEST]) + 1
+        meta = self.meta[seq % self.slots]
+        meta[SEQ] = 0
+        self.data[seq % self.slots, :frame.nbytes] = frame.reshape(-1)
+        h, w = frame.shape[:2]
+        ts = (timestamp or datetime.datetime.now()).timestamp()
+        meta[FRAME:CHANNELS + 1] = (frame_number, int(ts * 1e9), h, w, frame.shape[2] if frame.ndim == 3 else 1)
+        meta[SEQ] = seq
+        self.header[LATEST] = seq
+        return seq
+
+    def latest(self, copy=True):
+        """Newest complete frame as (frame, info), or None before the first publish.
+
+        With `copy=False` the frame is a view into shared memory that stays
+        valid until the writer laps the ring; check it with `is_current()`.
+        """
+        for _ in range(self.slots):
+            seq = int(self.header[LATEST])
+            if seq == 0:
+                return None
+            meta = self.meta[seq % self.slots].copy()
+            if meta[SEQ] != seq:
+                continue
+            h, w, c = int(meta[HEIGHT]), int(meta[WIDTH]), int(meta[CHANNELS])
+            view = self.data[seq % self.slots, :h * w * c].reshape((h, w, c) if c > 1 else (h, w))
+            frame = view.copy() if copy else view
+            if copy and not self.is_current(seq):
+                continue
+            info = {"seq": seq, "frame": int(meta[FRAME]),
+                    "timestamp": datetime.datetime.fromtimestamp(meta[TIME_NS] / 1e9)}
+            return frame, info
+        return None
+
+    def is_current(self, seq):
+        """True while the slot holding `seq` has not been overwritten."""
+        return int(self.meta[seq % self.slots, SEQ]) == seq
+
+    @property
+    def retired(self):
+        """True once the writer has closed or replaced this ring."""
+        return bool(self.header[RETIRED])
+
+    def close(self):
+        if self.owner:
+            self.header[RETIRED] = 1
+        # Views into the buffer must go before it can be closed
+        del self.header, self.meta, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingCapture:
+    """`cv2.VideoCapture`-like reader of the newest frame in a FrameRing."""
+
+    def __init__(self, name, timeout=5.0):
+        self.name = name
+        self.ring = FrameRing.attach(name)
+        deadline = time.monotonic() + timeout
+        while self.ring.latest(copy=False) is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def read(self):
+        if self.ring.retired:
+            # The writer restarted the ring (e.g. for a new frame size)
+            try:
+                ring = FrameRing.attach(self.name)
+            except (FileNotFoundError, ValueError):
+                return False, None
+            self.ring.close()
+            self.ring = ring
+        latest = self.ring.latest()
+        if latest is None:
+            return False, None
+        return True, latest[0]
+
+    def release(self):
+        self.ring.close()
+
+
+def open_capture(ring_name=None, fallback=0):
+    """Attach to the counter's frame ring when it is running, else open a camera."""
+    if ring_name:
+        try:
+            cap = RingCapture(ring_name)
+            logger.info(f"Reading frames from shared memory ring {ring_name}")
+            return cap
+        except (FileNotFoundError, ValueError):
+            logger.info(f"Frame ring {ring_name} not found, opening camera {fallback}")
+    return cv2.VideoCapture(fallback)
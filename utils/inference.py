@@ -0,0 +1,279 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# MobileNet-SSD preprocessing: (pixel - 127.5) * 0.007843 on BGR input of 300x300
+SCALE = 0.007843
+MEAN = (127.5, 127.5, 127.5)
+INPUT_SIZE = 300
+PERSON_CLASS = 15
+DEFAULT_THREADS = cv2.getNumThreads()
+
+OPENCV_BACKENDS = {
+    "default": cv2.dnn.DNN_BACKEND_DEFAULT,
+    "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+    "openvino": getattr(cv2.dnn, "DNN_BACKEND_INFERENCE_ENGINE", cv2.dnn.DNN_BACKEND_DEFAULT),
+    "cuda": getattr(cv2.dnn, "DNN_BACKEND_CUDA", cv2.dnn.DNN_BACKEND_DEFAULT),
+}
+OPENCV_TARGETS = {
+    "cpu": cv2.dnn.DNN_TARGET_CPU,
+    "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+    "opencl-fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+    "cuda": getattr(cv2.dnn, "DNN_TARGET_CUDA", cv2.dnn.DNN_TARGET_CPU),
+    "cuda-fp16": getattr(cv2.dnn, "DNN_TARGET_CUDA_FP16", cv2.dnn.DNN_TARGET_CPU),
+}
+
+
+class Detector:
+    """SSD person detector on top of an inference backend.
+
+    `detect(images)` returns one array of DetectionOutput rows
+    [image id, class, score, x0, y0, x1, y1] per image, with box corners
+    relative to that image (0..1), so callers rescale by their own crop
+    size. With `input_size` (the network's native 300) every image is
+    resized to it and the whole batch runs in one forward; with 0 images
+    keep their size and equally sized ones share a forward.
+
+    `frame_sizes` optionally gives the (W, H) of the frame each image was
+    cropped from. A crop then runs at its share of `input_size` (rounded up
+    to 32 pixels), so people appear at the same scale as in a full-frame
+    forward and a smaller crop costs proportionally less.
+    """
+
+    name = "detector"
+
+    def __init__(self, input_size=INPUT_SIZE, swap_rb=False):
+        self.input_size = input_size
+        self.swap_rb = swap_rb
+
+    def blob(self, images, size):
+        return cv2.dnn.blobFromImages(images, SCALE, size, MEAN, swapRB=self.swap_rb)
+
+    def forward(self, blob):
+        """Raw rows for a preprocessed batch, column 0 holding the batch index."""
+        raise NotImplementedError
+
+    def blob_size(self, image, frame_size=None):
+        """(width, height) the network sees `image` at."""
+        if not self.input_size:
+            return image.shape[1::-1]
+        if frame_size is None:
+            return self.input_size, self.input_size
+        return tuple(min(self.input_size, max(32, -(-self.input_size * crop // full // 32) * 32))
+                     for crop, full in zip(image.shape[1::-1], frame_size))
+
+    def detect(self, images, frame_sizes=None):
+        frame_sizes = frame_sizes or [None] * len(images)
+        groups = {}
+        for i, (image, frame_size) in enumerate(zip(images, frame_sizes)):
+            groups.setdefault(self.blob_size(image, frame_size), []).append(i)
+        results = [None] * len(images)
+        for size, members in groups.items():
+            rows = self.forward(self.blob([images[i] for i in members], size))
+            for b, i in enumerate(members):
+                results[i] = rows[rows[:, 0] == b]
+        return results
+
+    def warm_up(self, runs=2, batch=1):
+        """Run dummy forwards so lazy allocation and kernel selection happen at startup."""
+        size = self.input_size or INPUT_SIZE
+        images = [np.zeros((size, size, 3), dtype=np.uint8)] * batch
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.detect(images)
+        logger.info(f"{self.name}: warm-up took {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+class OpenCVDetector(Detector):
+    """Caffe MobileNet-SSD through OpenCV DNN with an explicit backend and target."""
+
+    def __init__(self, prototxt, model, backend="default", target="cpu", threads=None, input_size=INPUT_SIZE):
+        super().__init__(input_size)
+        if not prototxt:
+            raise ValueError("the OpenCV backend needs --prototxt with the Caffe deploy file")
+        # OpenCV's thread pool is process-wide; set it per forward only when asked to
+        self.threads = threads
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.net.setPreferableBackend(OPENCV_BACKENDS[backend])
+        self.net.setPreferableTarget(OPENCV_TARGETS[target])
+        self.name = f"opencv-{backend}-{target}"
+
+    def forward(self, blob):
+        if self.threads:
+            cv2.setNumThreads(self.threads)
+        self.net.setInput(blob)
+        detections = self.net.forward()
+        # SSD's DetectionOutput stacks every image's rows
+        return detections.reshape(-1, detections.shape[-1])
+
+
+class OnnxDetector(Detector):
+    """MobileNet-SSD converted to ONNX, run with ONNX Runtime on the CPU.
+
+    Two export layouts are understood: a single DetectionOutput-style
+    output of [image id, class, score, x0, y0, x1, y1] rows (as converted
+    from the Caffe model), or separate per-prior `scores` (N, P, classes)
+    and corner-form `boxes` (N, P, 4), which are reduced to people with
+    non-maximum suppression. Set `swap_rb` for exports trained on RGB.
+    """
+
+    def __init__(self, model, threads=None, input_size=INPUT_SIZE, swap_rb=False, nms_threshold=0.45,
+                 min_score=0.2):
+        super().__init__(input_size, swap_rb)
+        try:
+            import onnxruntime
+        except ImportError:
+            raise SystemExit("the onnx backend needs onnxruntime (pip install onnxruntime)")
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.outputs = [o.name for o in self.session.get_outputs()]
+        self.nms_threshold = nms_threshold
+        self.min_score = min_score
+        self.name = "onnxruntime-cpu"
+
+    def forward(self, blob):
+        outputs = self.session.run(None, {self.input_name: blob})
+        if len(outputs) == 1:
+            return outputs[0].reshape(-1, 7)
+        named = dict(zip(self.outputs, outputs))
+        scores = named.get("scores", outputs[0])
+        boxes = named.get("boxes", outputs[1])
+        rows = []
+        for b in range(scores.shape[0]):
+            person = scores[b, :, PERSON_CLASS]
+            keep = np.flatnonzero(person >= self.min_score)
+            if not len(keep):
+                continue
+            corners = boxes[b, keep]
+            rects = np.c_[corners[:, :2], corners[:, 2:] - corners[:, :2]].tolist()
+            for k in np.asarray(cv2.dnn.NMSBoxes(rects, person[keep].tolist(), self.min_score,
+                                                 self.nms_threshold)).reshape(-1):
+                rows.append((b, PERSON_CLASS, person[keep[k]], *corners[k]))
+        return np.array(rows, dtype=np.float32).reshape(-1, 7)
+
+
+def load_detector(args):
+    """Build the detector selected by the --backend, --dnn-* and --input-size flags."""
+    if args["backend"] == "onnx":
+        detector = OnnxDetector(args["model"], args.get("dnn_threads"), args["input_size"])
+    else:
+        detector = OpenCVDetector(args["prototxt"], args["model"], args["dnn_backend"], args["dnn_target"],
+                                  args.get("dnn_threads"), args["input_size"])
+    size = f"{detector.input_size}x{detector.input_size}" if detector.input_size else "frame size"
+    logger.info(f"Inference backend {detector.name}, input {size}")
+    return detector
+
+
+def _match(reference, rows, iou=0.5):
+    """Matched pairs of person boxes between two row arrays (greedy by IoU)."""
+    pairs, used = [], set()
+    for i, r in enumerate(reference):
+        best, best_iou = None, iou
+        for j, c in enumerate(rows):
+            if j in used:
+                continue
+            x0, y0 = max(r[3], c[3]), max(r[4], c[4])
+            x1, y1 = min(r[5], c[5]), min(r[6], c[6])
+            inter = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+            union = (r[5] - r[3]) * (r[6] - r[4]) + (c[5] - c[3]) * (c[6] - c[4]) - inter
+            if union > 0 and inter / union >= best_iou:
+                best, best_iou = j, inter / union
+        if best is not None:
+            used.add(best)
+            pairs.append((i, best))
+    return pairs
+
+
+def compare(detectors, frames, confidence=0.4):
+    """Latency of every detector and its agreement with the first one on `frames`.
+
+    Agreement counts confident person boxes matched at IoU >= 0.5: recall
+    is the share of the reference's boxes found, precision the share of
+    the detector's boxes that match one.
+    """
+    reference = None
+    report = []
+    for detector in detectors:
+        detector.warm_up()
+        latencies, found = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            rows = detector.detect([frame])[0]
+            latencies.append(time.perf_counter() - start)
+            found.append(rows[(rows[:, 2] >= confidence) & (rows[:, 1].astype(int) == PERSON_CLASS)])
+        reference = found if reference is None else reference
+        ms = np.array(latencies) * 1000
+        entry = {"backend": detector.name, "input_size": detector.input_size, "frames": len(frames),
+                 "mean_ms": round(float(ms.mean()), 2), "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                 "p95_ms": round(float(np.percentile(ms, 95)), 2), "people": int(sum(len(f) for f in found))}
+        matched = sum(len(_match(r, f)) for r, f in zip(reference, found))
+        ref_total, own_total = sum(len(r) for r in reference), entry["people"]
+        entry["recall"] = round(matched / ref_total, 3) if ref_total else None
+        entry["precision"] = round(matched / own_total, 3) if own_total else None
+        report.append(entry)
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[INFO] %(message)s")
+    ap = argparse.ArgumentParser(description="Compare inference backends on CPU: latency and agreement")
+    ap.add_argument("-p", "--prototxt", default="models/MobileNetSSD_deploy.prototxt")
+    ap.add_argument("-m", "--model", required=True, help="Caffe model; the first, full-size run is the reference")
+    ap.add_argument("--onnx", default=None, help="also run this ONNX model with ONNX Runtime")
+    ap.add_argument("-i", "--input", default=None,
+                    help="video to take frames from (default: a generated clip, which has no people to agree on)")
+    ap.add_argument("--frames", type=int, default=200)
+    ap.add_argument("--threads", type=int, nargs="+", default=[0],
+                    help="OpenCV/ONNX Runtime thread counts to try (0 = library default)")
+    ap.add_argument("-c", "--confidence", type=float, default=0.4)
+    ap.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    args = ap.parse_args()
+
+    import imutils
+    import tempfile
+    from utils.benchmark import synthetic_clip
+    tmp = tempfile.TemporaryDirectory()
+    if args.input is None:
+        args.input = os.path.join(tmp.name, "clip.avi")
+        synthetic_clip(args.input, args.frames)
+    cap = cv2.VideoCapture(args.input)
+    frames = []
+    while len(frames) < args.frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(imutils.resize(frame, width=500))
+    cap.release()
+    tmp.cleanup()
+
+    detectors = [OpenCVDetector(args.prototxt, args.model, "opencv", "cpu", DEFAULT_THREADS, input_size=0)]
+    detectors[0].name += "-full-frame"
+    for threads in args.threads:
+        detector = OpenCVDetector(args.prototxt, args.model, "opencv", "cpu", threads or DEFAULT_THREADS)
+        detector.name += f"-{threads or DEFAULT_THREADS}threads"
+        detectors.append(detector)
+        if args.onnx:
+            detector = OnnxDetector(args.onnx, threads or None)
+            detector.name += f"-{threads or 'default'}threads"
+            detectors.append(detector)
+
+    report = compare(detectors, frames, args.confidence)
+    for entry in report:
+        logger.info(f"{entry['backend']}: {entry['mean_ms']} ms mean, {entry['p95_ms']} ms p95, "
+                    f"recall {entry['recall']}, precision {entry['precision']}")
+    text = json.dumps({"input": args.input, "results": report}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
@@ -0,0 +1,198 @@
+import argparse
+import csv
+import datetime
+import glob
+import logging
+import os
+import time
+from itertools import zip_longest
+
+from utils.timing import epoch_ms, format_time
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_HEADER = ("Event", "Count", "Time", "Stay Duration", "Reason", "Zone", "Epoch ms")
+JOURNAL_EVENTS = ("in", "out", "cross")
+COUNTING_HEADER = ("Move In", "In Time", "Move Out", "Out Time", "Stay Duration")
+FSYNC_POLICIES = ("always", "batch", "never")
+
+
+class EventJournal:
+    """Append-only CSV journal with one row per entry/exit/crossing event.
+
+    The Zone column is empty for the main counting region and names the
+    zone or tripwire otherwise; counts run separately per zone. Events are
+    stamped with a datetime: Time holds it in local time to the millisecond
+    and Epoch ms as Unix epoch milliseconds.
+
+    Rows are buffered in memory and written in batches once `flush_size`
+    events are pending or `flush_interval` seconds have passed. `fsync`
+    controls durability: "always" syncs after every event, "batch" after
+    every flush and "never" leaves it to the OS. Files rotate daily and
+    whenever they grow past `max_bytes` (0 disables size rotation).
+    Each event is also handed to the optional `publisher` (see
+    `utils.aggregator.EventPublisher`) as soon as it is recorded.
+    """
+
+    def __init__(self, directory="utils/data/logs/journal", prefix="events",
+                 flush_size=64, flush_interval=5.0, fsync="batch",
+                 max_bytes=10 * 1024 * 1024, publisher=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        self.directory = directory
+        self.prefix = prefix
+        self.flush_size = max(1, int(flush_size))
+        self.flush_interval = float(flush_interval)
+        self.fsync = fsync
+        self.max_bytes = int(max_bytes)
+        self.publisher = publisher
+        self._buffer = []
+        self._file = None
+        self._writer = None
+        self._day = None
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a journal from the optional "journal" section of config.json."""
+        return cls(**config.get("journal", {}))
+
+    def record_in(self, count, timestamp, zone=""):
+        self._append(("in", count, timestamp, "", "", zone))
+
+    def record_out(self, count, timestamp, duration, reason="exit", zone=""):
+        """Record a visit ending; `reason` is "exit" or "lost" (track dropped inside)."""
+        self._append(("out", count, timestamp, duration, reason, zone))
+
+    def record_cross(self, count, timestamp, direction, zone):
+        """Record a tripwire crossing; `direction` ("forward"/"backward") goes in the Reason column."""
+        self._append(("cross", count, timestamp, "", direction, zone))
+
+    def _append(self, row):
+        timestamp = row[2]
+        if isinstance(timestamp, datetime.datetime):
+            row = row[:2] + (format_time(timestamp),) + row[3:] + (epoch_ms(timestamp),)
+        else:
+            # An already formatted time has no epoch value
+            row = row + ("",)
+        self._buffer.append(row)
+        if self.publisher is not None:
+            self.publisher.publish(row)
+        if (self.fsync == "always" or len(self._buffer) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def poll(self):
+        """Flush pending events if the time threshold has passed."""
+        if self._buffer and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        self._maybe_rotate()
+        self._writer.writerows(self._buffer)
+        self._buffer.clear()
+        self._file.flush()
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def _maybe_rotate(self):
+        today = datetime.date.today().strftime("%Y%m%d")
+        if self._file is not None and self._day == today and (
+                not self.max_bytes or self._file.tell() < self.max_bytes):
+            return
+        if self._file is not None:
+            self._file.close()
+        self._day = today
+        path = self._next_path(today)
+        self._file = open(path, "a", newline="")
+        self._writer = csv.writer(self._file, quoting=csv.QUOTE_ALL)
+        if self._file.tell() == 0:
+            self._writer.writerow(JOURNAL_HEADER)
+        logger.info(f"Journal writing to {path}")
+
+    def _next_path(self, day):
+        seq = 0
+        while True:
+            path = os.path.join(self.directory, f"{self.prefix}-{day}-{seq:03d}.csv")
+            if not os.path.exists(path) or not self.max_bytes or os.path.getsize(path) < self.max_bytes:
+                return path
+            seq += 1
+
+
+def journal_files(directory, prefix="events"):
+    """Journal files in the order they were written."""
+    return sorted(glob.glob(os.path.join(directory, f"{prefix}-*.csv")))
+
+
+def normalize_row(row):
+    """Pad a journal row to the current seven columns.
+
+    Journals written before exit reasons existed have four columns, those
+    written before zones existed have five and those written before
+    millisecond times existed have six (Time then holds whole minutes).
+    """
+    if len(row) == 4:
+        row = row + ["exit" if row[0] == "out" else ""]
+    return (list(row) + ["", ""])[:7]
+
+
+def read_events(directory, prefix="events"):
+    """Yield (event, count, time, stay duration, reason, zone, epoch ms) rows from every journal file."""
+    for path in journal_files(directory, prefix):
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            for row in reader:
+                if row and row[0] in JOURNAL_EVENTS:
+                    yield normalize_row(row)
+
+
+def counting_rows(directory, prefix="events", zone=""):
+    """Rebuild the column-wise layout that `counting_data.csv` has always used.
+
+    Only events of one zone are included, by default the main region.
+    """
+    move_in, in_time, move_out, out_time, stay_duration = [], [], [], [], []
+    for event, count, ts, dur, _, event_zone, _ in read_events(directory, prefix):
+        if event_zone != zone or event == "cross":
+            continue
+        if event == "in":
+            move_in.append(count)
+            in_time.append(ts)
+        else:
+            move_out.append(count)
+            out_time.append(ts)
+            stay_duration.append(dur)
+    return list(zip_longest(move_in, in_time, move_out, out_time, stay_duration, fillvalue=""))
+
+
+def export_counting_csv(directory, csv_path="utils/data/logs/counting_data.csv", prefix="events"):
+    """Write the journal out as a legacy `counting_data.csv` file."""
+    rows = counting_rows(directory, prefix)
+    with open(csv_path, "w", newline="") as myfile:
+        wr = csv.writer(myfile, quoting=csv.QUOTE_ALL)
+        wr.writerow(COUNTING_HEADER)
+        wr.writerows(rows)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[INFO] %(message)s")
+    ap = argparse.ArgumentParser(description="Export the event journal as counting_data.csv")
+    ap.add_argument("--dir", default="utils/data/logs/journal",
+                    help="journal directory")
+    ap.add_argument("--output", default="utils/data/logs/counting_data.csv",
+                    help="path of the exported CSV")
+    args = ap.parse_args()
+    n = export_counting_csv(args.dir, args.output)
+    logger.info(f"Exported {n} rows to {args.output}")
@@ -0,0 +1,182 @@
+import bisect
+import collections
+import faulthandler
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# Seconds; tuned for per-frame stage latencies
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; `observe()` is one bisect and two adds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, out = 0, []
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            out.append((bound, total))
+        return out
+
+    def quantile(self, q):
+        """Upper bucket bound holding the q-th observation (None when empty)."""
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+        return None
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def render_prometheus(families):
+    """Render (name, type, help, samples) families in Prometheus text format.
+
+    `samples` is a list of (labels dict, value) for counters and gauges and
+    of (labels dict, Histogram) for histograms.
+    """
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if kind == "histogram":
+                for bound, total in value.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(dict(labels, le=le))} {total}")
+                lines.append(f"{name}_sum{_labels(labels)} {value.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {value.count}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def dump_stacks():
+    """Current stack of every thread as text."""
+    names = {t.ident: t.name for t in threading.enumerate()}
+    out = []
+    for ident, frame in sys._current_frames().items():
+        out.append(f"--- thread {names.get(ident, ident)} ---")
+        out.extend(line.rstrip() for line in traceback.format_stack(frame))
+    return "\n".join(out) + "\n"
+
+
+def sample_profile(seconds=5.0, interval=0.005, top=40):
+    """Statistical profile of all threads by sampling their stacks.
+
+    Unlike cProfile this covers every pipeline thread and costs nothing when
+    it is not running. Returns the most frequent frames as text.
+    """
+    me = threading.get_ident()
+    own, cumulative = collections.Counter(), collections.Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = traceback.extract_stack(frame)
+            if not stack:
+                continue
+            leaf = stack[-1]
+            own[f"{leaf.filename}:{leaf.lineno} {leaf.name}"] += 1
+            for entry in {f"{f.filename}:{f.name}" for f in stack}:
+                cumulative[entry] += 1
+        samples += 1
+        time.sleep(interval)
+    lines = [f"{samples} samples over {seconds:.1f}s", "", "self samples:"]
+    lines += [f"{n:8d}  {where}" for where, n in own.most_common(top)]
+    lines += ["", "cumulative samples:"]
+    lines += [f"{n:8d}  {where}" for where, n in cumulative.most_common(top)]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving metrics and on-demand diagnostics.
+
+    GET /metrics                Prometheus text from `collect()`
+    GET /stacks                 stack dump of every thread
+    GET /profile?seconds=N      sampled profile of all threads for N seconds
+    """
+
+    def __init__(self, collect, port, host="127.0.0.1"):
+        self.collect = collect
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/metrics":
+                    body = render_prometheus(server.collect())
+                    ctype = "text/plain; version=0.0.4"
+                elif url.path == "/stacks":
+                    body, ctype = dump_stacks(), "text/plain"
+                elif url.path == "/profile":
+                    try:
+                        seconds = float(parse_qs(url.query).get("seconds", ["5"])[0])
+                    except ValueError:
+                        seconds = float("nan")
+                    if not 0 < seconds < float("inf"):
+                        self.send_error(400, "seconds must be a positive number")
+                        return
+                    body, ctype = sample_profile(min(seconds, 60.0)), "text/plain"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Metrics on http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/metrics")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def install_stack_dump_signal():
+    """Dump every thread's stack to stderr on SIGUSR1 (POSIX only)."""
+    if hasattr(signal, "SIGUSR1"):
+        faulthandler.register(signal.SIGUSR1, all_threads=True)
+
+
+def log_line(snapshot):
+    """Emit one structured (JSON) metrics log line."""
+    logger.info("metrics " + json.dumps(snapshot, separators=(",", ":")))
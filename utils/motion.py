@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Cheap frame-difference check that lets idle frames skip detection.
+
+    Only the neighbourhood of the counting region is looked at, downscaled
+    to `width` pixels and blurred, and compared with the previous sample.
+    A frame is "active" when more than `threshold` of its pixels changed by
+    at least `pixel_delta` grey levels; after motion the gate stays open
+    for `hold` frames so new tracks have time to be confirmed.
+    """
+
+    def __init__(self, threshold=0.002, pixel_delta=25, width=80, hold=15):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.width = width
+        self.hold = hold
+        self.previous = None
+        self.idle_for = 0
+        self.gated = 0
+        self.processed = 0
+
+    def _sample(self, frame, roi):
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            frame = frame[y0:y1, x0:x1]
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, h * self.width // w)), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def motion(self, frame, roi=None):
+        """True when the region's neighbourhood changed since the previous frame."""
+        sample = self._sample(frame, roi)
+        previous, self.previous = self.previous, sample
+        if previous is None or previous.shape != sample.shape:
+            return True
+        changed = np.count_nonzero(cv2.absdiff(sample, previous) >= self.pixel_delta)
+        return changed > self.threshold * sample.size
+
+    def check(self, frame, roi=None, tracks_alive=False):
+        """Decide whether this frame needs detection and tracking."""
+        if self.motion(frame, roi):
+            self.idle_for = 0
+        else:
+            self.idle_for += 1
+        active = tracks_alive or self.idle_for <= self.hold
+        if active:
+            self.processed += 1
+        else:
+            self.gated += 1
+        return active
+
+    def summary(self):
+        total = self.gated + self.processed
+        return {
+            "gated_frames": self.gated,
+            "processed_frames": self.processed,
+            "gated_ratio": round(self.gated / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,216 @@
+import logging
+import queue
+import threading
+import time
+
+from utils.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+DROP_POLICIES = ("block", "drop-oldest", "drop-newest")
+
+_END = object()
+
+
+class StageStats:
+    """Item count, busy time, latency histogram and dropped items for one stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.busy = 0.0
+        self.latency = Histogram()
+        self.dropped = 0
+        self.started = time.perf_counter()
+
+    def throughput(self):
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def mean_latency_ms(self):
+        return self.busy / self.count * 1000 if self.count else 0.0
+
+    def __str__(self):
+        return (f"{self.name}: {self.count} items, {self.throughput():.2f} items/s, "
+                f"{self.mean_latency_ms():.2f} ms/item, {self.dropped} dropped")
+
+
+class Pipeline:
+    """Runs a source, a chain of stages and a sink connected by bounded queues.
+
+    `source()` returns the next item or None when the input is exhausted.
+    Every stage is a callable taking an item and returning the processed item
+    (or None to discard it). `sink(item)` runs on the calling thread so GUI
+    calls such as `cv2.imshow` stay on the main thread; returning False stops
+    the pipeline.
+
+    With `threaded=False` every stage runs in order on the calling thread,
+    which is the classic single-loop behaviour. Otherwise each stage gets its
+    own thread and `drop_policy` decides what happens when the queue after
+    the source is full: "block" keeps strict ordering (use it for files),
+    "drop-oldest" keeps only the freshest frames and "drop-newest" discards
+    the incoming frame.
+
+    An exception in any threaded stage stops the pipeline and is re-raised
+    from `run()` once the threads have been joined, as in inline mode.
+    """
+
+    def __init__(self, source, stages, queue_size=4, drop_policy="block", threaded=True):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}, got {drop_policy!r}")
+        self.source = source
+        self.stages = list(stages)
+        self.queue_size = max(1, int(queue_size))
+        self.drop_policy = drop_policy
+        self.threaded = threaded
+        self.stats = [StageStats("capture")] + [StageStats(name) for name, _ in self.stages] + [StageStats("output")]
+        self._stop = threading.Event()
+        self._error = None
+        self._error_lock = threading.Lock()
+
+    def stop(self):
+        self._stop.set()
+
+    def queue_depths(self):
+        """Items waiting in each queue, keyed "<producer>-><consumer>" (empty when inline)."""
+        return {f"{a.name}->{b.name}": q.qsize()
+                for a, b, q in zip(self.stats, self.stats[1:], getattr(self, "_queues", []))}
+
+    def run(self, sink):
+        if self.threaded:
+            self._run_threaded(sink)
+        else:
+            self._run_inline(sink)
+
+    @staticmethod
+    def _timed(stats, fn, item):
+        t0 = time.perf_counter()
+        out = fn(item)
+        elapsed = time.perf_counter() - t0
+        stats.busy += elapsed
+        stats.latency.observe(elapsed)
+        stats.count += 1
+        return out
+
+    def _run_inline(self, sink):
+        while not self._stop.is_set():
+            item = self._read()
+            if item is None:
+                break
+            for stats, (_, fn) in zip(self.stats[1:], self.stages):
+                item = self._timed(stats, fn, item)
+                if item is None:
+                    break
+            if item is None:
+                continue
+            if self._timed(self.stats[-1], sink, item) is False:
+                break
+
+    def _read(self):
+        stats = self.stats[0]
+        t0 = time.perf_counter()
+        item = self.source()
+        elapsed = time.perf_counter() - t0
+        stats.busy += elapsed
+        if item is not None:
+            stats.latency.observe(elapsed)
+            stats.count += 1
+        return item
+
+    def _put(self, q, item, stats, lossy):
+        if not lossy or self.drop_policy == "block" or item is _END:
+            while not self._stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+            return
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        stats.dropped += 1
+        if self.drop_policy == "drop-newest":
+            return
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            pass
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _capture_loop(self, out_q):
+        try:
+            while not self._stop.is_set():
+                item = self._read()
+                if item is None:
+                    break
+                self._put(out_q, item, self.stats[0], lossy=True)
+        except Exception as e:
+            logger.exception("capture stage failed")
+            self._fail(e)
+        finally:
+            self._put(out_q, _END, self.stats[0], lossy=False)
+
+    def _stage_loop(self, stats, fn, in_q, out_q):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _END:
+                    break
+                out = self._timed(stats, fn, item)
+                if out is not None:
+                    self._put(out_q, out, stats, lossy=False)
+        except Exception as e:
+            logger.exception(f"{stats.name} stage failed")
+            self._fail(e)
+        finally:
+            self._put(out_q, _END, stats, lossy=False)
+
+    def _fail(self, error):
+        # Keep the first failure; later ones are usually consequences of it
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _run_threaded(self, sink):
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._capture_loop, args=(self._queues[0],),
+                                    name="capture", daemon=True)]
+        for i, (name, fn) in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._stage_loop,
+                args=(self.stats[i + 1], fn, self._queues[i], self._queues[i + 1]),
+                name=name, daemon=True))
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                item = self._get(self._queues[-1])
+                if item is _END:
+                    break
+                if self._timed(self.stats[-1], sink, item) is False:
+                    break
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join(timeout=2.0)
+        if self._error is not None:
+            raise self._error
+
+    def log_stats(self):
+        for stats in self.stats:
+            logger.info(str(stats))
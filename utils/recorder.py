@@ -0,0 +1,143 @@
+import collections
+import datetime
+import logging
+import os
+import threading
+
+import cv2
+
+from utils.pipeline import DROP_POLICIES
+
+logger = logging.getLogger(__name__)
+
+
+class VideoRecorder:
+    """Annotates and encodes output video on a background thread.
+
+    `submit()` never does more than a queue operation on the caller's
+    thread. Frames arriving faster than `fps` (by their frame time) are
+    skipped; the rest wait in a queue of `queue_size` frames where
+    `drop_policy` decides what happens when the encoder falls behind:
+    "drop-oldest" replaces the oldest waiting frame, "drop-newest" skips
+    the incoming one and "block" waits (for recordings, where every frame
+    should be kept). Frames are drawn with `render(frame, *overlay)` when
+    an overlay is given, scaled to `width` pixels wide (0 keeps the size)
+    and, with `segment_seconds`, written to a new `<path>_<start>.<ext>`
+    file whenever the capture time enters a new segment.
+    """
+
+    def __init__(self, path, fps, render=None, width=0, segment_seconds=0, queue_size=32,
+                 drop_policy="drop-oldest", fourcc="mp4v"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}, got {drop_policy!r}")
+        self.path = path
+        self.fps = float(fps)
+        self.render = render
+        self.width = int(width or 0)
+        self.segment_seconds = float(segment_seconds or 0)
+        self.queue_size = max(1, int(queue_size))
+        self.drop_policy = drop_policy
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.written = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.segments = 0
+        self._next_time = None
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._writer = None
+        self._segment = None
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, path, source_fps, render=None, live=True, **overrides):
+        """Build a recorder from the optional "recording" section of config.json.
+
+        Unset options fall back to the source frame rate and to dropping
+        old frames for live sources or blocking for recordings.
+        """
+        options = dict(config.get("recording", {}))
+        options.update({k: v for k, v in overrides.items() if v is not None})
+        options["fps"] = options.get("fps") or source_fps
+        options.setdefault("drop_policy", "drop-oldest" if live else "block")
+        return cls(path, render=render, **options)
+
+    def submit(self, frame, frame_time, captured_at, overlay=None):
+        """Queue a frame for writing; `frame_time` (seconds) drives the rate limit."""
+        step = 1.0 / self.fps
+        # A quarter-step tolerance keeps timestamp rounding from skipping frames at the source rate
+        if self._next_time is not None and frame_time + step / 4 < self._next_time:
+            self.skipped += 1
+            return
+        # Stay on the output rate's grid so jitter does not lower it
+        if self._next_time is None or frame_time - self._next_time >= step:
+            self._next_time = frame_time + step
+        else:
+            self._next_time += step
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                if self.drop_policy == "drop-newest":
+                    self.dropped += 1
+                    return
+                if self.drop_policy == "drop-oldest":
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self._cond.wait_for(lambda: len(self._queue) < self.queue_size or self._closed)
+            self._queue.append((frame, captured_at, overlay))
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    break
+                frame, captured_at, overlay = self._queue.popleft()
+                self._cond.notify_all()
+            if overlay is not None and self.render is not None:
+                self.render(frame, *overlay)
+            if self.width and frame.shape[1] != self.width:
+                h = round(frame.shape[0] * self.width / frame.shape[1])
+                frame = cv2.resize(frame, (self.width, h), interpolation=cv2.INTER_AREA)
+            self._writer_for(captured_at, frame).write(frame)
+            self.written += 1
+        if self._writer is not None:
+            self._writer.release()
+
+    def _writer_for(self, captured_at, frame):
+        segment = None
+        if self.segment_seconds:
+            segment = int(captured_at.timestamp() // self.segment_seconds)
+        if self._writer is not None and segment == self._segment:
+            return self._writer
+        if self._writer is not None:
+            self._writer.release()
+        path = self.path
+        if segment is not None:
+            start = datetime.datetime.fromtimestamp(segment * self.segment_seconds)
+            root, ext = os.path.splitext(self.path)
+            path = f"{root}_{start.strftime('%Y%m%d-%H%M%S')}{ext}"
+        H, W = frame.shape[:2]
+        self._writer = cv2.VideoWriter(path, self.fourcc, self.fps, (W, H), True)
+        self._segment = segment
+        self.segments += 1
+        logger.info(f"Recording to {path}")
+        return self._writer
+
+    def summary(self):
+        return {
+            "recorded_frames": self.written,
+            "recording_dropped": self.dropped,
+            "recording_rate_skipped": self.skipped,
+            "recording_segments": self.segments,
+        }
+
+    def close(self):
+        """Write what is still queued, then finish the file."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
@@ -0,0 +1,151 @@
+import itertools
+
+import cv2
+import numpy as np
+
+_versions = itertools.count(1)
+
+
+class RegionMask:
+    """Rasterized counting polygon for classifying many points at once.
+
+    The polygon is filled into a uint8 mask the size of the frame, so a
+    membership test for N centroids is a single fancy-indexing lookup
+    instead of N ray-casting loops. Points outside the frame are outside.
+    """
+
+    def __init__(self, polygon, width, height):
+        self.polygon = np.asarray(polygon, dtype=np.int32)
+        self.width = width
+        self.height = height
+        self.mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(self.mask, [self.polygon], 1)
+        self._edge_distance = None
+
+    def contains(self, points):
+        """Return a bool array telling which (x, y) points lie inside the region."""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        xs, ys = points[:, 0], points[:, 1]
+        valid = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        inside = np.zeros(len(points), dtype=bool)
+        inside[valid] = self.mask[ys[valid], xs[valid]].astype(bool)
+        return inside
+
+    def bounding_box(self, padding=0):
+        """(x0, y0, x1, y1) of the polygon grown by `padding` pixels, clipped to the frame."""
+        x, y, w, h = cv2.boundingRect(self.polygon)
+        return (max(x - padding, 0), max(y - padding, 0),
+                min(x + w + padding, self.width), min(y + h + padding, self.height))
+
+    def boundary_distance(self, points):
+        """Distance in pixels from each (x, y) point to the polygon outline.
+
+        The distance map is built lazily with `cv2.distanceTransform` the
+        first time it is needed. Points outside the frame are clamped to it.
+        """
+        if self._edge_distance is None:
+            edges = np.full((self.height, self.width), 255, dtype=np.uint8)
+            cv2.polylines(edges, [self.polygon], isClosed=True, color=0, thickness=1)
+            self._edge_distance = cv2.distanceTransform(edges, cv2.DIST_L2, 3)
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        xs = np.clip(points[:, 0], 0, self.width - 1)
+        ys = np.clip(points[:, 1], 0, self.height - 1)
+        return self._edge_distance[ys, xs]
+
+
+def validate_zones(zones):
+    """Raise ValueError unless every zone is a named polygon (3+ points) or line (2 points)."""
+    for zone in zones:
+        if "name" not in zone or ("polygon" in zone) == ("line" in zone):
+            raise ValueError("every zone needs a name and either a polygon or a line")
+        kind = "line" if "line" in zone else "polygon"
+        try:
+            points = np.asarray(zone[kind], dtype=float)
+        except (TypeError, ValueError):
+            points = np.zeros(0)
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError(f"zone {zone['name']!r}: {kind} must be a list of [x, y] points")
+        if kind == "line" and len(points) != 2:
+            raise ValueError(f"zone {zone['name']!r}: a line needs exactly 2 points")
+        if kind == "polygon" and len(points) < 3:
+            raise ValueError(f"zone {zone['name']!r}: a polygon needs at least 3 points")
+
+
+class ZoneMap:
+    """Named zones and directional tripwires rasterized into one bit mask.
+
+    Every zone owns one bit and every tripwire two: one for a band of
+    `band` pixels on each side of the line. A single lookup per frame gives
+    each point all the zones and bands it is in, so a track whose bits did
+    not change since the last frame costs one comparison no matter how many
+    zones exist. For a tripwire drawn from left to right on screen, a
+    "forward" crossing goes from top to bottom and "backward" the other
+    way (in general forward leaves the side the normal (y2 - y1, x1 - x2)
+    points to).
+
+    `zones` is a list of {"name": ..., "polygon": [[x, y], ...]} or
+    {"name": ..., "line": [[x1, y1], [x2, y2]]} dicts.
+    """
+
+    MAX_BITS = 64
+
+    def __init__(self, zones, width, height, band=40):
+        validate_zones(zones)
+        self.width = width
+        self.height = height
+        self.version = next(_versions)
+        self.zones = []
+        self.mask = np.zeros((height, width), dtype=np.uint64)
+        bit = 0
+        for zone in zones:
+            name = str(zone["name"])
+            if "line" in zone:
+                (x1, y1), (x2, y2) = np.asarray(zone["line"], dtype=float)
+                normal = np.array([y2 - y1, x1 - x2])
+                normal = normal / (np.linalg.norm(normal) or 1.0) * band
+                p1, p2 = np.array([x1, y1]), np.array([x2, y2])
+                shapes = [np.array([p1, p2, p2 + normal, p1 + normal]),
+                          np.array([p1, p2, p2 - normal, p1 - normal])]
+                kind = "line"
+            else:
+                shapes = [np.asarray(zone["polygon"])]
+                kind = "zone"
+            if bit + len(shapes) > self.MAX_BITS:
+                raise ValueError(f"too many zones; at most {self.MAX_BITS} bits (lines use two)")
+            self.zones.append((name, kind, bit))
+            for shape in shapes:
+                layer = np.zeros((height, width), dtype=np.uint8)
+                cv2.fillPoly(layer, [np.round(shape).astype(np.int32)], 1)
+                self.mask[layer.astype(bool)] |= np.uint64(1 << bit)
+                bit += 1
+
+    def lookup(self, points):
+        """Bit set of every (x, y) point as Python-int-compatible uint64 values."""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        xs, ys = points[:, 0], points[:, 1]
+        valid = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        bits = np.zeros(len(points), dtype=np.uint64)
+        bits[valid] = self.mask[ys[valid], xs[valid]]
+        return bits
+
+    def inside(self, bits):
+        """Names of the (polygon) zones a bit set lies in."""
+        return {name for name, kind, bit in self.zones if kind == "zone" and bits >> bit & 1}
+
+    def transitions(self, previous, current):
+        """Yield (name, event) for a track that moved from `previous` to `current` bits.
+
+        Events are "enter"/"exit" for zones and "forward"/"backward" for lines.
+        """
+        changed = previous ^ current
+        if not changed:
+            return
+        for name, kind, bit in self.zones:
+            if kind == "zone":
+                if changed >> bit & 1:
+                    yield name, "enter" if current >> bit & 1 else "exit"
+            elif changed >> bit & 3:
+                if previous >> bit & 1 and current >> (bit + 1) & 1:
+                    yield name, "forward"
+                elif previous >> (bit + 1) & 1 and current >> bit & 1:
+                    yield name, "backward"
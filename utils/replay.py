@@ -0,0 +1,294 @@
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from norfair import Detection, Tracker
+
+from utils.columnar import to_epoch_ms
+from utils.counting import RegionCounter
+from utils.telemetry import chunk_cameras, chunk_frame_size, chunk_sessions, read_chunks
+from utils.timing import epoch_ms
+
+logger = logging.getLogger(__name__)
+
+# Stay duration histogram edges in seconds
+DWELL_BINS = (0, 1, 2, 5, 10, 30, 60, 300, float("inf"))
+
+
+class DetectionLog:
+    """Stored per-frame detections of one session, loaded once and replayed many times.
+
+    `frames` holds every frame index from the first to the last recorded
+    one (frames without detections replay as empty) with its capture time
+    in `times_ms`; rows `starts[k]:starts[k + 1]` of `centroids` and
+    `scores` are the detections of `frames[k]`.
+    """
+
+    def __init__(self, det_frames, centroids, scores, time_frames, times_ms, frame_size):
+        order = np.argsort(det_frames, kind="stable")
+        det_frames = det_frames[order]
+        self.centroids = np.ascontiguousarray(centroids[order], dtype=np.float64)
+        self.scores = np.asarray(scores[order], dtype=np.float32)
+        first, last = int(time_frames.min()), int(time_frames.max())
+        self.frames = np.arange(first, last + 1)
+        self.starts = np.searchsorted(det_frames, np.r_[self.frames, last + 1])
+        known, idx = np.unique(time_frames, return_index=True)
+        self.times_ms = np.interp(self.frames, known, np.asarray(times_ms, dtype=np.float64)[idx])
+        self.frame_size = frame_size
+
+    def __len__(self):
+        return len(self.frames)
+
+    @classmethod
+    def from_telemetry(cls, directory, camera=None, frame_size=None, start=None, end=None):
+        """Detections recorded with --telemetry, one log per session.
+
+        Frame numbers restart with every run of the counter, so each session
+        is replayed on its own timeline; the frame size comes from its
+        chunks. A directory shared by several cameras needs `camera`.
+        """
+        if camera is None:
+            cameras = chunk_cameras(directory)
+            if len(cameras) > 1:
+                raise ValueError(f"the telemetry in {directory} holds cameras {', '.join(cameras)}, pass --camera")
+        logs = []
+        for session in chunk_sessions(directory, camera, start, end):
+            rows = read_chunks(directory, camera, start, end, session)
+            if not len(rows):
+                continue
+            size = chunk_frame_size(directory, camera, session) or frame_size
+            if size is None:
+                raise ValueError("the telemetry has no frame size, pass --frame-size")
+            det = rows[rows["track"] == -1]
+            logs.append(cls(det["frame"], np.stack((det["cx"], det["cy"]), axis=1), det["conf"],
+                            rows["frame"], rows["time_ms"], size))
+        if not logs:
+            raise ValueError(f"no telemetry rows in {directory}")
+        return logs
+
+    @classmethod
+    def from_csv(cls, csv_path, fps=30, frame_size=(500, 375), start=None, end=None):
+        """detections.csv rows of (time, sx, sy, ex, ey, conf) with start <= time < end.
+
+        The file has no frame numbers, so frames are placed by their time at
+        `fps`; this needs the millisecond times written since events gained
+        them.
+        """
+        df = pd.read_csv(csv_path, header=None, names=["time", "sx", "sy", "ex", "ey", "conf"])
+        times = to_epoch_ms(df["time"])
+        valid = times != np.iinfo(np.int64).min
+        if start is not None:
+            valid &= times >= epoch_ms(start)
+        if end is not None:
+            valid &= times < epoch_ms(end)
+        df, times = df[valid], times[valid]
+        if not len(df):
+            raise ValueError(f"no detections in {csv_path}")
+        frames = np.rint((times - times.min()) * fps / 1000).astype(np.int64)
+        centroids = np.stack((((df["sx"] + df["ex"]) // 2).to_numpy(), ((df["sy"] + df["ey"]) // 2).to_numpy()), axis=1)
+        return cls(frames, centroids, df["conf"].to_numpy(), frames, times, tuple(frame_size))
+
+    @classmethod
+    def load(cls, source, camera=None, fps=30, frame_size=None, start=None, end=None):
+        """Logs of a telemetry directory (one per session) or of a detections.csv file."""
+        if os.path.isdir(source):
+            return cls.from_telemetry(source, camera, frame_size, start, end)
+        return [cls.from_csv(source, fps, frame_size or (500, 375), start, end)]
+
+
+class ReplayClock:
+    """RegionCounter clock over the recorded capture times of a DetectionLog."""
+
+    def __init__(self, log):
+        self.first = int(log.frames[0])
+        self.times_ms = log.times_ms
+
+    def wall(self, frame_index):
+        return datetime.datetime.fromtimestamp(self.times_ms[frame_index - self.first] / 1000)
+
+    def mono(self, frame_index):
+        return self.times_ms[frame_index - self.first] / 1000
+
+    __call__ = wall
+
+
+class EventCollector:
+    """In-memory stand-in for EventJournal that keeps stay durations per zone."""
+
+    def __init__(self):
+        self.stays = {}
+
+    def record_in(self, count, timestamp, zone=""):
+        pass
+
+    def record_out(self, count, timestamp, duration, reason="exit", zone=""):
+        self.stays.setdefault(zone, []).append(duration)
+
+    def record_cross(self, count, timestamp, direction, zone):
+        pass
+
+
+def dwell_summary(stays):
+    """Quantiles and a histogram (DWELL_BINS) of stay durations in seconds."""
+    stays = np.asarray(stays, dtype=np.float64)
+    if not len(stays):
+        return {"count": 0}
+    hist, _ = np.histogram(stays, bins=DWELL_BINS)
+    labels = [f"{a:g}-{b:g}" if b != float("inf") else f"{a:g}+" for a, b in zip(DWELL_BINS[:-1], DWELL_BINS[1:])]
+    p50, p90, p95 = np.percentile(stays, [50, 90, 95])
+    return {
+        "count": len(stays),
+        "mean": round(float(stays.mean()), 3),
+        "p50": round(float(p50), 3),
+        "p90": round(float(p90), 3),
+        "p95": round(float(p95), 3),
+        "max": round(float(stays.max()), 3),
+        "histogram": dict(zip(labels, hist.tolist())),
+    }
+
+
+def replay(logs, distance_threshold=30, confidence=0.0, hit_counter_max=15, initialization_delay=None,
+           rect=None, tilt=0, polygon=None, zones=None):
+    """Run the tracker and region counting over DetectionLogs; returns counts and dwell.
+
+    `logs` is one DetectionLog or a list of them (sessions). Each session
+    starts with a fresh tracker and counter, and the counts and stay
+    durations are added up. `confidence` can only raise the threshold the
+    detections were stored with.
+    """
+    if isinstance(logs, DetectionLog):
+        logs = [logs]
+    events = EventCollector()
+    totals = {"total_in": 0, "total_out": 0, "lost_visits": 0}
+    zone_counts = {}
+    frames = 0
+    elapsed = 0.0
+    for log in logs:
+        tracker = Tracker(distance_function="euclidean", distance_threshold=distance_threshold,
+                          hit_counter_max=hit_counter_max, initialization_delay=initialization_delay)
+        counter = RegionCounter(events, 30, rect or (None, None, None, None), tilt,
+                                clock=ReplayClock(log), zones=zones)
+        counter.set_region(rect, tilt, polygon)
+        counter.set_frame_size(*log.frame_size)
+        centroids, scores, starts = log.centroids, log.scores, log.starts
+        t0 = time.perf_counter()
+        for k, frame_index in enumerate(log.frames.tolist()):
+            a, b = starts[k], starts[k + 1]
+            detections = [Detection(points=centroids[i:i + 1], scores=scores[i:i + 1])
+                          for i in range(a, b) if scores[i] >= confidence]
+            tracked_objects = tracker.update(detections=detections)
+            counter.update(tracked_objects, frame_index)
+            counter.evict({obj.id for obj in tracker.tracked_objects})
+        elapsed += time.perf_counter() - t0
+        frames += len(log)
+        totals["total_in"] += counter.totalIn
+        totals["total_out"] += counter.totalOut
+        totals["lost_visits"] += counter.lost
+        for zone, counts in counter.zone_counts.items():
+            total = zone_counts.setdefault(zone, [0, 0])
+            total[0] += counts[0]
+            total[1] += counts[1]
+    return {
+        "sessions": len(logs),
+        "frames": frames,
+        "frames_per_second": round(frames / elapsed, 1) if elapsed else None,
+        **totals,
+        "dwell": dwell_summary(events.stays.get("", [])),
+        "zones": {zone: {"in": counts[0], "out": counts[1], "dwell": dwell_summary(events.stays.get(zone, []))}
+                  for zone, counts in zone_counts.items()},
+    }
+
+
+def sweep_configs(distances, confidences, hit_counter_maxes, initialization_delays, regions):
+    """Every combination of tracker settings and regions as replay() keyword dicts."""
+    configs = []
+    for d, c, h, delay, region in itertools.product(distances, confidences, hit_counter_maxes,
+                                                    initialization_delays, regions):
+        configs.append(dict(region, distance_threshold=d, confidence=c, hit_counter_max=h,
+                            initialization_delay=delay))
+    return configs
+
+
+_worker_logs = None
+
+
+def _load_worker(source, load_args):
+    global _worker_logs
+    _worker_logs = DetectionLog.load(source, **load_args)
+
+
+def _replay_worker(params):
+    return dict(params=params, **replay(_worker_logs, **params))
+
+
+def sweep(source, configs, workers=None, **load_args):
+    """Replay `configs` across worker processes, each loading the detections once."""
+    workers = max(1, min(workers or os.cpu_count() or 1, len(configs)))
+    if workers == 1:
+        _load_worker(source, load_args)
+        return [_replay_worker(params) for params in configs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker,
+                             initargs=(source, load_args)) as pool:
+        return list(pool.map(_replay_worker, configs))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[INFO] %(message)s")
+    ap = argparse.ArgumentParser(description="Replay stored detections through the tracker and counter")
+    ap.add_argument("source", help="telemetry directory or detections.csv")
+    ap.add_argument("--camera", default=None, help="camera name, required when the telemetry holds several cameras")
+    ap.add_argument("--start", type=datetime.datetime.fromisoformat, default=None,
+                    help="only replay detections at or after this local time, e.g. 2025-06-05T10:00")
+    ap.add_argument("--end", type=datetime.datetime.fromisoformat, default=None,
+                    help="only replay detections before this local time")
+    ap.add_argument("--fps", type=float, default=30, help="frame rate for placing detections.csv rows")
+    ap.add_argument("--frame-size", type=int, nargs=2, default=None, metavar=("W", "H"),
+                    help="resized frame size when the source does not record it (default 500 375)")
+    ap.add_argument("--distance", type=float, nargs="+", default=[30], help="Norfair distance_threshold values")
+    ap.add_argument("--confidence", type=float, nargs="+", default=[0.0], help="confidence thresholds")
+    ap.add_argument("--hit-counter-max", type=int, nargs="+", default=[15], help="Norfair hit_counter_max values")
+    ap.add_argument("--init-delay", type=int, nargs="+", default=[None],
+                    help="Norfair initialization_delay values (default: hit_counter_max / 2)")
+    ap.add_argument("--rect", type=int, nargs=4, default=None, metavar=("X", "Y", "W", "H"),
+                    help="counting rectangle (default: the counter's middle band)")
+    ap.add_argument("--tilt", type=float, nargs="+", default=[0], help="tilt angles")
+    ap.add_argument("--regions", default=None,
+                    help='JSON file with a list of {"rect", "tilt"} or {"polygon"} regions (optionally "zones")')
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    ap.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    args = ap.parse_args()
+    if os.path.isdir(args.source) and args.camera is None and len(chunk_cameras(args.source)) > 1:
+        ap.error(f"{args.source} holds cameras {', '.join(chunk_cameras(args.source))}, pass --camera")
+
+    if args.regions:
+        with open(args.regions) as f:
+            regions = json.load(f)
+    else:
+        regions = [{"rect": args.rect, "tilt": tilt} for tilt in args.tilt]
+    configs = sweep_configs(args.distance, args.confidence, args.hit_counter_max, args.init_delay, regions)
+    start = time.perf_counter()
+    results = sweep(args.source, configs, args.workers, camera=args.camera, fps=args.fps,
+                    frame_size=tuple(args.frame_size) if args.frame_size else None,
+                    start=args.start, end=args.end)
+    logger.info(f"Replayed {len(configs)} configurations in {time.perf_counter() - start:.1f}s")
+    for result in results:
+        p, dwell = result["params"], result["dwell"]
+        logger.info(f"distance={p['distance_threshold']} confidence={p['confidence']} "
+                    f"hits={p['hit_counter_max']} delay={p['initialization_delay']} "
+                    f"region={p.get('polygon') or p.get('rect')}/{p.get('tilt', 0)}: "
+                    f"{result['sessions']} sessions: in {result['total_in']} out {result['total_out']} "
+                    f"p50 {dwell.get('p50', '-')}s p90 {dwell.get('p90', '-')}s "
+                    f"({result['frames_per_second']} frames/s)")
+    text = json.dumps({"source": args.source, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
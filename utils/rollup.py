@@ -0,0 +1,380 @@
+import csv
+import datetime
+import io
+import json
+import math
+import os
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+from utils.journal import JOURNAL_EVENTS, journal_files, normalize_row
+
+# Stay-duration histogram: 0.5 s bins up to 60 s plus one overflow bin
+HIST_EDGES = np.arange(0, 60.5, 0.5)
+N_BINS = len(HIST_EDGES)
+FIELDS = ("entries", "exits", "stay_sum", "stay_sumsq")
+_EPOCH = datetime.datetime(1970, 1, 1)
+_HIST_MAX = np.iinfo(np.uint16).max
+_KINDS = {"in": 0, "forward": 0, "backward": 1, "out": 2}
+
+
+def parse_minute(ts):
+    """Minutes since 1970 of a journal timestamp, keeping its naive local time."""
+    dt = datetime.datetime.strptime(ts[:16], "%Y-%m-%d %H:%M")
+    return (dt - _EPOCH) // datetime.timedelta(minutes=1)
+
+
+def hist_bin(duration):
+    return min(int(duration / 0.5), N_BINS - 1)
+
+
+class _ZoneSeries:
+    """Minute buckets of one zone held in minute-sorted arrays.
+
+    Entry and exit counts are int32, stay sums float64 and the histogram
+    uint16 (saturating); rows are appended in the common in-order case and
+    inserted otherwise.
+    """
+
+    def __init__(self, minutes=None, counts=None, stays=None, hist=None):
+        self.size = 0 if minutes is None else len(minutes)
+        capacity = max(self.size, 1024)
+        self.minutes = np.zeros(capacity, dtype=np.int64)
+        self.counts = np.zeros((capacity, 2), dtype=np.int32)
+        self.stays = np.zeros((capacity, 2), dtype=np.float64)
+        self.hist = np.zeros((capacity, N_BINS), dtype=np.uint16)
+        if self.size:
+            self.minutes[:self.size] = minutes
+            self.counts[:self.size] = counts
+            self.stays[:self.size] = stays
+            self.hist[:self.size] = hist
+
+    def _grow(self):
+        capacity = len(self.minutes) * 2
+        for name in ("minutes", "counts", "stays", "hist"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def row(self, minute):
+        """Index of the bucket for `minute`, creating it if needed."""
+        n = self.size
+        if n and self.minutes[n - 1] == minute:
+            return n - 1
+        i = n if not n or self.minutes[n - 1] < minute else int(np.searchsorted(self.minutes[:n], minute))
+        if i < n and self.minutes[i] == minute:
+            return i
+        if n == len(self.minutes):
+            self._grow()
+        for array in (self.minutes, self.counts, self.stays, self.hist):
+            array[i + 1:n + 1] = array[i:n]
+            array[i] = 0
+        self.minutes[i] = minute
+        self.size = n + 1
+        return i
+
+    def span(self, start=None, end=None):
+        """Index range of the buckets with start <= minute < end."""
+        minutes = self.minutes[:self.size]
+        lo = 0 if start is None else int(np.searchsorted(minutes, start))
+        hi = self.size if end is None else int(np.searchsorted(minutes, end))
+        return lo, max(lo, hi)
+
+
+def _to_minute(value):
+    """First whole minute at or after a datetime, or None."""
+    if value is None:
+        return None
+    return math.ceil((pd.Timestamp(value) - pd.Timestamp(0)) / pd.Timedelta(minutes=1))
+
+
+class RollupStore:
+    """Per-minute rollups of the event journal, updated incrementally.
+
+    Every minute bucket holds entry and exit counts, the sum and sum of
+    squares of stay durations and a stay-duration histogram, kept per zone
+    ("" is the main region). For tripwires entries and exits count forward
+    and backward crossings. `refresh()` only reads journal bytes appended
+    since the previous call. Buckets are saved next to the journal as one
+    file per day and only days that changed are rewritten; `state.json`
+    names the current day files and holds the read offsets, so a restart
+    does not re-parse history and an interrupted save keeps the previous
+    state. Coarser resolutions are summed from the minutes.
+    """
+
+    def __init__(self, directory, path=None, tail_size=500):
+        self.directory = directory
+        self.path = path or os.path.join(directory, "rollup")
+        self.series = {}
+        self.lines = set()
+        self.offsets = {}
+        self.tail = deque(maxlen=tail_size)
+        self._days = {}
+        self._dirty = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        state_path = os.path.join(self.path, "state.json")
+        legacy = os.path.join(self.directory, "rollup.npz")
+        if not os.path.exists(state_path):
+            if os.path.exists(legacy):
+                self._load_legacy(legacy)
+                self._dirty = {m // 1440 for s in self.series.values() for m in s.minutes[:s.size].tolist()}
+                self.save()
+                os.remove(legacy)
+            return
+        with open(state_path) as f:
+            state = json.load(f)
+        self.lines = set(state["lines"])
+        self.offsets = state["offsets"]
+        self._generation = state["generation"]
+        self._days = {int(day): name for day, name in state["days"].items()}
+        parts = {}
+        for name in self._days.values():
+            with np.load(os.path.join(self.path, name)) as data:
+                zones = json.loads(str(data["zones"]))
+                zone_ids = data["zone_ids"]
+                for i, zone in enumerate(zones):
+                    mask = zone_ids == i
+                    parts.setdefault(zone, []).append(
+                        (data["minutes"][mask], data["counts"][mask], data["stays"][mask], data["hist"][mask]))
+        for zone, chunks in parts.items():
+            minutes, counts, stays, hist = (np.concatenate(c) for c in zip(*chunks))
+            order = np.argsort(minutes, kind="stable")
+            self.series[zone] = _ZoneSeries(minutes[order], counts[order], stays[order], hist[order])
+        # Day files left behind by an interrupted save
+        current = set(self._days.values())
+        for name in os.listdir(self.path):
+            if name.endswith(".npz") and name not in current:
+                os.remove(os.path.join(self.path, name))
+
+    def _load_legacy(self, path):
+        # Single rollup.npz of float64 rows written by earlier versions
+        with np.load(path) as data:
+            zones = json.loads(str(data["zones"])) if "zones" in data else [""]
+            zone_ids = data["zone_ids"] if "zone_ids" in data else np.zeros(len(data["minutes"]), dtype=np.int32)
+            minutes, values = data["minutes"], data["values"]
+            for i, zone in enumerate(zones):
+                mask = zone_ids == i
+                if mask.any():
+                    v = values[mask]
+                    self.series[zone] = _ZoneSeries(
+                        minutes[mask], v[:, :2], v[:, 2:4],
+                        np.minimum(v[:, len(FIELDS):], _HIST_MAX))
+            self.lines = set(json.loads(str(data["lines"]))) if "lines" in data else set()
+            self.offsets = json.loads(str(data["offsets"]))
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._generation += 1
+        zones = sorted(self.series)
+        days = dict(self._days)
+        for day in sorted(self._dirty):
+            parts = []
+            for zone_id, zone in enumerate(zones):
+                s = self.series[zone]
+                lo, hi = s.span(day * 1440, (day + 1) * 1440)
+                if hi > lo:
+                    parts.append((np.full(hi - lo, zone_id, dtype=np.int32), s.minutes[lo:hi],
+                                  s.counts[lo:hi], s.stays[lo:hi], s.hist[lo:hi]))
+            if not parts:
+                days.pop(day, None)
+                continue
+            zone_ids, minutes, counts, stays, hist = (np.concatenate(p) for p in zip(*parts))
+            name = (_EPOCH + datetime.timedelta(days=day)).strftime("%Y%m%d") + f".{self._generation}.npz"
+            np.savez_compressed(os.path.join(self.path, name), zones=json.dumps(zones), zone_ids=zone_ids,
+                                minutes=minutes, counts=counts, stays=stays, hist=hist)
+            days[day] = name
+        state = {"generation": self._generation, "days": days,
+                 "lines": sorted(self.lines), "offsets": self.offsets}
+        tmp = os.path.join(self.path, "state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(self.path, "state.json"))
+        for day, name in self._days.items():
+            if days.get(day) != name:
+                os.remove(os.path.join(self.path, name))
+        self._days = days
+        self._dirty.clear()
+
+    def zones(self):
+        """Zone names seen so far; "" is the main region."""
+        with self._lock:
+            return sorted(set(self.series) | {""})
+
+    def add_event(self, event, ts, duration=None, zone=""):
+        """Add one event; `event` is "in", "out", "forward" or "backward"."""
+        minute = parse_minute(ts)
+        series = self.series.get(zone)
+        if series is None:
+            series = self.series[zone] = _ZoneSeries()
+        i = series.row(minute)
+        self._dirty.add(minute // 1440)
+        if event in ("in", "forward"):
+            series.counts[i, 0] += 1
+        elif event == "backward":
+            series.counts[i, 1] += 1
+        else:
+            series.counts[i, 1] += 1
+            series.stays[i, 0] += duration
+            series.stays[i, 1] += duration * duration
+            b = hist_bin(duration)
+            if series.hist[i, b] < _HIST_MAX:
+                series.hist[i, b] += 1
+
+    def refresh(self):
+        """Fold newly appended journal rows into the buckets; returns rows read."""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        added = 0
+        batches = {}
+        minute_of = {}
+        for path in journal_files(self.directory):
+            name = os.path.basename(path)
+            offset = self.offsets.get(name, 0)
+            if os.path.getsize(path) <= offset:
+                continue
+            with open(path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read()
+            # Leave a partially written last line for the next refresh
+            end = chunk.rfind(b"\n") + 1
+            if end == 0:
+                continue
+            for row in csv.reader(io.StringIO(chunk[:end].decode("utf-8"))):
+                if not row or row[0] not in JOURNAL_EVENTS:
+                    continue
+                row = normalize_row(row)
+                event, zone = row[0], row[5]
+                if event == "cross":
+                    event = row[4]
+                    self.lines.add(zone)
+                duration = float(row[3]) if event == "out" and row[3] else None
+                if event == "out" and (duration is None or duration < 0):
+                    continue
+                key = row[2][:16]
+                minute = minute_of.get(key)
+                if minute is None:
+                    minute = minute_of[key] = parse_minute(key)
+                batch = batches.setdefault(zone, ([], [], []))
+                batch[0].append(minute)
+                batch[1].append(_KINDS[event])
+                batch[2].append(duration or 0.0)
+                self.tail.append(row)
+                added += 1
+            self.offsets[name] = offset + end
+        for zone, (minutes, kinds, durations) in batches.items():
+            self._add_events(zone, np.array(minutes, dtype=np.int64), np.array(kinds), np.array(durations))
+        if added:
+            self.save()
+        return added
+
+    def _add_events(self, zone, minutes, kinds, durations):
+        """Vectorised add_event for one zone; kinds are 0 entry, 1 exit, 2 exit with a stay."""
+        series = self.series.get(zone)
+        if series is None:
+            series = self.series[zone] = _ZoneSeries()
+        unique, inverse = np.unique(minutes, return_inverse=True)
+        for minute in unique.tolist():
+            series.row(minute)
+            self._dirty.add(minute // 1440)
+        # Rows only move while creating buckets, so look the indices up afterwards
+        rows = np.searchsorted(series.minutes[:series.size], unique)
+        idx = rows[inverse]
+        np.add.at(series.counts, (idx, np.minimum(kinds, 1)), 1)
+        stay = kinds == 2
+        np.add.at(series.stays, (idx[stay], 0), durations[stay])
+        np.add.at(series.stays, (idx[stay], 1), durations[stay] ** 2)
+        hist = series.hist[rows].astype(np.int64)
+        np.add.at(hist, (inverse[stay], np.minimum((durations[stay] / 0.5).astype(np.int64), N_BINS - 1)), 1)
+        series.hist[rows] = np.minimum(hist, _HIST_MAX)
+
+    def _slice(self, start, end, zone, hist=True):
+        with self._lock:
+            series = self.series.get(zone)
+            if series is None:
+                return None
+            lo, hi = series.span(_to_minute(start), _to_minute(end))
+            return (series.minutes[lo:hi].copy(), series.counts[lo:hi].copy(), series.stays[lo:hi].copy(),
+                    series.hist[lo:hi].copy() if hist else None)
+
+    def frame(self, freq="1min", start=None, end=None, zone="", hist=False):
+        """Buckets of one zone resampled to `freq` between optional start/end datetimes.
+
+        With `hist` the frame has an extra "hist" column of histogram arrays.
+        """
+        part = self._slice(start, end, zone, hist)
+        columns = FIELDS + (("hist",) if hist else ())
+        if part is None or not len(part[0]):
+            return pd.DataFrame(columns=columns)
+        minutes, counts, stays, histogram = part
+        values = np.hstack([counts.astype(np.int64), stays])
+        step = to_offset(freq).nanos // 60_000_000_000
+        if step > 1:
+            # Sum runs of the same bin, then fill empty bins with zeros like resample()
+            bins = minutes // step
+            starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+            slots = bins[starts] - bins[0]
+            values_full = np.zeros((slots[-1] + 1, values.shape[1]))
+            values_full[slots] = np.add.reduceat(values, starts)
+            values = values_full
+            if hist:
+                hist_full = np.zeros((slots[-1] + 1, N_BINS), dtype=np.int64)
+                hist_full[slots] = np.add.reduceat(histogram.astype(np.int64), starts)
+                histogram = hist_full
+            minutes = (bins[0] + np.arange(len(values))) * step
+        df = pd.DataFrame(values, index=pd.to_datetime(minutes * 60, unit="s"), columns=FIELDS)
+        df[["entries", "exits"]] = df[["entries", "exits"]].astype(np.int64)
+        if hist:
+            df["hist"] = list(histogram)
+        return df
+
+    def summary(self, engaged_sec, start=None, end=None, zone=""):
+        """Totals, mean/median stay and engaged percentage over a time range."""
+        part = self._slice(start, end, zone)
+        if part is None:
+            entries = exits = 0
+            stay_sum = stay_sumsq = 0.0
+            hist = np.zeros(N_BINS, dtype=np.int64)
+        else:
+            _, counts, stays, hist = part
+            entries, exits = counts.sum(axis=0, dtype=np.int64).tolist()
+            stay_sum, stay_sumsq = stays.sum(axis=0).tolist()
+            hist = hist.sum(axis=0, dtype=np.int64)
+        return {
+            "entries": entries,
+            "visits": exits,
+            "mean": stay_sum / exits if exits else float("nan"),
+            "std": np.sqrt(max(stay_sumsq / exits - (stay_sum / exits) ** 2, 0)) if exits else float("nan"),
+            "median": hist_quantile(hist, 0.5),
+            "engaged_pct": engaged_share(hist, engaged_sec) * 100,
+        }
+
+
+def hist_quantile(hist, q):
+    """Quantile of the stay-duration histogram, interpolated inside the bin."""
+    total = hist.sum()
+    if not total:
+        return float("nan")
+    cum = np.cumsum(hist)
+    i = int(np.searchsorted(cum, q * total))
+    below = cum[i - 1] if i else 0
+    frac = (q * total - below) / hist[i] if hist[i] else 0
+    return float(HIST_EDGES[min(i, N_BINS - 1)] + frac * 0.5)
+
+
+def engaged_share(hist, engaged_sec):
+    """Share of visits lasting at least `engaged_sec` (exact on 0.5 s steps)."""
+    total = hist.sum()
+    if not total:
+        return 0.0
+    return float(hist[hist_bin(engaged_sec):].sum() / total)
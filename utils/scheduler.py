@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class DetectionScheduler:
+    """Decides on which frames the DNN runs; the tracker predicts in between.
+
+    With `adaptive` off the detector runs on every frame. Otherwise the
+    stride grows up to `max_stride` while the scene is quiet and drops back
+    to 1 as soon as a tracked person is within `margin` pixels of the
+    counting polygon's outline or would reach it before the next scheduled
+    detection at their current speed. Tracks that are still initializing
+    also force full rate so Norfair sees enough consecutive hits to confirm
+    them.
+    """
+
+    def __init__(self, adaptive=False, max_stride=5, margin=20):
+        self.adaptive = adaptive
+        self.max_stride = max(1, int(max_stride))
+        self.margin = margin
+        self.stride = 1
+        self.since_detect = 0
+        self.forwards = 0
+        self.skipped = 0
+
+    def should_detect(self):
+        return not self.adaptive or self.since_detect + 1 >= self.stride
+
+    def wake(self):
+        """Force a detection on the next frame, e.g. after the motion gate reopens."""
+        self.since_detect = self.stride
+
+    def mark(self, detected):
+        """Record whether the DNN ran; returns the frame period for Tracker.update."""
+        self.since_detect += 1
+        if not detected:
+            self.skipped += 1
+            return 1
+        self.forwards += 1
+        period, self.since_detect = self.since_detect, 0
+        return period
+
+    def observe(self, tracked_objects, region):
+        """Adjust the stride from how close and how fast tracks approach the region.
+
+        Pass every object the tracker holds (`tracker.tracked_objects`), not
+        just the confirmed ones returned by `Tracker.update`.
+        """
+        if not self.adaptive:
+            return
+        if not tracked_objects:
+            self.stride = self.max_stride
+            return
+        if any(obj.is_initializing for obj in tracked_objects):
+            self.stride = 1
+            return
+        centroids = np.array([obj.estimate[0] for obj in tracked_objects])
+        speeds = np.array([np.linalg.norm(obj.estimate_velocity[0]) for obj in tracked_objects])
+        distances = region.boundary_distance(centroids) - self.margin
+        if (distances <= 0).any():
+            self.stride = 1
+            return
+        frames_to_cross = distances / np.maximum(speeds, 1e-3)
+        self.stride = int(np.clip(frames_to_cross.min() // 2, 1, self.max_stride))
+
+    def summary(self):
+        total = self.forwards + self.skipped
+        return {
+            "frames": total,
+            "forwards": self.forwards,
+            "skipped": self.skipped,
+            "forward_ratio": round(self.forwards / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,195 @@
+import datetime
+import glob
+import math
+import os
+import time
+
+import numpy as np
+
+# Quantile sketch: log-spaced buckets with 2% relative accuracy between
+# MIN_STAY and MAX_STAY seconds, plus one bucket below and one above.
+ALPHA = 0.02
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+MIN_STAY = 0.1
+MAX_STAY = 3 * 3600.0
+DD_BINS = int(math.ceil(math.log(MAX_STAY / MIN_STAY, GAMMA))) + 2
+# Fine histogram: 0.1 s bins up to 30 s plus overflow, exact for engagement thresholds
+HIST_STEP = 0.1
+HIST_BINS = 301
+# Row layout: [count, sum, quantile buckets..., histogram bins...]
+DD_OFFSET = 2
+HIST_OFFSET = DD_OFFSET + DD_BINS
+ROW_SIZE = HIST_OFFSET + HIST_BINS
+
+
+def empty_row():
+    return np.zeros(ROW_SIZE)
+
+
+def add_duration(row, duration):
+    """Add one stay duration (seconds) to a sketch row in place."""
+    row[0] += 1
+    row[1] += duration
+    if duration < MIN_STAY:
+        dd = 0
+    else:
+        dd = min(int(math.ceil(math.log(duration / MIN_STAY, GAMMA))) + 1, DD_BINS - 1)
+    row[DD_OFFSET + dd] += 1
+    row[HIST_OFFSET + min(int(duration / HIST_STEP + 1e-9), HIST_BINS - 1)] += 1
+
+
+def quantile(row, q):
+    """Stay-duration quantile within 2% relative error (NaN when empty)."""
+    counts = row[DD_OFFSET:HIST_OFFSET]
+    total = counts.sum()
+    if not total:
+        return float("nan")
+    i = int(np.searchsorted(np.cumsum(counts), q * total))
+    if i == 0:
+        return MIN_STAY / 2
+    # Midpoint (in relative terms) of bucket i: (gamma^(i-2), gamma^(i-1)] * MIN_STAY
+    return MIN_STAY * 2 * GAMMA ** (i - 1) / (GAMMA + 1)
+
+
+def engaged_share(row, engaged_sec):
+    """Share of visits lasting at least `engaged_sec` (exact on 0.1 s steps)."""
+    hist = row[HIST_OFFSET:]
+    total = hist.sum()
+    if not total:
+        return 0.0
+    return float(hist[min(int(engaged_sec / HIST_STEP + 1e-9), HIST_BINS - 1):].sum() / total)
+
+
+def summarize(row, engaged_sec):
+    count = row[0]
+    return {
+        "visits": int(count),
+        "mean": row[1] / count if count else float("nan"),
+        "median": quantile(row, 0.5),
+        "p90": quantile(row, 0.9),
+        "p95": quantile(row, 0.95),
+        "engaged_pct": engaged_share(row, engaged_sec) * 100,
+    }
+
+
+class SketchWriter:
+    """Feeds closed visits into hourly sketch rows, one file per camera and day.
+
+    Files live in `<directory>/<camera>/<YYYYMMDD>.npy` as a (24, ROW_SIZE)
+    array. Only days touched since the last `flush()` are rewritten, so
+    saving costs the same no matter how much history exists.
+    """
+
+    def __init__(self, directory, camera, flush_interval=5.0):
+        self.directory = os.path.join(directory, camera)
+        self.flush_interval = float(flush_interval)
+        self.days = {}
+        self.dirty = set()
+        self._last_flush = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config, camera):
+        """Build a writer from the optional "sketches" section of config.json."""
+        return cls(camera=camera, **config.get("sketches", {"directory": "utils/data/logs/sketches"}))
+
+    def _day(self, day):
+        rows = self.days.get(day)
+        if rows is None:
+            path = os.path.join(self.directory, f"{day}.npy")
+            rows = np.load(path) if os.path.exists(path) else np.zeros((24, ROW_SIZE))
+            # Only the current day is kept around once it has been saved
+            self.days = {k: v for k, v in self.days.items() if k in self.dirty}
+            self.days[day] = rows
+        return rows
+
+    def add(self, when, duration):
+        day = when.strftime("%Y%m%d")
+        add_duration(self._day(day)[when.hour], duration)
+        self.dirty.add(day)
+
+    def poll(self):
+        """Save touched days if the time threshold has passed."""
+        if self.dirty and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        for day in self.dirty:
+            path = os.path.join(self.directory, f"{day}.npy")
+            tmp = path + ".tmp.npy"
+            np.save(tmp, self.days[day])
+            os.replace(tmp, path)
+        self.dirty.clear()
+
+
+class SketchReader:
+    """Range queries over the hourly sketches of every camera.
+
+    Rows are kept with a running prefix sum per camera, so merging the
+    sketches for any date range is one subtraction of two prefix rows no
+    matter how long the history is. `refresh()` reloads only day files whose
+    modification time changed and recomputes prefixes from that day on.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cameras = {}
+
+    def refresh(self):
+        for cam_dir in sorted(glob.glob(os.path.join(self.directory, "*"))):
+            if not os.path.isdir(cam_dir):
+                continue
+            cam = self.cameras.setdefault(os.path.basename(cam_dir),
+                                          {"days": [], "mtimes": {}, "cum": np.zeros((1, ROW_SIZE))})
+            files = sorted(glob.glob(os.path.join(cam_dir, "[0-9]" * 8 + ".npy")))
+            days = [os.path.basename(f)[:8] for f in files]
+            changed = [d for d, f in zip(days, files) if cam["mtimes"].get(d) != os.path.getmtime(f)]
+            if not changed:
+                continue
+            if cam["days"] and days[0] != cam["days"][0]:
+                # History now starts on another day; rebuild from scratch
+                cam["cum"] = np.zeros((1, ROW_SIZE))
+                changed = days
+            self._rebuild(cam, cam_dir, days, min(changed))
+
+    def _rebuild(self, cam, cam_dir, days, first_changed):
+        # Hourly timeline from the first day, with empty days filled in
+        start = datetime.datetime.strptime(days[0], "%Y%m%d")
+        end = datetime.datetime.strptime(days[-1], "%Y%m%d")
+        n_hours = ((end - start).days + 1) * 24
+        from_hour = (datetime.datetime.strptime(first_changed, "%Y%m%d") - start).days * 24
+        cum = np.zeros((n_hours + 1, ROW_SIZE))
+        keep = min(from_hour + 1, len(cam["cum"]))
+        cum[:keep] = cam["cum"][:keep]
+        cum[keep:from_hour + 1] = cum[keep - 1]
+        rows = np.zeros((n_hours - from_hour, ROW_SIZE))
+        for day in days:
+            offset = (datetime.datetime.strptime(day, "%Y%m%d") - start).days * 24 - from_hour
+            if offset < 0:
+                continue
+            path = os.path.join(cam_dir, f"{day}.npy")
+            rows[offset:offset + 24] = np.load(path)
+            cam["mtimes"][day] = os.path.getmtime(path)
+        cum[from_hour + 1:] = cum[from_hour] + np.cumsum(rows, axis=0)
+        cam["days"], cam["cum"], cam["start"] = days, cum, start
+
+    def query(self, start=None, end=None, camera=None):
+        """Merged sketch row for [start, end) across one or all cameras."""
+        total = empty_row()
+        for name, cam in self.cameras.items():
+            if camera is not None and name != camera or not cam["days"]:
+                continue
+            cum, n = cam["cum"], len(cam["cum"]) - 1
+
+            def hour(t, default):
+                if t is None:
+                    return default
+                h = (t - cam["start"]) // datetime.timedelta(hours=1)
+                return int(min(max(h, 0), n))
+
+            total += cum[hour(end, n)] - cum[hour(start, 0)]
+        return total
+
+    def summary(self, engaged_sec, start=None, end=None, camera=None):
+        return summarize(self.query(start, end, camera), engaged_sec)
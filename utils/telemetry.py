@@ -0,0 +1,256 @@
+import argparse
+import csv
+import datetime
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from utils.timing import epoch_ms, format_time
+
+logger = logging.getLogger(__name__)
+
+# One row per detection (track = -1) or tracked estimate (track = id, hits = Norfair hit counter).
+# Boxes are the SSD box of the detection, or of the track's last matched detection.
+ROW_DTYPE = np.dtype([
+    ("time_ms", "<i8"), ("frame", "<i4"), ("track", "<i4"), ("hits", "<i2"),
+    ("cx", "<i2"), ("cy", "<i2"), ("sx", "<i2"), ("sy", "<i2"), ("ex", "<i2"), ("ey", "<i2"),
+    ("conf", "<f4"),
+])
+NO_BOX = (-1, -1, -1, -1)
+
+
+class TelemetryWriter:
+    """Per-frame detections and track estimates written off the counting loop.
+
+    `record()` only copies a few references onto a bounded queue; a
+    background thread turns them into rows and writes compressed `.npz`
+    chunks of up to `chunk_rows` rows or `chunk_seconds` of frames. Only
+    every `sample_every`-th frame is recorded, and when the writer falls
+    behind by `max_pending` frames new frames are dropped (counted in
+    `dropped`) rather than slowing the caller down.
+
+    Chunks are named `<camera>-s<session>-<first time_ms>-<last time_ms>.npz`
+    so readers can pick a run and a time range without opening files; the
+    session is the epoch ms the writer started at, and frame numbers only
+    count up within one session. Set `frame_size` to (W, H) once known; it
+    is stored with each chunk for replays.
+    """
+
+    def __init__(self, directory="utils/data/logs/telemetry", camera="main", chunk_rows=50000,
+                 chunk_seconds=60.0, max_pending=512, sample_every=1):
+        self.directory = directory
+        self.camera = camera
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.chunk_seconds = float(chunk_seconds)
+        self.sample_every = max(1, int(sample_every))
+        self.frames = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.rows_written = 0
+        self.chunks = 0
+        self.frame_size = None
+        self.session = epoch_ms(datetime.datetime.now())
+        self._queue = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._rows = []
+        self._chunk_started = None
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name=f"telemetry-{camera}", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, camera="main", directory=None):
+        """Build a writer from the optional "telemetry" section of config.json."""
+        options = dict(config.get("telemetry", {}))
+        if directory is not None:
+            options["directory"] = directory
+        return cls(camera=camera, **options)
+
+    def record(self, frame_index, captured_at, detections, tracked_objects):
+        """Queue one frame's detections (None on tracker-only frames) and tracked objects."""
+        self.frames += 1
+        if (self.frames - 1) % self.sample_every:
+            return
+        tracks = [(obj.id, obj.hit_counter, obj.estimate[0], obj.last_detection) for obj in tracked_objects]
+        try:
+            self._queue.put_nowait((frame_index, captured_at, detections, tracks))
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                self._add(*item)
+            if self._rows and (len(self._rows) >= self.chunk_rows
+                               or time.monotonic() - self._chunk_started >= self.chunk_seconds):
+                self._write_chunk()
+        self._write_chunk()
+
+    def _add(self, frame_index, captured_at, detections, tracks):
+        if not self._rows:
+            self._chunk_started = time.monotonic()
+        t = epoch_ms(captured_at)
+        for det in detections or ():
+            cx, cy = det.points[0]
+            box = det.data if det.data is not None else NO_BOX
+            self._rows.append((t, frame_index, -1, 0, cx, cy, *box, det.scores[0]))
+        for tid, hits, (cx, cy), last in tracks:
+            box, conf = NO_BOX, -1.0
+            if last is not None:
+                box = last.data if last.data is not None else NO_BOX
+                conf = last.scores[0] if last.scores is not None else -1.0
+            self._rows.append((t, frame_index, tid, hits, cx, cy, *box, conf))
+
+    def _write_chunk(self):
+        if not self._rows:
+            return
+        rows = np.array(self._rows, dtype=ROW_DTYPE)
+        self._rows = []
+        name = f"{self.camera}-s{self.session}-{rows['time_ms'][0]}-{rows['time_ms'][-1]}.npz"
+        path = os.path.join(self.directory, name)
+        tmp = path + ".tmp"
+        extra = {} if self.frame_size is None else {"frame_size": np.array(self.frame_size)}
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, rows=rows, session=np.int64(self.session), **extra)
+        os.replace(tmp, path)
+        self.rows_written += len(rows)
+        self.chunks += 1
+
+    def summary(self):
+        return {
+            "telemetry_frames": self.recorded,
+            "telemetry_dropped": self.dropped,
+            "telemetry_rows": self.rows_written,
+        }
+
+    def close(self):
+        """Write everything still queued and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def parse_chunk_name(path):
+    """(camera, session, first time_ms, last time_ms) of a chunk file name.
+
+    Chunks written before sessions existed have no session part; their
+    session is 0.
+    """
+    name, first, last = os.path.basename(path)[:-4].rsplit("-", 2)
+    camera, _, session = name.rpartition("-s")
+    if camera and session.isdigit():
+        return camera, int(session), int(first), int(last)
+    return name, 0, int(first), int(last)
+
+
+def chunk_files(directory, camera=None, session=None):
+    """(path, session, first time_ms, last time_ms) of every chunk, oldest first."""
+    chunks = []
+    for path in glob.glob(os.path.join(directory, f"{camera or '*'}-*-*.npz")):
+        name, chunk_session, first, last = parse_chunk_name(path)
+        if (camera is None or name == camera) and (session is None or chunk_session == session):
+            chunks.append((path, chunk_session, first, last))
+    return sorted(chunks, key=lambda c: (c[1], c[2]))
+
+
+def chunk_cameras(directory):
+    """Camera names with chunks in `directory`."""
+    return sorted({parse_chunk_name(path)[0] for path in glob.glob(os.path.join(directory, "*-*-*.npz"))})
+
+
+def chunk_sessions(directory, camera=None, start=None, end=None):
+    """Sessions of `camera` with chunks overlapping start <= time_ms < end, oldest first."""
+    start, end = _range_ms(start, end)
+    return sorted({session for _, session, first, last in chunk_files(directory, camera)
+                   if not ((start is not None and last < start) or (end is not None and first >= end))})
+
+
+def _range_ms(start, end):
+    if isinstance(start, datetime.datetime):
+        start = epoch_ms(start)
+    if isinstance(end, datetime.datetime):
+        end = epoch_ms(end)
+    return start, end
+
+
+def read_chunks(directory, camera=None, start=None, end=None, session=None):
+    """Rows with start <= time_ms < end (epoch ms or datetimes) as one structured array.
+
+    Chunks outside the range or of another session are skipped by name;
+    rows come back in the order they were written, session by session.
+    """
+    start, end = _range_ms(start, end)
+    parts = []
+    for path, _, first, last in chunk_files(directory, camera, session):
+        if (start is not None and last < start) or (end is not None and first >= end):
+            continue
+        with np.load(path) as data:
+            rows = data["rows"]
+        if start is not None or end is not None:
+            keep = np.ones(len(rows), dtype=bool)
+            if start is not None:
+                keep &= rows["time_ms"] >= start
+            if end is not None:
+                keep &= rows["time_ms"] < end
+            rows = rows[keep]
+        parts.append(rows)
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=ROW_DTYPE)
+
+
+def chunk_frame_size(directory, camera=None, session=None):
+    """(W, H) of the frames the chunks were recorded on, or None if unknown."""
+    for path, _, _, _ in chunk_files(directory, camera, session):
+        with np.load(path) as data:
+            if "frame_size" in data:
+                return tuple(int(v) for v in data["frame_size"])
+    return None
+
+
+def export_detections_csv(directory, csv_path="utils/data/logs/detections.csv", camera=None):
+    """Write the raw detections out as `detections.csv` rows of (time, sx, sy, ex, ey, conf)."""
+    rows = read_chunks(directory, camera)
+    rows = rows[rows["track"] == -1]
+    times = [format_time(datetime.datetime.fromtimestamp(t / 1000)) for t in rows["time_ms"].tolist()]
+    with open(csv_path, "w", newline="") as f:
+        wr = csv.writer(f)
+        wr.writerows(zip(times, rows["sx"].tolist(), rows["sy"].tolist(), rows["ex"].tolist(),
+                         rows["ey"].tolist(), rows["conf"].astype(float).round(4).tolist()))
+    return len(rows)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[INFO] %(message)s")
+    ap = argparse.ArgumentParser(description="Inspect or export detection telemetry chunks")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("summary", help="rows, chunks, sessions and time span per camera")
+    p.add_argument("directory", nargs="?", default="utils/data/logs/telemetry")
+    p = sub.add_parser("export", help="write raw detections as detections.csv")
+    p.add_argument("directory", nargs="?", default="utils/data/logs/telemetry")
+    p.add_argument("--output", default="utils/data/logs/detections.csv")
+    p.add_argument("--camera", default=None)
+    args = ap.parse_args()
+
+    if args.command == "export":
+        n = export_detections_csv(args.directory, args.output, args.camera)
+        logger.info(f"Exported {n} detections to {args.output}")
+    else:
+        for camera in chunk_cameras(args.directory):
+            t0 = time.perf_counter()
+            rows = read_chunks(args.directory, camera)
+            elapsed = time.perf_counter() - t0
+            detections = int(np.count_nonzero(rows["track"] == -1))
+            span = (rows["time_ms"][-1] - rows["time_ms"][0]) / 1000 if len(rows) else 0.0
+            logger.info(f"{camera}: {len(chunk_files(args.directory, camera))} chunks in "
+                        f"{len(chunk_sessions(args.directory, camera))} sessions, {len(rows)} rows "
+                        f"({detections} detections, {len(rows) - detections} track estimates) "
+                        f"over {span:.1f}s, read in {elapsed * 1000:.1f} ms")
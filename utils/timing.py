@@ -0,0 +1,77 @@
+import datetime
+import time
+
+# Event times keep millisecond resolution; the first 16 characters are still "%Y-%m-%d %H:%M"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def format_time(when):
+    """Local time of an event as text with millisecond resolution."""
+    return when.strftime(TIME_FORMAT)[:-3]
+
+
+def epoch_ms(when):
+    """Unix epoch milliseconds of a (local, naive) datetime, truncated like `format_time`."""
+    return int(when.replace(microsecond=0).timestamp()) * 1000 + when.microsecond // 1000
+
+
+class WallClock:
+    """Clock for frames processed as they arrive: the current time."""
+
+    def wall(self, frame_index):
+        return datetime.datetime.now()
+
+    def mono(self, frame_index):
+        return time.monotonic()
+
+    __call__ = wall
+
+
+class VideoClock:
+    """Clock of a recording: frame index / fps after its wall-clock start."""
+
+    def __init__(self, start, feed_fps):
+        self.start = start
+        self.feed_fps = feed_fps
+
+    def wall(self, frame_index):
+        return self.start + datetime.timedelta(seconds=frame_index / self.feed_fps)
+
+    def mono(self, frame_index):
+        return frame_index / self.feed_fps
+
+    __call__ = wall
+
+
+class FrameClock:
+    """Capture times of recent frames, looked up by frame index.
+
+    Each frame is stamped with the wall-clock time used for event stamps and
+    a monotonic time used for durations, so dwell times come from when the
+    frames were captured rather than from how many frames were processed.
+    The last `size` frames are remembered in a ring; unknown indices fall
+    back to the newest stamp.
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self._ring = [None] * size
+        self._last = None
+
+    def stamp(self, frame_index, captured_at, captured_mono):
+        self._last = (frame_index, captured_at, captured_mono)
+        self._ring[frame_index % self.size] = self._last
+
+    def _entry(self, frame_index):
+        entry = self._ring[frame_index % self.size]
+        if entry is not None and entry[0] == frame_index:
+            return entry
+        return self._last or (frame_index, datetime.datetime.now(), time.monotonic())
+
+    def wall(self, frame_index):
+        return self._entry(frame_index)[1]
+
+    def mono(self, frame_index):
+        return self._entry(frame_index)[2]
+
+    __call__ = wall